@@ -0,0 +1,214 @@
+"""Spreads subscription allocations across several RHSM accounts.
+
+A manifest category, or the global settings, may list several accounts instead of a single
+`offline_token`:
+
+    accounts:
+      - name: "primary"
+        offline_token: "..."
+      - name: "secondary"
+        offline_token: "..."
+
+A category's own `offline_token` takes precedence over the global `accounts`, so such a category
+always uses that one account. Accounts may also be listed as bare offline tokens, in which case
+they are named after a digest of the token. Each new Manifester instance is assigned the account
+with the least load, judged by the remaining capacity of the requested subscriptions, the number of
+rate limited (429) responses received recently and the number of manifests currently being
+generated from the account. A manifest counts as being generated from the moment its allocation is
+created until its manifest is downloaded, its allocation is deleted or a step fails. The name of
+the account is recorded in the inventory with each allocation.
+"""
+from collections import deque
+import hashlib
+import math
+import threading
+import time
+
+from manifester.logger import _logger as logger
+from manifester.settings import settings
+
+# Seconds for which rate limited responses and observed pool capacity count towards account load
+RATE_LIMIT_WINDOW = 300
+CAPACITY_TTL = 600
+# Number of in-flight manifests that one recent rate limited response is worth
+RATE_LIMIT_WEIGHT = 2
+
+
+class Account:
+    """An RHSM account that allocations can be created in."""
+
+    def __init__(self, offline_token, name=None):
+        self.offline_token = offline_token
+        self.fingerprint = hashlib.sha256(str(offline_token).encode()).hexdigest()[:12]
+        self.name = name or f"account-{self.fingerprint}"
+
+    @classmethod
+    def from_setting(cls, entry):
+        """Create an account from an entry of an `accounts` setting."""
+        if isinstance(entry, str):
+            return cls(entry)
+        return cls(entry["offline_token"], name=entry.get("name"))
+
+    def __repr__(self):
+        """Return a string representation of the account that does not include its token."""
+        return f"Account(name={self.name!r})"
+
+
+def category_accounts(manifest_data):
+    """Return the accounts that allocations of a manifest category are created in, if any.
+
+    A category's own `accounts` come first, then its own `offline_token`, so that a category
+    dedicated to one account is not spread across the global `accounts`. Returns an empty list
+    if no accounts are listed, in which case the offline token is used without an account.
+    """
+    entries = manifest_data.get("accounts")
+    if not entries and manifest_data.get("offline_token"):
+        entries = [manifest_data["offline_token"]] if settings.get("accounts") else []
+    elif not entries:
+        entries = settings.get("accounts") or []
+    return [Account.from_setting(entry) for entry in entries]
+
+
+def configured_accounts():
+    """Return every account listed in the global settings and in the manifest categories.
+
+    Once any accounts are listed, the offline tokens that categories without their own accounts
+    create allocations with are included too.
+    """
+    categories = list((settings.get("manifest_category") or {}).values())
+    entries = list(settings.get("accounts") or [])
+    for category in categories:
+        entries.extend(category.get("accounts") or [])
+    if entries:
+        entries.extend(
+            category["offline_token"]
+            for category in categories
+            if not category.get("accounts") and category.get("offline_token")
+        )
+        uses_global_token = not settings.get("accounts") and any(
+            not category.get("accounts") and not category.get("offline_token")
+            for category in categories
+        )
+        if uses_global_token and settings.get("offline_token"):
+            entries.append(settings.get("offline_token"))
+    accounts = {}
+    for entry in entries:
+        account = Account.from_setting(entry)
+        accounts.setdefault(account.name, account)
+    return list(accounts.values())
+
+
+def find_account(name):
+    """Return the configured account with the given name, or None if there is no such account."""
+    return next((account for account in configured_accounts() if account.name == name), None)
+
+
+class _AccountLoad:
+    def __init__(self):
+        self.in_flight = 0
+        self.assigned = 0
+        self.rate_limited = deque()
+        self.capacity = {}
+
+
+class AccountSelector:
+    """Tracks the load on each account and assigns new allocations to the least loaded one."""
+
+    def __init__(self):
+        self._loads = {}
+        self._lock = threading.Lock()
+
+    def _load(self, account):
+        return self._loads.setdefault(account.fingerprint, _AccountLoad())
+
+    def _score(self, load, subscription_data, now):
+        while load.rate_limited and now - load.rate_limited[0] > RATE_LIMIT_WINDOW:
+            load.rate_limited.popleft()
+        insufficient = False
+        for sub in subscription_data or []:
+            remaining, observed_at = load.capacity.get(sub["name"], (math.inf, now))
+            if now - observed_at <= CAPACITY_TTL and remaining <= sub["quantity"]:
+                insufficient = True
+        busy = load.in_flight + RATE_LIMIT_WEIGHT * len(load.rate_limited)
+        return (insufficient, busy, load.assigned)
+
+    def select(self, accounts, subscription_data=None):
+        """Assign the least loaded account to a new allocation."""
+        now = time.monotonic()
+        with self._lock:
+            account = min(
+                accounts, key=lambda acc: self._score(self._load(acc), subscription_data, now)
+            )
+            self._load(account).assigned += 1
+        logger.debug("Assigned account %s to a new allocation.", account.name)
+        return account
+
+    def acquire(self, account):
+        """Count a manifest being generated from the account as in flight."""
+        with self._lock:
+            self._load(account).in_flight += 1
+
+    def in_flight(self, account):
+        """Return the number of manifests being generated from the account."""
+        with self._lock:
+            return self._load(account).in_flight
+
+    def release(self, account):
+        """Stop counting an allocation of the account as in flight."""
+        with self._lock:
+            load = self._load(account)
+            load.in_flight = max(load.in_flight - 1, 0)
+
+    def record_rate_limit(self, account):
+        """Count a rate limited response received from the account."""
+        with self._lock:
+            self._load(account).rate_limited.append(time.monotonic())
+
+    def record_capacity(self, account, subscription_name, remaining):
+        """Record the entitlements of a subscription last seen to be available in the account."""
+        if remaining is not None and remaining < 0:
+            # Pools with unlimited entitlements report -1 available
+            remaining = math.inf
+        with self._lock:
+            self._load(account).capacity[subscription_name] = (remaining, time.monotonic())
+
+    def clear(self):
+        """Forget the load recorded for every account."""
+        with self._lock:
+            self._loads.clear()
+
+
+ACCOUNT_SELECTOR = AccountSelector()
+
+
+class AccountRequester:
+    """Sends requests with another requester and reports rate limited responses for an account."""
+
+    RATE_LIMITED = 429
+
+    def __init__(self, requester, account, selector=ACCOUNT_SELECTOR):
+        self.requester = requester
+        self.account = account
+        self.selector = selector
+
+    def _send(self, method, *args, **kwargs):
+        response = getattr(self.requester, method)(*args, **kwargs)
+        if response.status_code == self.RATE_LIMITED:
+            self.selector.record_rate_limit(self.account)
+        return response
+
+    def get(self, *args, **kwargs):
+        """Send a GET request."""
+        return self._send("get", *args, **kwargs)
+
+    def post(self, *args, **kwargs):
+        """Send a POST request."""
+        return self._send("post", *args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        """Send a PUT request."""
+        return self._send("put", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Send a DELETE request."""
+        return self._send("delete", *args, **kwargs)
@@ -0,0 +1,200 @@
+"""Measures connectivity to the RHSM API and the latency of the read-only calls Manifester makes.
+
+Each configured endpoint is probed with a raw socket so that DNS resolution, the TCP connection,
+the proxy tunnel, the TLS handshake and the time to the first response byte are timed separately.
+The read-only API calls are then sent through Manifester's own code paths, so that retries and
+pagination are included in their timings. Every measurement is repeated and reported as
+percentiles in milliseconds.
+"""
+import base64
+import math
+import socket
+import ssl
+import time
+from urllib.parse import unquote, urlsplit
+
+from manifester.helpers import fetch_paginated_data
+from manifester.logger import _logger as logger
+
+PERCENTILES = (50, 95, 99)
+PROBE_TIMEOUT = 10
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class ProbeError(Exception):
+    """Raised when an endpoint cannot be reached, for example because a proxy refused a tunnel."""
+
+
+def percentiles(samples, points=PERCENTILES):
+    """Return the given percentiles of a list of samples, interpolating between closest ranks."""
+    ordered = sorted(samples)
+    if not ordered:
+        return dict.fromkeys(points)
+    results = {}
+    for point in points:
+        rank = (len(ordered) - 1) * point / 100
+        lower, upper = math.floor(rank), math.ceil(rank)
+        results[point] = ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+    return results
+
+
+def _proxy_for(url, proxies):
+    """Return the parsed proxy URL that requests would use for a URL, or None."""
+    proxy = (proxies or {}).get(urlsplit(url).scheme)
+    return urlsplit(proxy) if proxy else None
+
+
+def _read_head(sock):
+    """Read a response up to the end of its headers and return the status line."""
+    data = b""
+    while b"\r\n\r\n" not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data.split(b"\r\n", 1)[0].decode("latin-1")
+
+
+def probe_url(url, proxies=None, timeout=PROBE_TIMEOUT):
+    """Time the phases of a single GET request to a URL.
+
+    :return: dict of seconds spent on dns, tcp, proxy (tunnel setup), tls, ttfb and total; phases
+        that do not apply, such as tls for plain HTTP, are None
+    """
+    target = urlsplit(url)
+    proxy = _proxy_for(url, proxies)
+    connect_to = proxy or target
+    timings = dict.fromkeys(("dns", "tcp", "proxy", "tls", "ttfb", "total"))
+    started = time.perf_counter()
+    addrinfo = socket.getaddrinfo(
+        connect_to.hostname,
+        connect_to.port or DEFAULT_PORTS[connect_to.scheme],
+        type=socket.SOCK_STREAM,
+    )
+    timings["dns"] = time.perf_counter() - started
+    family, socktype, proto, _, address = addrinfo[0]
+    sock = socket.socket(family, socktype, proto)
+    sock.settimeout(timeout)
+    try:
+        mark = time.perf_counter()
+        sock.connect(address)
+        timings["tcp"] = time.perf_counter() - mark
+        target_address = f"{target.hostname}:{target.port or DEFAULT_PORTS[target.scheme]}"
+        proxy_auth = ""
+        if proxy and proxy.username:
+            credentials = f"{unquote(proxy.username)}:{unquote(proxy.password or '')}"
+            proxy_auth = (
+                f"Proxy-Authorization: Basic {base64.b64encode(credentials.encode()).decode()}\r\n"
+            )
+        if proxy and target.scheme == "https":
+            mark = time.perf_counter()
+            sock.sendall(
+                f"CONNECT {target_address} HTTP/1.1\r\nHost: {target_address}\r\n"
+                f"{proxy_auth}\r\n".encode()
+            )
+            status_line = _read_head(sock)
+            if " 200 " not in f"{status_line} ":
+                raise ProbeError(f"Proxy refused tunnel to {target_address}: {status_line}")
+            timings["proxy"] = time.perf_counter() - mark
+        if target.scheme == "https":
+            mark = time.perf_counter()
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=target.hostname)
+            timings["tls"] = time.perf_counter() - mark
+        # Plain HTTP requests through a proxy name the absolute URL instead of tunneling
+        if proxy and target.scheme == "http":
+            path = url
+        else:
+            path = (target.path or "/") + (f"?{target.query}" if target.query else "")
+            proxy_auth = ""
+        mark = time.perf_counter()
+        sock.sendall(
+            f"GET {path} HTTP/1.1\r\nHost: {target_address}\r\nUser-Agent: manifester-bench\r\n"
+            f"{proxy_auth}Connection: close\r\n\r\n".encode()
+        )
+        if not sock.recv(1):
+            raise ProbeError(f"{url} closed the connection without responding")
+        timings["ttfb"] = time.perf_counter() - mark
+        # The rest of the response is drained so that the server is not sent a connection reset
+        while sock.recv(65536):
+            pass
+    finally:
+        sock.close()
+    timings["total"] = time.perf_counter() - started
+    return timings
+
+
+def _time_call(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def _token_call(manifester):
+    manifester._access_token = None
+    return manifester.access_token
+
+
+def _versions_call(manifester):
+    # valid_sat_versions is a cached property, so the cached value is dropped before each sample
+    manifester.__dict__.pop("valid_sat_versions", None)
+    return manifester.valid_sat_versions
+
+
+def _allocations_call(manifester):
+    manifester._allocations = None
+    return fetch_paginated_data(manifester, "allocations")
+
+
+API_CALLS = {
+    "token": _token_call,
+    "versions": _versions_call,
+    "allocations": _allocations_call,
+}
+
+
+def run_bench(manifester, samples=10, proxies=None):
+    """Probe the RHSM endpoints of a Manifester instance and time its read-only API calls.
+
+    The instance should disable the metadata cache (metadata_cache_ttl=0) so that the versions
+    call reaches the API.
+
+    :return: dict with a "probes" entry of phase percentiles per endpoint URL, an "api" entry of
+        percentiles per API call, and the number of samples
+    """
+    report = {"samples": samples, "probes": {}, "api": {}}
+    for name, url in (
+        ("token_request", manifester.token_request_url),
+        ("allocations", manifester.allocations_url),
+    ):
+        phases = {}
+        for _ in range(samples):
+            for phase, seconds in probe_url(url, proxies=proxies).items():
+                if seconds is not None:
+                    phases.setdefault(phase, []).append(seconds)
+        report["probes"][name] = {
+            "url": url,
+            "phases": {phase: percentiles(values) for phase, values in phases.items()},
+        }
+        logger.debug("Probed %s %s times.", url, samples)
+    for name, call in API_CALLS.items():
+        durations = [_time_call(lambda call=call: call(manifester)) for _ in range(samples)]
+        report["api"][name] = percentiles(durations)
+        logger.debug("Timed %s API call %s times.", name, samples)
+    return report
+
+
+def format_report(report):
+    """Return the lines of a human readable table of a bench report, in milliseconds."""
+    header = f"{'':<26}" + "".join(f"{f'p{point}':>10}" for point in PERCENTILES)
+    lines = [f"{report['samples']} samples, times in ms", header]
+
+    def row(label, values):
+        cells = "".join(f"{values[point] * 1000:>10.1f}" for point in PERCENTILES)
+        return f"{label:<26}{cells}"
+
+    for name, probe in report["probes"].items():
+        lines.append(f"{name} ({probe['url']})")
+        lines.extend(row(f"  {phase}", values) for phase, values in probe["phases"].items())
+    lines.append("api calls")
+    lines.extend(row(f"  {name}", values) for name, values in report["api"].items())
+    return lines
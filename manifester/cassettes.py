@@ -0,0 +1,241 @@
+"""Records RHSM API traffic to cassette files and replays it without network access.
+
+A cassette is a JSON file holding the request/response exchanges of a Manifester run in the order
+they were sent, together with the time that each response took to arrive. Secrets (the offline
+token, access tokens and authorization headers) are scrubbed before the cassette is written.
+
+Both requesters can be passed to Manifester with the `requester` argument:
+
+    recorder = RecordingRequester("golden_ticket.json")
+    Manifester(manifest_category="golden_ticket", requester=recorder).get_manifest()
+    recorder.save()
+
+    replayer = ReplayRequester("golden_ticket.json", speed=1.0)
+    Manifester(manifest_category="golden_ticket", requester=replayer).get_manifest()
+
+Replayed requests are matched to recorded ones by method, URL and query parameters, and repeated
+requests are answered with the recorded responses in order. Replaying at a speed of 1.0 reproduces
+the recorded latency of every response, other speeds scale it, and no speed replays instantly.
+"""
+import base64
+from collections import defaultdict, deque
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from manifester.helpers import UTC
+from manifester.logger import _logger as logger
+
+CASSETTE_VERSION = 1
+SCRUBBED = "<scrubbed>"
+# Request and response fields that hold credentials
+SECRET_HEADERS = ("Authorization", "Cookie", "Set-Cookie")
+SECRET_FIELDS = ("access_token", "id_token", "refresh_token")
+# Query parameters that differ between runs, such as randomly generated allocation names
+VOLATILE_PARAMS = ("name",)
+# Response headers that describe the recorded transfer rather than the replayed content
+DROPPED_HEADERS = ("Content-Encoding", "Content-Length", "Transfer-Encoding")
+
+
+class CassetteError(Exception):
+    """Raised when a replayed request was not recorded in the cassette."""
+
+
+def _request_key(method, url, params):
+    params = sorted(
+        (str(key), str(value))
+        for key, value in (params or {}).items()
+        if key not in VOLATILE_PARAMS
+    )
+    return f"{method.upper()} {url} {json.dumps(params)}"
+
+
+def _scrub(data):
+    if not isinstance(data, dict):
+        return data
+    return {key: SCRUBBED if key in SECRET_FIELDS else _scrub(value) for key, value in data.items()}
+
+
+def _encode_body(content, content_type):
+    """Store JSON bodies as scrubbed JSON, other text as text and binary content as base64."""
+    if not content:
+        return {"text": ""}
+    if "json" in content_type:
+        try:
+            return {"json": _scrub(json.loads(content))}
+        except ValueError:
+            pass
+    try:
+        return {"text": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(body):
+    if "json" in body:
+        return json.dumps(body["json"]).encode("utf-8")
+    if "base64" in body:
+        return base64.b64decode(body["base64"])
+    return body["text"].encode("utf-8")
+
+
+class RecordingRequester:
+    """Sends requests with a real requester and records every exchange for a cassette.
+
+    :param path: location of the cassette file written by save()
+    :param requester: module or object used to send requests, the requests module by default
+    """
+
+    # Responses are real requests responses, so Manifester must not treat this as a mock
+    is_mock = False
+    # Responses served from the metadata cache would be missing from the cassette
+    use_metadata_cache = False
+
+    def __init__(self, path, requester=None):
+        self.path = Path(path)
+        self.requester = requests if requester is None else requester
+        self.interactions = []
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _send(self, method, url, **kwargs):
+        started = time.monotonic()
+        interaction = {
+            "offset": round(started - self._start, 6),
+            "request": {
+                "method": method.upper(),
+                "url": url,
+                "params": {key: str(value) for key, value in (kwargs.get("params") or {}).items()},
+            },
+        }
+        try:
+            response = getattr(self.requester, method)(url, **kwargs)
+        except requests.exceptions.RequestException as err:
+            interaction["elapsed"] = round(time.monotonic() - started, 6)
+            interaction["error"] = {"type": type(err).__name__, "message": str(err)}
+            self._record(interaction)
+            raise
+        interaction["elapsed"] = round(time.monotonic() - started, 6)
+        headers = {
+            key: SCRUBBED if key in SECRET_HEADERS else value
+            for key, value in response.headers.items()
+            if key not in DROPPED_HEADERS
+        }
+        interaction["response"] = {
+            "status_code": response.status_code,
+            "headers": headers,
+            "body": _encode_body(response.content, headers.get("Content-Type", "")),
+        }
+        self._record(interaction)
+        return response
+
+    def _record(self, interaction):
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def get(self, url, **kwargs):
+        """Send and record a GET request."""
+        return self._send("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Send and record a POST request."""
+        return self._send("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """Send and record a PUT request."""
+        return self._send("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """Send and record a DELETE request."""
+        return self._send("delete", url, **kwargs)
+
+    def save(self, path=None):
+        """Write the recorded exchanges to the cassette file, replacing it atomically."""
+        path = Path(path) if path else self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            cassette = {
+                "version": CASSETTE_VERSION,
+                "recorded_at": datetime.now(UTC).isoformat(),
+                "interactions": sorted(self.interactions, key=lambda i: i["offset"]),
+            }
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(cassette, indent=1))
+        tmp_path.replace(path)
+        logger.info("Recorded %s requests to cassette %s", len(cassette["interactions"]), path)
+        return path
+
+
+class ReplayRequester:
+    """Answers requests with the responses recorded in a cassette.
+
+    :param path: location of the cassette file
+    :param speed: factor by which recorded latency is divided, or None to replay instantly
+    """
+
+    is_mock = False
+    # Requests answered from the metadata cache would leave recorded responses unused
+    use_metadata_cache = False
+
+    def __init__(self, path, speed=None):
+        self.path = Path(path)
+        self.speed = speed
+        cassette = json.loads(self.path.read_text())
+        if cassette.get("version") != CASSETTE_VERSION:
+            raise CassetteError(f"Unsupported cassette version {cassette.get('version')}")
+        self._queues = defaultdict(deque)
+        for interaction in cassette["interactions"]:
+            request = interaction["request"]
+            key = _request_key(request["method"], request["url"], request["params"])
+            self._queues[key].append(interaction)
+        self._lock = threading.Lock()
+
+    def _next_interaction(self, key):
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteError(f"No recorded response for request {key}")
+            # The last recorded response keeps answering requests repeated more than recorded
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def _send(self, method, url, **kwargs):
+        interaction = self._next_interaction(_request_key(method, url, kwargs.get("params")))
+        if self.speed:
+            time.sleep(interaction["elapsed"] / self.speed)
+        if "error" in interaction:
+            error = interaction["error"]
+            exception_class = getattr(
+                requests.exceptions, error["type"], requests.exceptions.RequestException
+            )
+            raise exception_class(error["message"])
+        recorded = interaction["response"]
+        response = requests.Response()
+        response.status_code = recorded["status_code"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = _decode_body(recorded["body"])
+        response.encoding = "utf-8"
+        response.url = url
+        response.reason = "Replayed"
+        return response
+
+    def get(self, url, **kwargs):
+        """Replay a GET request."""
+        return self._send("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Replay a POST request."""
+        return self._send("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """Replay a PUT request."""
+        return self._send("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """Replay a DELETE request."""
+        return self._send("delete", url, **kwargs)
@@ -1,19 +1,48 @@
 """Defines the CLI commands for Manifester."""
+from datetime import timedelta
+import json
 import os
 from pathlib import Path
+import zipfile
 
 import click
 
-from manifester import Manifester, helpers
+from manifester import Manifester, helpers, profiling, tracing
+from manifester.accounts import configured_accounts, find_account
+from manifester.bench import format_report, run_bench
+from manifester.cassettes import RecordingRequester, ReplayRequester
+from manifester.inspection import ManifestIndex, matching_categories, with_recorded_version
+from manifester.journal import JournalInUse, load_journals
+from manifester.loadtest import format_report as format_load_report, run_load_test
 from manifester.logger import _logger as logger
+from manifester.scheduling import PRIORITIES
 from manifester.settings import settings
+from manifester.stub import RhsmStubServer
 
 
 # To do: add a command for returning subscription pools
-@click.group
-def cli():
+@click.group()
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    envvar="MANIFESTER_PROFILE",
+    help="Write cProfile statistics, phase timings and peak memory next to the log file",
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Write the phases of manifest generation to this file as a Chrome trace",
+)
+@click.pass_context
+def cli(ctx, profile, trace_file):
     """Command-line interface for manifester."""
-    pass
+    if profile:
+        ctx.with_resource(profiling.profile(ctx.invoked_subcommand))
+    if trace_file:
+        tracing.start(trace_file)
+        ctx.call_on_close(tracing.stop)
 
 
 @cli.command()
@@ -24,16 +53,60 @@ def cli():
 )
 @click.option("--allocation-name", type=str, help="Name of upstream subscription allocation")
 @click.option("--requester", type=str, default=None)
-def get_manifest(manifest_category, allocation_name, requester):
+@click.option(
+    "--record-cassette",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Record the RHSM API requests and responses of this run to a cassette file",
+)
+@click.option(
+    "--replay-cassette",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    help="Answer RHSM API requests with the responses recorded in a cassette file",
+)
+@click.option(
+    "--replay-speed",
+    type=float,
+    default=None,
+    help="Replay recorded latency divided by this factor (1.0 for recorded speed)",
+)
+@click.option(
+    "--bypass-cache",
+    is_flag=True,
+    default=False,
+    help="Fetch RHSM API metadata, such as valid Satellite versions, instead of using the cache",
+)
+@click.option(
+    "--priority",
+    type=click.Choice(PRIORITIES),
+    default=None,
+    help="Priority of this manifest's operations when concurrency is limited",
+)
+def get_manifest(
+    *,
+    manifest_category,
+    allocation_name,
+    requester,
+    record_cassette,
+    replay_cassette,
+    replay_speed,
+    bypass_cache,
+    priority,
+):
     """Return a subscription manifester based on the settings for the provided manifest_category."""
-    manifester = Manifester(manifest_category, allocation_name, requester=requester)
-    manifester.create_subscription_allocation()
-    for sub in manifester.subscription_data:
-        manifester.process_subscription_pools(
-            subscription_pools=manifester.subscription_pools,
-            subscription_data=sub,
-        )
-    return manifester.trigger_manifest_export()
+    if record_cassette:
+        requester = RecordingRequester(record_cassette)
+    elif replay_cassette:
+        requester = ReplayRequester(replay_cassette, speed=replay_speed)
+    # The flag only enables bypassing, so that the setting still applies when it is not passed
+    kwargs = {"bypass_metadata_cache": True} if bypass_cache else {}
+    if priority:
+        kwargs["priority"] = priority
+    manifester = Manifester(manifest_category, allocation_name, requester=requester, **kwargs)
+    try:
+        return manifester.get_manifest()
+    finally:
+        if record_cassette:
+            requester.save()
 
 
 @cli.command()
@@ -57,8 +130,14 @@ def delete(allocations, all_, remove_manifest_file, offline_token):
     inv = helpers.load_inventory_file(Path(settings.inventory_path))
     for num, allocation in enumerate(inv):
         if str(num) in allocations or allocation.get("name") in allocations or all_:
+            # Allocations are deleted from the account recorded in the inventory, if any
+            account = (
+                find_account(allocation["account"])
+                if offline_token is None and allocation.get("account")
+                else None
+            )
             Manifester(
-                minimal_init=True, offline_token=offline_token
+                minimal_init=True, offline_token=offline_token, account=account
             ).delete_subscription_allocation(uuid=allocation.get("uuid"))
             if remove_manifest_file:
                 manifester_directory = (
@@ -71,20 +150,115 @@ def delete(allocations, all_, remove_manifest_file, offline_token):
                 ).unlink()
 
 
+@cli.command()
+@click.argument("allocations", type=str, nargs=-1)
+@click.option(
+    "--manifest-category",
+    type=str,
+    default=None,
+    help="Category of manifests whose journal does not name one",
+)
+@click.option("--list", "list_", is_flag=True, default=False, help="Only list unfinished manifests")
+def resume(allocations, manifest_category, list_):
+    """Continue generating unfinished manifests from their journals.
+
+    Resumes the named allocations, or every allocation with a journal if none are named.
+    """
+    journals = load_journals(allocations)
+    if not journals:
+        click.echo("No unfinished manifests found.")
+        return
+    for journal in journals:
+        entry = journal.entry
+        if list_:
+            click.echo(f"{entry['name']} ({entry['uuid']}): {journal.step}")
+            continue
+        if journal.in_progress():
+            click.echo(f"{entry['name']} is still being generated by process {entry['pid']}.")
+            continue
+        category = entry.get("manifest_category") or manifest_category
+        if category is None:
+            raise click.UsageError(
+                f"The journal of {entry['name']} names no manifest category. "
+                "Pass --manifest-category."
+            )
+        account = find_account(entry["account"]) if entry.get("account") else None
+        try:
+            manifest = Manifester(category, entry["name"], account=account).resume_manifest()
+        except JournalInUse:
+            click.echo(f"{entry['name']} is still being generated by another process.")
+            continue
+        click.echo(f"{entry['name']}: {manifest.path}")
+
+
+def _account_manifesters(offline_token=None, **kwargs):
+    """Return a Manifester instance for each configured account, or one for the offline token.
+
+    Commands that act on existing allocations cover every account listed in the settings, unless
+    an offline token is passed.
+    """
+    accounts = configured_accounts() if offline_token is None else []
+    if not accounts:
+        return [Manifester(minimal_init=True, offline_token=offline_token, **kwargs)]
+    return [Manifester(minimal_init=True, account=account, **kwargs) for account in accounts]
+
+
 @cli.command()
 @click.option("--details", is_flag=True, help="Display full inventory details")
 @click.option("--sync", is_flag=True, help="Fetch inventory data from RHSM before displaying")
+@click.option(
+    "--hydrate",
+    is_flag=True,
+    help="Sync the inventory, then fetch and display the entitlements attached to each allocation",
+)
+@click.option(
+    "--max-workers",
+    type=int,
+    default=helpers.DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Maximum number of concurrent requests used by --hydrate",
+)
 @click.option("--offline-token", type=str, default=None)
-def inventory(details, sync, offline_token):
+def inventory(details, sync, hydrate, max_workers, offline_token):
     """Display the local inventory file's contents."""
     border = "-" * 38
-    if sync:
-        helpers.update_inventory(
-            Manifester(minimal_init=True, offline_token=offline_token).subscription_allocations,
-            sync=True,
-        )
+    if sync or hydrate:
+        manifesters = _account_manifesters(offline_token)
+        # Cached entitlements are only valid while the inventory's lastModified values are current
+        with profiling.phase("sync"):
+            allocations = [
+                allocation
+                for manifester in manifesters
+                for allocation in manifester.subscription_allocations
+            ]
+            helpers.update_inventory(allocations, sync=True)
     inv = helpers.load_inventory_file(Path(settings.inventory_path))
-    if not details:
+    if hydrate:
+        logger.info("Displaying local inventory data with attached entitlements")
+        with profiling.phase("hydrate"):
+            # Rows are written as soon as each allocation's entitlements arrive
+            for num, allocation, entitlements in helpers.hydrate_allocations(
+                manifesters[0],
+                inv,
+                max_workers=max_workers,
+                account_manifesters={m.account.name: m for m in manifesters if m.account},
+            ):
+                click.echo(f"{num}:")
+                if details:
+                    for key, value in allocation.items():
+                        click.echo(f"{'':<4}{key}: {value}")
+                else:
+                    click.echo(f"{'':<4}name: {allocation['name']}")
+                if entitlements is None:
+                    click.echo(f"{'':<4}entitlements: unavailable")
+                    continue
+                click.echo(f"{'':<4}entitlements:")
+                for entitlement in entitlements:
+                    click.echo(
+                        f"{'':<8}{entitlement.get('subscriptionName')}: "
+                        f"{entitlement.get('entitlementQuantity')}"
+                    )
+    elif not details:
         logger.info("Displaying local inventory data")
         click.echo(border)
         click.echo(f"| {'Index'} | {'Allocation Name':<26} |")
@@ -98,3 +272,255 @@ def inventory(details, sync, offline_token):
             click.echo(f"{num}:")
             for key, value in allocation.items():
                 click.echo(f"{'':<4}{key}: {value}")
+
+
+@cli.command()
+@click.option(
+    "--max-age",
+    type=float,
+    default=None,
+    help="Reap allocations created more than this many hours ago",
+)
+@click.option(
+    "--untracked",
+    is_flag=True,
+    default=False,
+    help="Reap allocations that are missing from the local inventory",
+)
+@click.option("--dry-run", is_flag=True, default=False, help="Report stale allocations only")
+@click.option(
+    "--max-workers",
+    type=int,
+    default=helpers.DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Maximum number of concurrent deletion requests",
+)
+@click.option(
+    "--rate",
+    type=float,
+    default=2,
+    show_default=True,
+    help="Maximum number of deletion requests per second",
+)
+@click.option(
+    "--priority",
+    type=click.Choice(PRIORITIES),
+    default="background",
+    show_default=True,
+    help="Priority of the deletions when concurrency is limited",
+)
+@click.option("--offline-token", type=str, default=None)
+def reap(*, max_age, untracked, dry_run, max_workers, rate, priority, offline_token):
+    """Delete leaked subscription allocations matching the configured username_prefix."""
+    max_age = max_age if max_age is not None else settings.get("reaper_max_age")
+    if max_age is None and not untracked:
+        raise click.UsageError("Provide --max-age, --untracked, or the reaper_max_age setting.")
+    report = []
+    for manifester in _account_manifesters(offline_token, priority=priority):
+        report.extend(
+            helpers.reap_allocations(
+                manifester,
+                max_age=timedelta(hours=max_age) if max_age is not None else None,
+                untracked=untracked,
+                dry_run=dry_run,
+                max_workers=max_workers,
+                rate=rate,
+            )
+        )
+    logger.info(f"Found {len(report)} stale allocations")
+    for entry in report:
+        status = "dry run" if dry_run else entry["status"]
+        click.echo(f"{entry['name']} ({entry['uuid']}): {entry['reason']} [{status}]")
+
+
+@cli.command()
+@click.argument("manifest_files", type=click.Path(exists=True, dir_okay=False), nargs=-1)
+@click.option(
+    "--manifest-category",
+    type=str,
+    default=None,
+    help="Only display manifests that match this manifest category",
+)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Display output as JSON")
+def inspect(manifest_files, manifest_category, as_json):
+    """Display the contents of local manifest files without extracting them.
+
+    Inspects every manifest in the manifests directory if no files are provided.
+    """
+    if not manifest_files:
+        manifester_directory = (
+            Path(os.environ["MANIFESTER_DIRECTORY"]).resolve()
+            if "MANIFESTER_DIRECTORY" in os.environ
+            else Path()
+        )
+        manifest_files = sorted(manifester_directory.joinpath("manifests").glob("*.zip"))
+    categories = settings.get("manifest_category") or {}
+    inv = helpers.load_inventory_file(Path(settings.inventory_path))
+    index = ManifestIndex()
+    results = {}
+    try:
+        for manifest_file in manifest_files:
+            try:
+                summary = index.inspect(manifest_file)
+            except (OSError, ValueError, KeyError, zipfile.BadZipFile) as err:
+                logger.warning(f"Unable to inspect {manifest_file}: {err}")
+                continue
+            summary = with_recorded_version(summary, inv)
+            summary["categories"] = matching_categories(summary, categories)
+            if manifest_category and manifest_category not in summary["categories"]:
+                continue
+            results[str(manifest_file)] = summary
+    finally:
+        index.save()
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    for manifest_file, summary in results.items():
+        click.echo(f"{manifest_file}:")
+        for key, value in summary.items():
+            if key != "entitlements":
+                click.echo(f"{'':<4}{key}: {value}")
+        click.echo(f"{'':<4}entitlements:")
+        for entitlement in summary["entitlements"]:
+            click.echo(
+                f"{'':<8}{entitlement['subscription_name']}: {entitlement['quantity']} "
+                f"(pool {entitlement['pool_id']})"
+            )
+
+
+@cli.command()
+@click.option(
+    "--manifest-category",
+    "manifest_categories",
+    type=str,
+    multiple=True,
+    help="Manifest category to validate (all categories by default)",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Rebuild the subscription catalog from RHSM instead of using the cached catalog",
+)
+def validate(manifest_categories, refresh):
+    """Check manifest categories against the subscriptions available in their accounts.
+
+    No subscription allocations are created or modified.
+    """
+    manifest_categories = manifest_categories or list(settings.get("manifest_category") or {})
+    failed = False
+    for category in manifest_categories:
+        manifester = Manifester(category, preflight=True)
+        try:
+            problems = manifester.validate_subscription_data(refresh=refresh)
+        finally:
+            manifester._release_account()
+        if problems is None:
+            click.echo(f"{category}: unknown (no allocation in the account to list subscriptions)")
+        elif problems:
+            failed = True
+            click.echo(f"{category}: invalid")
+            for problem in problems:
+                click.echo(f"{'':<4}{problem}")
+        else:
+            click.echo(f"{category}: valid")
+    if failed:
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option(
+    "--samples",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Number of times each endpoint is probed and each API call is timed",
+)
+@click.option(
+    "--stub",
+    is_flag=True,
+    default=False,
+    help="Benchmark a local imitation of the RHSM API instead of the configured URLs",
+)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Display output as JSON")
+@click.option("--offline-token", type=str, default=None)
+def bench(samples, stub, as_json, offline_token):
+    """Measure connection phases and read-only API call latency for the RHSM API.
+
+    Connections are made through the configured proxies. No subscription allocations are created.
+    """
+    if stub:
+        with RhsmStubServer() as server:
+            manifester = Manifester(
+                minimal_init=True,
+                offline_token=server.manifest_category()["offline_token"],
+                proxies={},
+                metadata_cache_ttl=0,
+            )
+            manifester.token_request_url = server.token_url
+            manifester.allocations_url = server.allocations_url
+            report = run_bench(manifester, samples=samples)
+    else:
+        proxies = settings.get("proxies")
+        manifester = Manifester(
+            minimal_init=True, offline_token=offline_token, proxies=proxies, metadata_cache_ttl=0
+        )
+        report = run_bench(manifester, samples=samples, proxies=proxies)
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    for line in format_report(report):
+        click.echo(line)
+
+
+@cli.command()
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Number of concurrent manifest generation and deletion cycles",
+)
+@click.option("--duration", type=float, default=None, help="Seconds after which no cycle starts")
+@click.option("--iterations", type=click.IntRange(min=1), default=None, help="Cycles to run")
+@click.option(
+    "--latency",
+    type=float,
+    default=0,
+    show_default=True,
+    help="Seconds by which the stub RHSM API delays every response",
+)
+@click.option(
+    "--rate-limit",
+    type=click.FloatRange(0, 1),
+    default=0,
+    show_default=True,
+    help="Fraction of stub RHSM API responses that are rate limited (HTTP 429)",
+)
+@click.option(
+    "--adaptive-concurrency",
+    is_flag=True,
+    default=False,
+    help="Limit the requests in flight adaptively and report the limit reached",
+)
+@click.option("--json", "as_json", is_flag=True, default=False, help="Display output as JSON")
+def load_test(*, workers, duration, iterations, latency, rate_limit, adaptive_concurrency, as_json):
+    """Generate and delete manifests concurrently against a local stub of the RHSM API.
+
+    Reports throughput, cycle and phase latency percentiles, retries and memory usage.
+    """
+    if duration is None and iterations is None:
+        raise click.UsageError("Provide --duration, --iterations, or both.")
+    report = run_load_test(
+        workers=workers,
+        duration=duration,
+        iterations=iterations,
+        latency=latency,
+        rate_limit=rate_limit,
+        category={"adaptive_concurrency": True} if adaptive_concurrency else None,
+    )
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+    for line in format_load_report(report):
+        click.echo(line)
@@ -0,0 +1,180 @@
+"""Adapts the number of RHSM API requests in flight to how the API is coping.
+
+A fixed number of concurrent requests is either slower than necessary when the API is quiet or
+causes storms of rate limited (429) responses when it is busy. When the `adaptive_concurrency`
+setting is enabled, requests to the RHSM API from every Manifester instance in the process that use
+the same account wait for one of a limited number of slots, and the limit is adjusted with additive
+increase and multiplicative decrease (AIMD):
+
+- when a request is rate limited, fails with a server error or takes much longer than the recent
+  baseline latency of its endpoint, the limit is multiplied by BACKOFF_FACTOR, at most once per
+  round of requests
+- when a request succeeds promptly while every slot is in use, the limit grows by about one slot
+  per round of requests, up to `adaptive_concurrency_max`
+
+This applies to parallel manifest generation, `reap` deletions, `inventory --hydrate` and the
+paginated listings alike, since they all send their requests through the same limiter. The thread
+pools of those commands set the most requests that can be in flight, and the limiter decides how
+many are. The current limit of each limiter is reported by `limiter_metrics()`.
+
+Baseline latencies are kept per endpoint, grouped as by `hedging.endpoint_key`, so that inherently
+slow requests such as manifest downloads and large pool pages are not mistaken for congestion.
+"""
+import math
+import threading
+import time
+
+from manifester.deadlines import active_deadline
+from manifester.hedging import endpoint_key
+from manifester.logger import _logger as logger
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 32
+BACKOFF_FACTOR = 0.5
+# A response this many times slower than the baseline latency counts as a sign of congestion
+LATENCY_TOLERANCE = 2.0
+# Responses within this many seconds of the baseline latency never count as slow
+LATENCY_SLACK = 0.05
+# Fraction of the difference by which the baseline latency rises towards slower responses
+BASELINE_DRIFT = 0.01
+CONGESTION_CODES = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter:
+    """Limits the requests in flight, adjusting the limit by AIMD from their outcome and latency."""
+
+    def __init__(self, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=DEFAULT_MAX_LIMIT):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.decreases = 0
+        self.baseline_latencies = {}
+        self._last_decrease = -math.inf
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait for a free slot and return the time at which the request started.
+
+        Raises DeadlineExceeded if the active deadline runs out while waiting.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                active = active_deadline()
+                timeout = None if active is None else active.remaining()
+                if timeout is not None and timeout <= 0:
+                    raise active.exceeded()
+                self._condition.wait(timeout)
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.monotonic()
+
+    def release(self, started, congested=False, endpoint=None):
+        """Free the slot of a request that started at started, and adjust the limit.
+
+        :param endpoint: endpoint of the request, whose latency is compared with earlier requests
+            to the same endpoint
+        """
+        latency = time.monotonic() - started
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            baseline = self.baseline_latencies.get(endpoint)
+            if baseline is None or latency < baseline:
+                baseline = latency
+            else:
+                baseline += (latency - baseline) * BASELINE_DRIFT
+            self.baseline_latencies[endpoint] = baseline
+            slow = latency > baseline * LATENCY_TOLERANCE + LATENCY_SLACK
+            previous = int(self.limit)
+            if congested or slow:
+                # Requests sent before the last decrease already saw the congestion it reacted to
+                if started > self._last_decrease:
+                    self.limit = max(self.limit * BACKOFF_FACTOR, self.minimum)
+                    self.decreases += 1
+                    self._last_decrease = time.monotonic()
+            elif saturated:
+                self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            if int(self.limit) != previous:
+                logger.debug("Adaptive concurrency limit changed to %s.", int(self.limit))
+            self._condition.notify_all()
+
+    def metrics(self):
+        """Return the current limit, the requests in flight and the decreases made so far."""
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "decreases": self.decreases,
+                "baseline_latencies": dict(self.baseline_latencies),
+            }
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def adaptive_limiter(key, maximum=DEFAULT_MAX_LIMIT):
+    """Return the limiter shared by requests with the same key, creating it if needed."""
+    with _LIMITERS_LOCK:
+        if key not in _LIMITERS:
+            _LIMITERS[key] = AdaptiveLimiter(maximum=maximum)
+        return _LIMITERS[key]
+
+
+def limiter_metrics():
+    """Return the metrics of every adaptive limiter in the process, by key."""
+    with _LIMITERS_LOCK:
+        limiters = dict(_LIMITERS)
+    return {key: limiter.metrics() for key, limiter in limiters.items()}
+
+
+def clear_limiters():
+    """Forget every adaptive limiter, so that new requests start from the initial limit."""
+    with _LIMITERS_LOCK:
+        _LIMITERS.clear()
+
+
+class AdaptiveRequester:
+    """Sends requests with another requester, holding a slot of an adaptive limiter for each.
+
+    Only requests to URLs starting with prefix are limited, so that requests to other services,
+    such as the access token endpoint, do not affect the limit.
+    """
+
+    def __init__(self, requester, limiter, prefix):
+        self.requester = requester
+        self.limiter = limiter
+        self.prefix = prefix
+
+    def _send(self, method, url, **kwargs):
+        if not str(url).startswith(self.prefix):
+            return getattr(self.requester, method)(url, **kwargs)
+        started = self.limiter.acquire()
+        congested = True
+        try:
+            response = getattr(self.requester, method)(url, **kwargs)
+            congested = response.status_code in CONGESTION_CODES
+            return response
+        finally:
+            # Requests that raise, such as timeouts, count as congestion
+            self.limiter.release(started, congested, endpoint_key(str(url)))
+
+    def get(self, url, **kwargs):
+        """Send a GET request."""
+        return self._send("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Send a POST request."""
+        return self._send("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """Send a PUT request."""
+        return self._send("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        """Send a DELETE request."""
+        return self._send("delete", url, **kwargs)
@@ -0,0 +1,103 @@
+"""Time budgets for manifest generation and the RHSM API requests that it makes.
+
+A budget is entered with the `deadline` context manager and applies to every request sent by
+`simple_retry` in the same thread until the block exits. Budgets nest, so a per-phase budget entered
+while an overall deadline is active ends at whichever of the two expires first:
+
+    with deadline(600, "manifest"):
+        with deadline(60, "create"):
+            manifester.create_subscription_allocation()
+
+Requests are sent with a timeout no longer than the time remaining, retries are not attempted once
+the remaining time would be spent waiting, and DeadlineExceeded is raised with the name of the
+budget that ran out.
+"""
+from contextlib import contextmanager
+import contextvars
+import math
+import time
+
+from requests.exceptions import Timeout
+
+# Seconds that a request may wait to connect or between bytes of the response, without a deadline
+DEFAULT_REQUEST_TIMEOUT = 120
+
+_ACTIVE_DEADLINE = contextvars.ContextVar("manifester_deadline", default=None)
+
+
+class DeadlineExceeded(Timeout):
+    """Raised when the overall deadline or a phase budget of a manifest has run out."""
+
+    def __init__(self, phase, budget):
+        self.phase = phase
+        self.budget = budget
+        super().__init__(f"The {phase} budget of {budget} seconds was exceeded")
+
+
+class Deadline:
+    """A time budget, limited further by the budget that was active when it was entered."""
+
+    def __init__(self, seconds, phase, parent=None):
+        self.phase = phase
+        self.budget = seconds
+        self.parent = parent
+        self.expires = time.monotonic() + seconds if seconds else math.inf
+
+    def limiting(self):
+        """Return the budget that runs out first, either this one or an enclosing one."""
+        if self.parent is not None:
+            parent = self.parent.limiting()
+            if parent.expires < self.expires:
+                return parent
+        return self
+
+    def remaining(self):
+        """Return the seconds left before this budget or an enclosing one runs out."""
+        return self.limiting().expires - time.monotonic()
+
+    def exceeded(self):
+        """Return the DeadlineExceeded error for the budget that runs out first."""
+        limiting = self.limiting()
+        return DeadlineExceeded(limiting.phase, limiting.budget)
+
+    def check(self):
+        """Raise DeadlineExceeded if this budget or an enclosing one has run out."""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise self.exceeded()
+        return remaining
+
+
+@contextmanager
+def deadline(seconds, phase):
+    """Limit the requests sent inside the block to a budget of seconds, if seconds is set."""
+    parent = _ACTIVE_DEADLINE.get()
+    if not seconds:
+        yield parent
+        return
+    active = Deadline(seconds, phase, parent)
+    active.check()
+    token = _ACTIVE_DEADLINE.set(active)
+    try:
+        yield active
+    finally:
+        _ACTIVE_DEADLINE.reset(token)
+
+
+def active_deadline():
+    """Return the innermost budget active in the current thread, or None."""
+    return _ACTIVE_DEADLINE.get()
+
+
+def request_timeout(timeout=None):
+    """Return the timeout for a request, shortened to the time left in the active budget.
+
+    Raises DeadlineExceeded if the active budget has already run out.
+    """
+    active = _ACTIVE_DEADLINE.get()
+    if active is None:
+        return timeout
+    remaining = active.check()
+    if remaining == math.inf:
+        return timeout
+    return remaining if timeout is None else min(timeout, remaining)
@@ -0,0 +1,209 @@
+"""Hedges slow idempotent GET requests to the RHSM API with a duplicate request.
+
+Most RHSM API reads answer quickly, but a few take tens of seconds. When hedging is enabled, a GET
+request that has not been answered after a delay is sent a second time, and whichever request
+answers first is used. The delay is the configured percentile of the recent latency of the same
+endpoint, so only requests that are already slower than usual are duplicated. Duplicates are
+limited by a budget shared by every Manifester instance in the process: each GET request earns a
+fraction of a hedge, and a hedge is only sent if one has been earned.
+
+GET requests that start an export job are never hedged, since repeating them starts another job.
+Requests are sent from a thread pool with the caller's context, so the active deadline applies to
+them, and waiting for either request stops with DeadlineExceeded once the deadline runs out.
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import contextvars
+import math
+import re
+import threading
+import time
+
+from manifester.deadlines import active_deadline
+from manifester.logger import _logger as logger
+
+DEFAULT_HEDGE_PERCENTILE = 95
+DEFAULT_HEDGE_MIN_DELAY = 1.0
+DEFAULT_HEDGE_BUDGET = 0.05
+# Delay used until enough latency samples of an endpoint have been recorded
+INITIAL_HEDGE_DELAY = 5.0
+MIN_SAMPLES = 20
+MAX_SAMPLES = 200
+# Number of hedges that may be sent at once after a quiet period
+MAX_BURST = 10
+# Path suffixes of GET requests that are not idempotent
+UNHEDGED_SUFFIXES = ("/export",)
+_ID_PATTERN = re.compile(r"/[0-9a-fA-F-]{16,}")
+
+
+def endpoint_key(url):
+    """Return the URL with allocation, job and export IDs replaced, to group similar requests."""
+    return _ID_PATTERN.sub("/{id}", url.split("?", 1)[0])
+
+
+class LatencyTracker:
+    """Recent latencies of each endpoint."""
+
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self._samples = {}
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, url, seconds):
+        """Record the latency of a request."""
+        with self._lock:
+            samples = self._samples.setdefault(
+                endpoint_key(url), deque(maxlen=self._max_samples)
+            )
+            samples.append(seconds)
+
+    def percentile(self, url, percentile):
+        """Return a percentile of the recent latency of an endpoint, or None without enough data."""
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint_key(url), ()))
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * percentile / 100) - 1)]
+
+    def clear(self):
+        """Forget every recorded latency."""
+        with self._lock:
+            self._samples.clear()
+
+
+class HedgeBudget:
+    """Limits hedges to a fraction of the GET requests sent, allowing a small burst."""
+
+    def __init__(self, max_burst=MAX_BURST):
+        self.max_burst = max_burst
+        self.tokens = 0.0
+        self.sent = 0
+        self.won = 0
+        self._lock = threading.Lock()
+
+    def earn(self, ratio):
+        """Add the share of a hedge earned by sending a GET request."""
+        with self._lock:
+            self.tokens = min(self.tokens + ratio, self.max_burst)
+
+    def spend(self):
+        """Use a hedge if one has been earned and return whether it may be sent."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.sent += 1
+            return True
+
+    def record_win(self):
+        """Count a hedge that answered before the request it duplicated."""
+        with self._lock:
+            self.won += 1
+
+    def clear(self):
+        """Reset the earned hedges and the counts of hedges sent and won."""
+        with self._lock:
+            self.tokens = 0.0
+            self.sent = 0
+            self.won = 0
+
+
+LATENCY_TRACKER = LatencyTracker()
+HEDGE_BUDGET = HedgeBudget()
+_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="manifester-hedge")
+
+
+class HedgingRequester:
+    """Sends requests with another requester, hedging GET requests that are slower than usual.
+
+    :param percentile: percentile of an endpoint's recent latency after which a hedge is sent
+    :param min_delay: seconds before which a request is never hedged
+    :param budget: fraction of GET requests that may be hedged
+    :param initial_delay: seconds after which requests to an endpoint without enough recorded
+        latencies are hedged
+    """
+
+    def __init__(
+        self,
+        requester,
+        percentile=DEFAULT_HEDGE_PERCENTILE,
+        min_delay=DEFAULT_HEDGE_MIN_DELAY,
+        budget=DEFAULT_HEDGE_BUDGET,
+        initial_delay=INITIAL_HEDGE_DELAY,
+    ):
+        self.requester = requester
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.tracker = LATENCY_TRACKER
+        self.hedges = HEDGE_BUDGET
+
+    def _timed_get(self, url, kwargs):
+        started = time.monotonic()
+        response = self.requester.get(url, **kwargs)
+        self.tracker.record(url, time.monotonic() - started)
+        return response
+
+    def hedge_delay(self, url):
+        """Return the seconds after which a GET request to the URL is hedged."""
+        observed = self.tracker.percentile(url, self.percentile)
+        return max(self.min_delay, self.initial_delay if observed is None else observed)
+
+    def _submit(self, url, kwargs):
+        # The request runs with the caller's context, so that the active deadline applies to it
+        return _EXECUTOR.submit(contextvars.copy_context().run, self._timed_get, url, kwargs)
+
+    def _wait(self, futures, timeout=None, return_when=FIRST_COMPLETED):
+        """Wait for futures, for no longer than the time left before the active deadline.
+
+        Raises DeadlineExceeded if the deadline has run out before any of the futures completed.
+        """
+        active = active_deadline()
+        remaining = None if active is None else active.check()
+        if remaining is not None and remaining != math.inf:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        done, pending = wait(futures, timeout=timeout, return_when=return_when)
+        if not done and active is not None and active.remaining() <= 0:
+            raise active.exceeded()
+        return done, pending
+
+    def _result(self, future):
+        while not future.done():
+            self._wait([future])
+        return future.result()
+
+    def get(self, url, **kwargs):
+        """Send a GET request, and a duplicate if it has not been answered after the hedge delay."""
+        if url.split("?", 1)[0].endswith(UNHEDGED_SUFFIXES):
+            return self.requester.get(url, **kwargs)
+        self.hedges.earn(self.budget)
+        primary = self._submit(url, kwargs)
+        done, _ = self._wait([primary], timeout=self.hedge_delay(url))
+        if done or not self.hedges.spend():
+            return self._result(primary)
+        logger.debug("Hedging slow request to %s.", endpoint_key(url))
+        hedge = self._submit(url, kwargs)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = self._wait(pending)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedges.record_win()
+                    # The slower request cannot be cancelled and finishes in the background
+                    return future.result()
+        # Both requests failed, so the error of the original request is raised
+        return primary.result()
+
+    def post(self, *args, **kwargs):
+        """Send a POST request."""
+        return self.requester.post(*args, **kwargs)
+
+    def put(self, *args, **kwargs):
+        """Send a PUT request."""
+        return self.requester.put(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Send a DELETE request."""
+        return self.requester.delete(*args, **kwargs)
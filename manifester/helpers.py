@@ -1,5 +1,10 @@
 """Defines helper functions used by Manifester."""
 from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import copy
+from datetime import datetime, timezone
+import hashlib
 import json
 import os
 from pathlib import Path
@@ -7,34 +12,86 @@ import random
 import re
 import subprocess
 import sys
+import threading
 import time
 
-from requests import HTTPError
+from requests import HTTPError, Response
+from requests.exceptions import Timeout
 import yaml
 
+from manifester.deadlines import DeadlineExceeded, active_deadline, request_timeout
 from manifester.logger import _logger as logger
+from manifester.records import AllocationRecord, PoolRecord
 from manifester.settings import settings
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is not available on Windows
+    fcntl = None
+
 RESULTS_LIMIT = 10000
+# datetime.UTC is only available from Python 3.11 onwards
+UTC = timezone.utc  # noqa: UP017
+DEFAULT_MAX_WORKERS = 8
+NOT_MODIFIED = 304
+SUCCESS_CODES = range(200, 300)
+
+
+def simple_retry(
+    cmd, cmd_args=None, cmd_kwargs=None, max_timeout=240, _cur_timeout=1, before_retry=None
+):
+    """Re(Try) a function given its args and kwargs up until a max timeout.
 
+    When a deadline is active, the request timeout is shortened to the time remaining and no retry
+    is attempted once waiting for it would exceed the deadline.
 
-def simple_retry(cmd, cmd_args=None, cmd_kwargs=None, max_timeout=240, _cur_timeout=1):
-    """Re(Try) a function given its args and kwargs up until a max timeout."""
+    A response with status 500 or 504 may be sent after the server has carried out the request.
+    For requests that are not idempotent, before_retry is called with such a response before the
+    request is repeated, and if it returns anything other than None, that is returned instead.
+    """
     cmd_args = cmd_args if cmd_args else []
     cmd_kwargs = cmd_kwargs if cmd_kwargs else {}
+    timeout = request_timeout(cmd_kwargs.get("timeout"))
+    if timeout is not None:
+        # The caller's kwargs are reused for later requests, so they are copied before changing
+        cmd_kwargs = dict(cmd_kwargs, timeout=timeout)
     # If additional debug information is needed, the following log entry can be modified to
     # include the data being passed by adding {cmd_kwargs=} to the f-string. Please do so
     # with caution as some data (notably the offline token) should be treated as a secret.
-    logger.debug(f"Sending request to endpoint {cmd_args}")
-    response = cmd(*cmd_args, **cmd_kwargs)
-    logger.debug(f"Response status code is {response.status_code}")
+    logger.debug("Sending request to endpoint %s", cmd_args)
+    try:
+        response = cmd(*cmd_args, **cmd_kwargs)
+    except Timeout as err:
+        active = active_deadline()
+        if active is not None and active.remaining() <= 0 and not isinstance(err, DeadlineExceeded):
+            raise active.exceeded() from err
+        raise
+    logger.debug("Response status code is %s", response.status_code)
     if response.status_code in [429, 500, 504]:
         new_wait = _cur_timeout * 2
         if new_wait > max_timeout:
             raise Exception("Retry timeout exceeded")
-        logger.debug(f"Trying again in {_cur_timeout} seconds")
+        active = active_deadline()
+        if active is not None and active.remaining() <= _cur_timeout:
+            logger.debug("Not retrying, the %s budget would be exceeded", active.limiting().phase)
+            raise active.exceeded()
+        logger.debug("Trying again in %s seconds", _cur_timeout)
         time.sleep(_cur_timeout)
-        response = simple_retry(cmd, cmd_args, cmd_kwargs, max_timeout, new_wait)
+        # Checked after waiting, so that a request the server is still carrying out can finish
+        if before_retry is not None and response.status_code != 429:  # noqa: PLR2004
+            applied = before_retry(response)
+            if applied is not None:
+                return applied
+        response = simple_retry(cmd, cmd_args, cmd_kwargs, max_timeout, new_wait, before_retry)
+    return response
+
+
+def applied_response(body):
+    """Return a successful response with a JSON body, for a request found to have taken effect."""
+    response = Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(body).encode()
     return response
 
 
@@ -60,100 +117,172 @@ def process_sat_version(sat_version, valid_sat_versions):
     return sat_version
 
 
-def fetch_paginated_data(manifester, endpoint):
-    """Fetch data from the API and account for pagination in the API response.
+def _page_records(manifester, endpoint, response, raw):
+    """Parse one page of an API response into the records kept by fetch_paginated_data.
 
-    Currently used only for subscription allocations and subscription pools.
+    :return: tuple of the number of results on the page and the list of records kept from it
     """
+    page = response.json()
+    if manifester.is_mock and endpoint == "pools":
+        page = page.pool_response
+    elif manifester.is_mock and endpoint == "allocations":
+        page = page.allocations_response
+        if hasattr(page, "force_export_failure"):
+            page = page.allocations_response
+    body = page["body"]
     if endpoint == "allocations":
-        _endpoint_url = manifester.allocations_url
-        _endpoint_data = manifester._allocations
-        MAX_RESULTS_PER_PAGE = 100
+        # Allocations of other users are discarded as each page is parsed
+        kept = [a for a in body if a["name"].startswith(manifester.username_prefix)]
+        return len(body), kept if raw else [AllocationRecord.from_dict(a) for a in kept]
+    return len(body), body if raw else [PoolRecord.from_dict(p) for p in body]
+
+
+def _endpoint_paging(manifester, endpoint, allocation_uuid=None):
+    """Return the URL and page size of a paginated endpoint."""
+    if endpoint == "allocations":
+        return manifester.allocations_url, 100
     elif endpoint == "pools":
-        _endpoint_url = f"{manifester.allocations_url}/{manifester.allocation_uuid}/pools"
+        allocation_uuid = allocation_uuid or manifester.allocation_uuid
+        _endpoint_url = f"{manifester.allocations_url}/{allocation_uuid}/pools"
         if "stage" in manifester.allocations_url:
             _endpoint_url = _endpoint_url + "?future=true"
-        _endpoint_data = manifester._subscription_pools
-        MAX_RESULTS_PER_PAGE = 50
-    else:
-        raise ValueError(
-            f"Received value {endpoint} for endpoint argument. Valid values "
-            "for endpoint are 'allocations' or 'pools'."
-        )
-    if not _endpoint_data:
-        _offset = 0
+        return _endpoint_url, 50
+    raise ValueError(
+        f"Received value {endpoint} for endpoint argument. Valid values "
+        "for endpoint are 'allocations' or 'pools'."
+    )
+
+
+def iter_paginated_data(manifester, endpoint, raw=None, allocation_uuid=None):
+    """Yield records from a paginated API endpoint, fetching each page only when it is needed.
+
+    Callers that stop iterating early, for example once a matching subscription pool has been
+    found, never request the remaining pages. Records are parsed as described for
+    fetch_paginated_data. Pools are listed for the manifester's allocation unless allocation_uuid
+    names another one.
+    """
+    _endpoint_url, MAX_RESULTS_PER_PAGE = _endpoint_paging(manifester, endpoint, allocation_uuid)
+    if raw is None:
+        raw = True if endpoint == "allocations" else manifester.raw_records
+    _offset = 0
+    _results = MAX_RESULTS_PER_PAGE
+    total_results = 0
+    # The endpoints used in the API call below can return a limited number of results per page. For
+    # organizations with more subscription allocations or pools than fit on a page, the loop below
+    # works around this limit by repeating calls with a progressively larger value for the
+    # `offset` parameter.
+    while _results == MAX_RESULTS_PER_PAGE:
+        if _offset:
+            logger.debug("Fetching additional data with an offset of %s.", _offset)
         data = {
             "headers": {"Authorization": f"Bearer {manifester.access_token}"},
             "proxies": manifester.manifest_data.get("proxies"),
-            "params": {
-                "offset": _offset,
-                "limit": RESULTS_LIMIT,
-            },
+            "timeout": manifester.request_timeout,
+            "params": {"offset": _offset, "limit": RESULTS_LIMIT},
         }
-        _endpoint_data = simple_retry(
+        response = simple_retry(
             manifester.requester.get,
             cmd_args=[f"{_endpoint_url}"],
             cmd_kwargs=data,
         )
-        if _endpoint_data.status_code in [400, 401, 403, 404]:
+        if response.status_code in [400, 401, 403, 404]:
             raise HTTPError(
-                f"Received HTTP {_endpoint_data.status_code} response code. Please "
+                f"Received HTTP {response.status_code} response code. Please "
                 "ensure that the request is a properly-formatted and authorized "
                 "request to a valid endpoint."
             )
-        _endpoint_data = _endpoint_data.json()
-        if manifester.is_mock and endpoint == "pools":
-            _endpoint_data = _endpoint_data.pool_response
-        elif manifester.is_mock and endpoint == "allocations":
-            _endpoint_data = _endpoint_data.allocations_response
-        _results = len(_endpoint_data["body"])
-        # The endpoints used in the above API call can return a maximum of 50 results. For
-        # organizations with more than 50 subscription allocations or pools, the loop below works
-        # around this limit by repeating calls with a progressively larger value for the `offset`
-        # parameter.
-        while _results == MAX_RESULTS_PER_PAGE:
-            _offset += MAX_RESULTS_PER_PAGE
-            logger.debug(f"Fetching additional data with an offset of {_offset}.")
-            data = {
-                "headers": {"Authorization": f"Bearer {manifester.access_token}"},
-                "proxies": manifester.manifest_data.get("proxies"),
-                "params": {"offset": _offset, "limit": RESULTS_LIMIT},
-            }
-            offset_data = simple_retry(
-                manifester.requester.get,
-                cmd_args=[f"{_endpoint_url}"],
-                cmd_kwargs=data,
-            )
-            if offset_data.status_code in [400, 401, 403, 404]:
-                raise HTTPError(
-                    f"Received HTTP {_endpoint_data.status_code} response code. Please "
-                    "ensure that the request is a properly-formatted and authorized "
-                    "request to a valid endpoint."
-                )
-            offset_data = offset_data.json()
-            if manifester.is_mock and endpoint == "pools":
-                offset_data = offset_data.pool_response
-            elif manifester.is_mock and endpoint == "allocations":
-                offset_data = offset_data.allocations_response
-            _endpoint_data["body"] += offset_data["body"]
-            _results = len(offset_data["body"])
-            total_results = len(_endpoint_data["body"])
-            logger.debug(f"Total {endpoint} available on this account: {total_results}")
+        _results, page_records = _page_records(manifester, endpoint, response, raw)
+        total_results += len(page_records)
+        logger.debug("Total %s kept from this account: %s", endpoint, total_results)
+        _offset += MAX_RESULTS_PER_PAGE
+        yield from page_records
+
+
+def fetch_paginated_data(manifester, endpoint, raw=None):
+    """Fetch data from the API and account for pagination in the API response.
+
+    Currently used only for subscription allocations and subscription pools. Allocations are
+    filtered by username_prefix as each page is parsed. Unless raw is set, pools are projected onto
+    compact PoolRecord objects. Allocations are kept as raw dicts by default because they are
+    written to the inventory, and are projected onto AllocationRecord objects if raw is False.
+    """
     if endpoint == "allocations":
-        if hasattr(_endpoint_data, "force_export_failure"):
-            return [
-                a
-                for a in _endpoint_data.allocations_response["body"]
-                if a["name"].startswith(manifester.username_prefix)
-            ]
-        else:
-            return [
-                a
-                for a in _endpoint_data["body"]
-                if a["name"].startswith(manifester.username_prefix)
-            ]
+        _endpoint_data = manifester._allocations
     elif endpoint == "pools":
-        return _endpoint_data
+        _endpoint_data = manifester._subscription_pools
+    else:
+        # Raises a ValueError describing the valid endpoints
+        _endpoint_paging(manifester, endpoint)
+    if not _endpoint_data:
+        records = list(iter_paginated_data(manifester, endpoint, raw))
+        _endpoint_data = records if endpoint == "allocations" else {"body": records}
+    return _endpoint_data
+
+
+class PoolCatalog:
+    """Subscription pool listings shared by all Manifester instances in a process.
+
+    Listings are keyed by account and Satellite version so that allocations created from the same
+    account for the same version reuse a single download of the pool listing. The number of
+    available entitlements in each pool is decremented locally as attachments succeed, and a
+    listing is only fetched again when it is invalidated after a failed attachment or when it is
+    older than the TTL requested by the caller.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(manifester):
+        """Return the catalog key of a Manifester instance's account and Satellite version."""
+        # The offline token identifies the account, but it is a secret and is only kept as a digest
+        token_digest = hashlib.sha256(str(manifester.offline_token).encode()).hexdigest()
+        return (manifester.allocations_url, token_digest, manifester.sat_version)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def pools(self, manifester, ttl):
+        """Return the pool listing for the manifester's account, fetching it if needed."""
+        key = self.key(manifester)
+        with self._key_lock(key):
+            fetched_at, listing = self._listings.get(key, (None, None))
+            if listing is not None and time.monotonic() - fetched_at < ttl:
+                logger.debug("Using cached pool listing for %s.", manifester.sat_version)
+                return listing
+            manifester._subscription_pools = None
+            pools = fetch_paginated_data(manifester, "pools")
+            # The listing is copied so that local accounting never modifies the fetched data
+            listing = {"body": [copy.copy(pool) for pool in pools["body"]]}
+            self._listings[key] = (time.monotonic(), listing)
+            return listing
+
+    def consume(self, manifester, pool_id, quantity):
+        """Deduct a successfully attached quantity from a pool's available entitlements."""
+        key = self.key(manifester)
+        with self._key_lock(key):
+            _, listing = self._listings.get(key, (None, None))
+            for pool in listing["body"] if listing else []:
+                # A value of -1 indicates that the pool has an unlimited quantity
+                if pool["id"] == pool_id and pool["entitlementsAvailable"] != -1:
+                    pool["entitlementsAvailable"] = max(pool["entitlementsAvailable"] - quantity, 0)
+
+    def invalidate(self, manifester):
+        """Discard the manifester's pool listing so that the next lookup fetches it again."""
+        key = self.key(manifester)
+        with self._key_lock(key):
+            self._listings.pop(key, None)
+
+    def clear(self):
+        """Discard every pool listing in the catalog."""
+        with self._lock:
+            self._listings.clear()
+
+
+POOL_CATALOG = PoolCatalog()
 
 
 def load_inventory_file(file):
@@ -174,23 +303,55 @@ def load_inventory_file(file):
 
 
 def _dump_inventory_file(inventory_path, inventory):
-    """Write inventory data to local inventory file."""
-    with inventory_path.open("w") as inventory_file:
+    """Write inventory data to local inventory file, replacing the previous file atomically."""
+    tmp_path = inventory_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("w") as inventory_file:
         yaml.dump(inventory, inventory_file, allow_unicode=True)
+    tmp_path.replace(inventory_path)
 
 
 def _update_inventory(inventory_path, inventory, allocation):
-    """Add new allocation, remove and recreate inventory file."""
+    """Add new allocation and rewrite the inventory file."""
     inventory.append(allocation)
-    inventory_path.unlink()
-    inventory_path.touch()
     _dump_inventory_file(inventory_path, inventory)
 
 
+# Serializes read-modify-write cycles on the inventory file between threads
+INVENTORY_LOCK = threading.Lock()
+
+
+@contextmanager
+def _locked_inventory(inventory_path):
+    """Serialize read-modify-write cycles on the inventory file between threads and processes."""
+    with INVENTORY_LOCK, inventory_path.with_name(f"{inventory_path.name}.lock").open("a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
 def update_inventory(inventory_data, sync=False, remove=False, uuid=None):
     """Replace the existing inventory file with current subscription allocations."""
+    with _locked_inventory(Path(settings.inventory_path)):
+        _update_inventory_file(inventory_data, sync=sync, remove=remove, uuid=uuid)
+
+
+def _update_inventory_file(inventory_data, sync, remove, uuid):
     inventory_path = Path(settings.inventory_path)
     if sync:
+        # Parked allocations are only known to the local inventory, so their state is carried over
+        parked = {
+            alloc["uuid"]
+            for alloc in load_inventory_file(inventory_path) or []
+            if alloc.get("parked")
+        }
+        inventory_data = [
+            dict(alloc, parked=True) if alloc["uuid"] in parked else alloc
+            for alloc in inventory_data
+        ]
         if load_inventory_file(inventory_path):
             inventory_path.unlink()
         inventory_path.touch()
@@ -212,6 +373,324 @@ def update_inventory(inventory_data, sync=False, remove=False, uuid=None):
             _update_inventory(inventory_path, inv, current_allocation)
 
 
+def park_allocation(uuid):
+    """Mark an allocation in the local inventory as parked and available for reuse."""
+    inventory_path = Path(settings.inventory_path)
+    with _locked_inventory(inventory_path):
+        inv = load_inventory_file(inventory_path)
+        for alloc in inv:
+            if alloc["uuid"] == uuid:
+                alloc["parked"] = True
+        _dump_inventory_file(inventory_path, inv)
+
+
+def claim_parked_allocation(sat_version, simple_content_access, account=None):
+    """Claim a parked allocation matching the Satellite version and Simple Content Access setting.
+
+    When several accounts are configured, only allocations in the given account are claimed.
+
+    :return: the inventory entry of the claimed allocation, or None if no allocation matches
+    """
+    inventory_path = Path(settings.inventory_path)
+    with _locked_inventory(inventory_path):
+        inv = load_inventory_file(inventory_path) or []
+        for alloc in inv:
+            if (
+                alloc.get("parked")
+                # The API may report the version with or without the 'sat-' prefix
+                and str(alloc.get("version")).removeprefix("sat-")
+                == sat_version.removeprefix("sat-")
+                and alloc.get("simpleContentAccess") == simple_content_access
+                and alloc.get("account") == account
+            ):
+                alloc["parked"] = False
+                _dump_inventory_file(inventory_path, inv)
+                return alloc
+
+
+def cache_dir(create=True):
+    """Return the directory used for manifester's local caches, creating it if needed."""
+    directory = Path(settings.get("cache_dir", ".manifester_cache"))
+    if create:
+        directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+class AllocationDetailsCache:
+    """Local cache of the entitlements attached to each subscription allocation.
+
+    Entries are keyed by allocation UUID and are only valid while the allocation's lastModified
+    value is unchanged. Allocations that do not report a lastModified value are never cached.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else cache_dir().joinpath("allocation_details.json")
+        self._entries = json.loads(self.path.read_text()) if self.path.is_file() else {}
+        self._lock = threading.Lock()
+
+    def get(self, allocation):
+        """Return the cached entitlements of an allocation, or None if they are stale or absent."""
+        entry = self._entries.get(allocation["uuid"])
+        if entry and allocation.get("lastModified") and (
+            entry["lastModified"] == allocation["lastModified"]
+        ):
+            return entry["entitlements"]
+
+    def set(self, allocation, entitlements):
+        """Cache the entitlements of an allocation."""
+        if allocation.get("lastModified"):
+            with self._lock:
+                self._entries[allocation["uuid"]] = {
+                    "lastModified": allocation["lastModified"],
+                    "entitlements": entitlements,
+                }
+
+    def save(self):
+        """Write the cache to disk, replacing the previous file atomically."""
+        with self._lock:
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._entries))
+            tmp_path.replace(self.path)
+
+
+class ResponseCache:
+    """On-disk cache of the responses of read-only RHSM API metadata endpoints.
+
+    Each response is stored in its own file, named after a digest of the account and the URL, so
+    that accounts sharing the cache directory never read each other's responses, and processes
+    only contend for the responses that they both fetch. The validators sent by the server (ETag
+    and Last-Modified) are stored with the response body so that expired entries can be revalidated
+    with a conditional request instead of being downloaded again.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else cache_dir().joinpath("responses")
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url, account=None):
+        digest = hashlib.sha256(f"{account}:{url}".encode()).hexdigest()
+        return self.directory.joinpath(f"{digest}.json")
+
+    def get(self, url, account=None):
+        """Return the cache entry of a URL for an account, or None if it has not been cached."""
+        path = self._path(url, account)
+        try:
+            return json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, url, body, etag=None, last_modified=None, account=None):
+        """Cache a response body and its validators, replacing the previous entry atomically."""
+        path = self._path(url, account)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "url": url,
+                    "account": account,
+                    "fetched_at": time.time(),
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "body": body,
+                }
+            )
+        )
+        tmp_path.replace(path)
+
+
+def fetch_cached_json(manifester, url, ttl, bypass=False, cache=None):
+    """Return the JSON body of a read-only endpoint, using the response cache when possible.
+
+    Responses are cached per account, and only successful (2xx) responses are cached. Entries
+    younger than ttl seconds are returned without a request. Older entries are revalidated with a
+    conditional request if the server sent validators for them, and a 304 response renews them.
+    Passing bypass ignores the cached entry, but the fresh response is still cached.
+    """
+    cache = cache or ResponseCache()
+    # The offline token identifies the account, but it is a secret and is only kept as a digest
+    account = hashlib.sha256(str(manifester.offline_token).encode()).hexdigest()[:12]
+    entry = None if bypass else cache.get(url, account)
+    if entry and time.time() - entry["fetched_at"] < ttl:
+        logger.debug("Using cached response for %s.", url)
+        return entry["body"]
+    headers = {"Authorization": f"Bearer {manifester.access_token}"}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    response = simple_retry(
+        manifester.requester.get,
+        cmd_args=[url],
+        cmd_kwargs={
+            "headers": headers,
+            "proxies": manifester.manifest_data.get("proxies"),
+            "timeout": manifester.request_timeout,
+        },
+    )
+    if entry and response.status_code == NOT_MODIFIED:
+        logger.debug("Cached response for %s is still valid.", url)
+        cache.set(url, entry["body"], entry.get("etag"), entry.get("last_modified"), account)
+        return entry["body"]
+    if response.status_code not in SUCCESS_CODES:
+        return response.json()
+    body = response.json()
+    cache.set(
+        url,
+        body,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+        account,
+    )
+    return body
+
+
+def hydrate_allocations(
+    manifester,
+    allocations,
+    max_workers=DEFAULT_MAX_WORKERS,
+    cache_path=None,
+    account_manifesters=None,
+):
+    """Yield each allocation with its attached entitlements as soon as they are available.
+
+    Entitlements are fetched concurrently by up to max_workers threads, so results are yielded in
+    completion order rather than inventory order. Allocations whose entitlements cannot be fetched
+    are logged and yielded with None in place of their entitlements.
+
+    :param account_manifesters: dictionary of Manifester instances by account name, used for the
+        allocations whose inventory entry names an account instead of manifester
+    :return: generator of (inventory index, allocation, list of attached entitlements) tuples
+    """
+    account_manifesters = account_manifesters or {}
+    cache = AllocationDetailsCache(cache_path)
+    # Request the access tokens before they are shared by the worker threads
+    for owner in (manifester, *account_manifesters.values()):
+        owner.access_token
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for num, allocation in enumerate(allocations):
+                entitlements = cache.get(allocation)
+                if entitlements is not None:
+                    yield num, allocation, entitlements
+                else:
+                    owner = account_manifesters.get(allocation.get("account"), manifester)
+                    future = executor.submit(owner.get_allocation_details, allocation["uuid"])
+                    futures[future] = (num, allocation)
+            for future in as_completed(futures):
+                num, allocation = futures[future]
+                try:
+                    entitlements = future.result()["body"]["entitlementsAttached"]["value"]
+                except Exception as err:  # noqa: BLE001 - one failure should not end the listing
+                    logger.warning(
+                        f"Unable to fetch entitlements of allocation {allocation['name']}: {err}"
+                    )
+                    yield num, allocation, None
+                    continue
+                cache.set(allocation, entitlements)
+                yield num, allocation, entitlements
+    finally:
+        cache.save()
+
+
+class RateLimiter:
+    """Space out calls made from any number of threads to at most `rate` calls per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _allocation_age(allocation, now):
+    """Return the age of an allocation as a timedelta, or None if its creation date is unknown."""
+    created = allocation.get("createdDate")
+    if not created:
+        return None
+    # datetime.fromisoformat only accepts the 'Z' suffix from Python 3.11 onwards
+    created = datetime.fromisoformat(str(created).replace("Z", "+00:00"))
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=UTC)
+    return now - created
+
+
+def find_stale_allocations(allocations, inventory, max_age=None, untracked=False, now=None):
+    """Find allocations that are older than max_age or, optionally, missing from the inventory.
+
+    :param max_age: datetime.timedelta; allocations without a creation date are never too old
+    :param untracked: also consider allocations that are missing from the local inventory stale
+    :return: list of (allocation, reason) tuples
+    """
+    now = now or datetime.now(UTC)
+    inventory_uuids = {alloc["uuid"] for alloc in inventory or []}
+    stale = []
+    for allocation in allocations:
+        age = _allocation_age(allocation, now)
+        if max_age is not None and age is not None and age > max_age:
+            stale.append((allocation, f"older than {max_age}"))
+        elif untracked and allocation["uuid"] not in inventory_uuids:
+            stale.append((allocation, "missing from inventory"))
+    return stale
+
+
+def reap_allocations(
+    manifester,
+    *,
+    max_age=None,
+    untracked=False,
+    dry_run=False,
+    max_workers=DEFAULT_MAX_WORKERS,
+    rate=2,
+):
+    """Delete stale allocations under the manifester's username_prefix.
+
+    Deletions are sent concurrently by up to max_workers threads and are limited to `rate`
+    requests per second, and wait for scheduler slots at the manifester's priority if concurrency
+    is limited. Nothing is deleted when dry_run is set.
+
+    :return: list of dictionaries reporting the name, UUID, reason and response status of each
+        stale allocation
+    """
+    inventory = load_inventory_file(Path(settings.inventory_path))
+    # Fetched directly, since the manifester's cached listing may hold either raw dicts or records
+    stale = find_stale_allocations(
+        iter_paginated_data(manifester, "allocations", raw=False),
+        inventory,
+        max_age=max_age,
+        untracked=untracked,
+    )
+    report = [
+        {"name": alloc["name"], "uuid": alloc["uuid"], "reason": reason, "status": None}
+        for alloc, reason in stale
+    ]
+    if dry_run or not report:
+        return report
+    limiter = RateLimiter(rate)
+
+    def _reap(entry):
+        limiter.wait()
+        with manifester._scheduled("delete"):
+            entry["status"] = manifester._delete_allocation(entry["uuid"]).status_code
+        logger.info(f"Reaped allocation {entry['name']} with status {entry['status']}")
+
+    manifester.access_token
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(_reap, report))
+    for entry in report:
+        if entry["status"] in [200, 204]:
+            update_inventory(None, remove=True, uuid=entry["uuid"])
+    return report
+
+
 def fake_http_response_code(good_codes=None, bad_codes=None, fail_rate=0):
     """Return an HTTP response code randomly selected from sets of good and bad codes."""
     if random.random() > (fail_rate / 100):
@@ -0,0 +1,162 @@
+"""Reads the contents of exported subscription manifests without extracting them to disk.
+
+A manifest is a zip archive that contains a signature and a nested `consumer_export.zip` archive.
+The nested archive holds the consumer (the subscription allocation), its entitlements and metadata
+about the export as JSON files. Only the central directory and the nested archive are read from
+the manifest file, the nested archive is read in memory, and a summary of each manifest is kept in
+an index that is only invalidated when the manifest file changes.
+
+The exported consumer does not record the Satellite version of its allocation. That version is
+taken from the `version` that the RHSM API reports for the allocation, as recorded in the local
+inventory.
+"""
+import io
+import json
+import os
+from pathlib import Path
+import threading
+import zipfile
+
+from manifester.helpers import cache_dir
+from manifester.logger import _logger as logger
+
+CONSUMER_EXPORT = "consumer_export.zip"
+# Candlepin's content access mode for consumers with Simple Content Access enabled
+SCA_CONTENT_ACCESS_MODE = "org_environment"
+
+
+def _read_json(archive, name):
+    with archive.open(name) as member:
+        return json.load(member)
+
+
+def _summarize(consumer_export):
+    """Build a summary of a manifest from its nested consumer export archive."""
+    consumer = {}
+    meta = {}
+    entitlements = []
+    for name in consumer_export.namelist():
+        if name.endswith("export/consumer.json"):
+            consumer = _read_json(consumer_export, name)
+        elif name.endswith("export/meta.json"):
+            meta = _read_json(consumer_export, name)
+        elif "export/entitlements/" in name and name.endswith(".json"):
+            entitlement = _read_json(consumer_export, name)
+            pool = entitlement.get("pool") or {}
+            entitlements.append(
+                {
+                    "pool_id": pool.get("id"),
+                    "subscription_name": pool.get("productName"),
+                    "quantity": entitlement.get("quantity"),
+                }
+            )
+    content_access_mode = consumer.get("contentAccessMode")
+    simple_content_access = None
+    if content_access_mode is not None:
+        simple_content_access = (
+            "enabled" if content_access_mode == SCA_CONTENT_ACCESS_MODE else "disabled"
+        )
+    return {
+        "consumer_uuid": consumer.get("uuid"),
+        "consumer_name": consumer.get("name"),
+        "simple_content_access": simple_content_access,
+        "created": meta.get("created"),
+        "entitlements": sorted(entitlements, key=lambda e: (e["subscription_name"] or "")),
+    }
+
+
+def read_manifest(path):
+    """Summarize a manifest file's consumer, entitlements and settings without extracting it.
+
+    :return: dictionary describing the manifest
+    """
+    with zipfile.ZipFile(path) as manifest:
+        consumer_export = io.BytesIO(manifest.read(CONSUMER_EXPORT))
+    with zipfile.ZipFile(consumer_export) as export:
+        return _summarize(export)
+
+
+class ManifestIndex:
+    """Index of manifest summaries, keyed by path and validated by file size and modification time.
+
+    The index is stored as JSON in manifester's cache directory so that repeated audits of stored
+    manifests only read the manifests that have changed.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else cache_dir().joinpath("manifest_index.json")
+        self._entries = json.loads(self.path.read_text()) if self.path.is_file() else {}
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def inspect(self, manifest_path):
+        """Return the summary of a manifest, reading the manifest only if it is not indexed."""
+        manifest_path = Path(manifest_path).resolve()
+        stat = manifest_path.stat()
+        key = str(manifest_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["summary"]
+        logger.debug("Reading manifest %s", manifest_path)
+        summary = read_manifest(manifest_path)
+        with self._lock:
+            self._entries[key] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "summary": summary,
+            }
+            self._changed = True
+        return summary
+
+    def save(self):
+        """Write the index to disk if it has changed, replacing the previous file atomically."""
+        with self._lock:
+            if not self._changed:
+                return
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._entries))
+            tmp_path.replace(self.path)
+            self._changed = False
+
+
+def with_recorded_version(summary, inventory):
+    """Add the Satellite version recorded for the manifest's allocation to a manifest summary.
+
+    :param inventory: allocations as listed by the RHSM API, such as the local inventory
+    :return: copy of the summary with a sat_version, which is None if the allocation is not listed
+    """
+    allocation = next(
+        (alloc for alloc in inventory or [] if alloc.get("uuid") == summary["consumer_uuid"]), {}
+    )
+    return dict(summary, sat_version=allocation.get("version"))
+
+
+def manifest_matches_category(summary, category):
+    """Check whether a manifest summary matches the settings of a manifest category.
+
+    The manifest must contain exactly the subscription quantities in the category's
+    subscription_data and, when both are known, the same Simple Content Access setting and
+    Satellite version.
+    """
+    requested = {}
+    for sub in category.get("subscription_data") or []:
+        requested[sub["name"]] = requested.get(sub["name"], 0) + sub["quantity"]
+    attached = {}
+    for entitlement in summary["entitlements"]:
+        name = entitlement["subscription_name"]
+        attached[name] = attached.get(name, 0) + (entitlement["quantity"] or 0)
+    if requested != attached:
+        return False
+    for key in ("simple_content_access", "sat_version"):
+        manifest_value, category_value = summary.get(key), category.get(key)
+        if manifest_value and category_value:
+            # Satellite versions may be recorded with or without the 'sat-' prefix
+            if str(manifest_value).removeprefix("sat-") != str(category_value).removeprefix("sat-"):
+                return False
+    return True
+
+
+def matching_categories(summary, categories):
+    """Return the names of the manifest categories that a manifest summary matches."""
+    return [name for name, data in categories.items() if manifest_matches_category(summary, data)]
@@ -0,0 +1,215 @@
+"""On-disk journal of the completed steps of each manifest being generated.
+
+When the `journal` setting is enabled, a journal file for the allocation of each manifest being
+generated is kept in the `journals` directory of `cache_dir` and rewritten after each step
+completes:
+
+    created      the allocation's UUID, name, manifest category and account
+    attachments  each subscription pool attached, with the quantity of entitlements
+    attached     set once every requested subscription has been attached
+    export_job   the ID of the export job started for the manifest
+
+The journal is discarded once the manifest has been downloaded or the allocation is deleted. If the
+process dies before then, `manifester resume` or `Manifester.resume_manifest()` continues from the
+last completed step, for example by polling the export job that was already started, instead of
+creating another allocation and leaking the first.
+
+The process generating a manifest holds an exclusive lock on the journal's lock file, which is
+released when the process exits, so that only one process at a time can continue a manifest.
+"""
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import socket
+import threading
+
+from manifester.helpers import UTC, cache_dir
+from manifester.logger import _logger as logger
+from manifester.reservations import _process_alive
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is not available on Windows
+    fcntl = None
+
+
+class JournalInUse(Exception):
+    """Raised when another process is already generating the manifest of a journal."""
+
+
+def journal_directory(create=True):
+    """Return the directory that journals are kept in, creating it if needed."""
+    directory = cache_dir(create=create).joinpath("journals")
+    if create:
+        directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def _lock_file(lock_path):
+    """Open a lock file and lock it exclusively, returning None if another process holds it.
+
+    Lock files are only removed by a process holding their lock. A process that was waiting for a
+    lock file that is then removed ends up locking the removed file, so the lock is taken again on
+    the file now at lock_path, and two processes never hold the lock at once.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        lock_file = lock_path.open("a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        try:
+            if lock_path.stat().st_ino == os.fstat(lock_file.fileno()).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+
+class AllocationJournal:
+    """The completed steps of generating the manifest of one allocation.
+
+    :param path: journal file, rewritten atomically whenever a step is recorded
+    """
+
+    def __init__(self, path, entry):
+        self.path = Path(path)
+        self.entry = entry
+        self._lock = threading.Lock()
+        self._claim_file = None
+
+    @classmethod
+    def start(cls, uuid, name, manifest_category=None, account=None, directory=None):
+        """Create the journal of a newly created allocation."""
+        entry = {
+            "uuid": uuid,
+            "name": name,
+            "manifest_category": manifest_category,
+            "account": account,
+            "created": datetime.now(UTC).isoformat(),
+            "hostname": socket.gethostname(),
+            "pid": os.getpid(),
+            "attachments": [],
+            "attached": False,
+            "export_job": None,
+        }
+        journal = cls(Path(directory or journal_directory()).joinpath(f"{uuid}.json"), entry)
+        journal._lock_claim()
+        journal.save()
+        return journal
+
+    @classmethod
+    def load(cls, path):
+        """Read a journal file."""
+        return cls(path, json.loads(Path(path).read_text()))
+
+    @property
+    def step(self):
+        """Return the last completed step: created, attached or exporting."""
+        if self.entry["export_job"]:
+            return "exporting"
+        return "attached" if self.entry["attached"] else "created"
+
+    def in_progress(self):
+        """Return whether another process on this host is still generating the manifest."""
+        return (
+            self.entry.get("hostname") == socket.gethostname()
+            and self.entry.get("pid") != os.getpid()
+            and _process_alive(self.entry.get("pid"))
+        )
+
+    def save(self):
+        """Write the journal, replacing the previous file atomically."""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self.entry, indent=2))
+            tmp_path.replace(self.path)
+
+    def _lock_claim(self):
+        """Take the exclusive lock of the journal, returning False if another process holds it."""
+        if self._claim_file is None:
+            self._claim_file = _lock_file(self.path.with_suffix(".lock"))
+        return self._claim_file is not None
+
+    def release(self):
+        """Release the journal, so that another process can continue the manifest."""
+        if self._claim_file is not None:
+            self._claim_file.close()
+            self._claim_file = None
+
+    def claim(self):
+        """Take over the manifest from a process that died, and record this process as its owner.
+
+        The journal is read again once it is locked, since the previous owner may have completed
+        more steps since it was loaded. Raises JournalInUse if another process holds the journal,
+        and FileNotFoundError if the manifest was finished in the meantime.
+        """
+        if not self._lock_claim():
+            raise JournalInUse(
+                f"Subscription allocation {self.entry['name']} is being generated by another "
+                "process."
+            )
+        try:
+            self.entry = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            self.path.with_suffix(".lock").unlink(missing_ok=True)
+            self.release()
+            raise
+        self.record(hostname=socket.gethostname(), pid=os.getpid())
+
+    def record(self, **fields):
+        """Record the completion of a step."""
+        self.entry.update(fields)
+        self.save()
+
+    def record_attachment(self, pool_id, subscription_name, quantity):
+        """Record entitlements attached from a subscription pool."""
+        self.entry["attachments"].append(
+            {"pool": pool_id, "subscription": subscription_name, "quantity": quantity}
+        )
+        self.save()
+
+    def discard(self):
+        """Delete the journal once the manifest is complete or the allocation is gone."""
+        self.path.unlink(missing_ok=True)
+        # The lock file is only removed while it is locked, see _lock_file
+        if self._lock_claim():
+            self.path.with_suffix(".lock").unlink(missing_ok=True)
+        self.release()
+        logger.debug("Discarded the journal of subscription allocation %s.", self.entry["name"])
+
+
+def load_journals(names=None, directory=None):
+    """Return the journals of unfinished manifests, optionally only those of named allocations."""
+    journals = []
+    for path in sorted(Path(directory or journal_directory(create=False)).glob("*.json")):
+        try:
+            journal = AllocationJournal.load(path)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Unable to read journal {path}: {err}")
+            continue
+        if not names or journal.entry["name"] in names:
+            journals.append(journal)
+    return journals
+
+
+def discard_journal(uuid, directory=None):
+    """Delete the journal of an allocation, if there is one.
+
+    The lock file is left in place if another process holds it.
+    """
+    path = Path(directory or journal_directory(create=False)).joinpath(f"{uuid}.json")
+    path.unlink(missing_ok=True)
+    lock_path = path.with_suffix(".lock")
+    if not lock_path.exists():
+        return
+    lock_file = _lock_file(lock_path)
+    if lock_file is not None:
+        lock_path.unlink(missing_ok=True)
+        lock_file.close()
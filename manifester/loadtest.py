@@ -0,0 +1,224 @@
+"""Soak and load testing of manifest generation against a local imitation of the RHSM API.
+
+A number of worker threads repeatedly generate a manifest and delete its allocation, each cycle
+with a new Manifester instance, until a duration has passed or a number of cycles has completed.
+Every request goes to a local RhsmStubServer, which can delay responses and answer a fraction of
+them with HTTP 429, so that token churn, rate limiting, inventory contention and memory growth can
+be observed without touching RHSM. The phases of every cycle are timed with trace spans.
+
+The inventory is written to a temporary file for the duration of the run, and downloaded manifests
+are removed as soon as each cycle completes.
+"""
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - resource is not available on Windows
+    resource = None
+
+from manifester import tracing
+from manifester.bench import PERCENTILES, percentiles
+from manifester.concurrency import limiter_metrics
+from manifester.logger import _logger as logger
+from manifester.manifester import Manifester
+from manifester.settings import settings
+from manifester.stub import RhsmStubServer
+
+
+def _rss_bytes():
+    """Return the current resident set size of the process, or None where it is unavailable."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _peak_rss_bytes():
+    """Return the peak resident set size of the process, or None where it is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+@contextmanager
+def _temporary_inventory():
+    """Point the inventory_path setting at a temporary file for the duration of the block."""
+    original = settings.get("inventory_path")
+    with tempfile.TemporaryDirectory(prefix="manifester-load-") as directory:
+        inventory_path = Path(directory, "inventory.yaml")
+        inventory_path.touch()
+        settings.set("inventory_path", str(inventory_path))
+        try:
+            yield inventory_path
+        finally:
+            settings.set("inventory_path", original)
+
+
+class LoadTest:
+    """Concurrent manifest generation and deletion cycles against a stub RHSM API.
+
+    :param workers: number of threads running cycles at the same time
+    :param duration: seconds after which no new cycle is started
+    :param iterations: total number of cycles to run
+    :param category: overrides of the stub's manifest category, such as subscription_data
+    """
+
+    def __init__(self, stub, workers=10, duration=None, iterations=None, category=None):
+        if duration is None and iterations is None:
+            raise ValueError("A load test needs a duration or a number of iterations.")
+        self.stub = stub
+        self.workers = workers
+        self.duration = duration
+        self.iterations = iterations
+        self.category = category or {}
+        self.cycle_times = []
+        self.errors = {}
+        self._started_cycles = 0
+        self._lock = threading.Lock()
+
+    def _claim_cycle(self, deadline):
+        with self._lock:
+            if self.iterations is not None and self._started_cycles >= self.iterations:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            self._started_cycles += 1
+            return self._started_cycles
+
+    def _cycle(self, number):
+        started = time.perf_counter()
+        manifester = Manifester(
+            manifest_category=self.stub.manifest_category(
+                **dict({"username_prefix": f"load{number}"}, **self.category)
+            )
+        )
+        manifest = manifester.get_manifest()
+        manifester.delete_subscription_allocation()
+        manifest.path.unlink(missing_ok=True)
+        return time.perf_counter() - started
+
+    def _worker(self, deadline):
+        while (number := self._claim_cycle(deadline)) is not None:
+            try:
+                elapsed = self._cycle(number)
+            except Exception as err:  # noqa: BLE001 - failures are counted in the report
+                logger.debug("Load test cycle %s failed: %s", number, err)
+                with self._lock:
+                    name = type(err).__name__
+                    self.errors[name] = self.errors.get(name, 0) + 1
+            else:
+                with self._lock:
+                    self.cycle_times.append(elapsed)
+
+    def run(self):
+        """Run the cycles and return a report of throughput, latency, retries and memory."""
+        tracer = tracing.active_tracer()
+        owns_tracer = tracer is None
+        if owns_tracer:
+            tracer = tracing.start(None)
+        rss_before = _rss_bytes()
+        started_at = time.time_ns() // 1000
+        started = time.monotonic()
+        deadline = started + self.duration if self.duration is not None else None
+        try:
+            with _temporary_inventory():
+                threads = [
+                    threading.Thread(target=self._worker, args=(deadline,), name=f"load-{num}")
+                    for num in range(self.workers)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            elapsed = time.monotonic() - started
+            spans = [span for span in tracer.spans if span.start >= started_at]
+            if owns_tracer:
+                tracing.stop()
+        phases = {}
+        for span in spans:
+            phases.setdefault(span.name, []).append(span.duration / 1_000_000)
+        return {
+            "workers": self.workers,
+            "seconds": round(elapsed, 3),
+            "manifests": len(self.cycle_times),
+            "manifests_per_minute": round(len(self.cycle_times) / elapsed * 60, 2),
+            "errors": dict(self.errors),
+            "cycle": percentiles(self.cycle_times),
+            "phases": {name: percentiles(durations) for name, durations in phases.items()},
+            "requests": sum(self.stub.requests.values()),
+            "token_requests": self.stub.requests["token"],
+            # Manifester retries every rate limited response
+            "retries": self.stub.requests["rate_limited"],
+            "rss_growth_bytes": (
+                _rss_bytes() - rss_before if rss_before is not None else None
+            ),
+            "peak_rss_bytes": _peak_rss_bytes(),
+            # Only set when the category enables adaptive_concurrency
+            "concurrency": next(
+                (
+                    metrics
+                    for (url, _), metrics in limiter_metrics().items()
+                    if url == self.stub.allocations_url
+                ),
+                None,
+            ),
+        }
+
+
+def run_load_test(
+    *, workers=10, duration=None, iterations=None, latency=0, rate_limit=0, category=None
+):
+    """Start a stub RHSM API and run a load test against it, returning the report."""
+    with RhsmStubServer(latency=latency, rate_limit=rate_limit) as stub:
+        logger.info(
+            "Running load test with %s workers against a stub RHSM API at %s",
+            workers,
+            stub.base_url,
+        )
+        return LoadTest(
+            stub, workers=workers, duration=duration, iterations=iterations, category=category
+        ).run()
+
+
+def format_report(report):
+    """Return the lines of a human readable summary of a load test report."""
+    lines = [
+        f"{report['manifests']} manifests in {report['seconds']} s with {report['workers']} "
+        f"workers ({report['manifests_per_minute']} per minute)",
+        f"requests: {report['requests']}, token requests: {report['token_requests']}, "
+        f"retries: {report['retries']}",
+    ]
+    if report["errors"]:
+        errors = ", ".join(f"{name}: {count}" for name, count in report["errors"].items())
+        lines.append(f"errors: {errors}")
+    if report["concurrency"] is not None:
+        concurrency = report["concurrency"]
+        lines.append(
+            f"adaptive concurrency limit: {concurrency['limit']} "
+            f"(peak {concurrency['peak_in_flight']} in flight, "
+            f"{concurrency['decreases']} decreases)"
+        )
+    if report["peak_rss_bytes"] is not None:
+        lines.append(f"peak RSS: {report['peak_rss_bytes'] / 2**20:.1f} MiB")
+    if report["rss_growth_bytes"] is not None:
+        lines.append(f"RSS growth: {report['rss_growth_bytes'] / 2**20:.1f} MiB")
+    lines.append(f"{'times in ms':<32}" + "".join(f"{f'p{point}':>10}" for point in PERCENTILES))
+
+    def row(label, values):
+        if values[PERCENTILES[0]] is None:
+            return f"{label:<32}"
+        cells = "".join(f"{values[point] * 1000:>10.1f}" for point in PERCENTILES)
+        return f"{label:<32}{cells}"
+
+    lines.append(row("cycle", report["cycle"]))
+    lines.extend(row(f"  {name}", values) for name, values in sorted(report["phases"].items()))
+    return lines
@@ -1,7 +1,10 @@
 """Defines manifester's internal logging."""
 
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+import queue
 
 from dynaconf import Dynaconf
 import logzero
@@ -15,6 +18,54 @@ temp_settings = Dynaconf(
     load_dotenv=False,
 )
 
+_queue_listeners = {}
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves all formatting to the handlers of the queue listener.
+
+    The standard QueueHandler formats each record on the calling thread so that it can be pickled.
+    Records are only passed between threads of the same process here, so formatting is deferred
+    until the listener thread emits the record. Arguments passed to a logging call should therefore
+    not be modified after the call is made.
+    """
+
+    def prepare(self, record):
+        """Return the record unchanged."""
+        return record
+
+
+def _stop_queue_listener(logger):
+    """Stop the logger's queue listener, flushing queued records, and reattach its handlers."""
+    listener = _queue_listeners.pop(logger.name, None)
+    if listener is None:
+        return
+    listener.stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, DeferredQueueHandler):
+            logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
+def _start_queue_listener(logger):
+    """Move the logger's handlers to a queue listener that emits records on a background thread."""
+    log_queue = queue.SimpleQueue()
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _queue_listeners[logger.name] = listener
+
+
+@atexit.register
+def _stop_queue_listeners():
+    """Flush all queued log records before the interpreter exits."""
+    for name in list(_queue_listeners):
+        _stop_queue_listener(logging.getLogger(name))
+
 
 def _setup_logzero(
     level=temp_settings.get("log_level", "info"),
@@ -22,8 +73,14 @@ def _setup_logzero(
     name=None,
     formatter=None,
     silent=True,
+    *,
+    log_async=temp_settings.get("log_async", False),
 ):
-    """Call logzero setup with the given settings."""
+    """Call logzero setup with the given settings.
+
+    If log_async is set, records are written to the log file by a background thread instead of the
+    thread that logs them.
+    """
     Path(path).parent.mkdir(parents=True, exist_ok=True)
     log_fmt = "%(color)s[%(levelname)s %(asctime)s]%(end_color)s %(message)s"
     debug_fmt = (
@@ -38,6 +95,7 @@ def _setup_logzero(
     formatter = logzero.LogFormatter(
         fmt=debug_fmt if log_level is logging.DEBUG else log_fmt, color=False
     )
+    _stop_queue_listener(logging.getLogger(name))
     logger = logzero.setup_logger(
         name=name,
         formatter=formatter,
@@ -47,6 +105,8 @@ def _setup_logzero(
         backupCount=3,
         disableStderrLogger=silent,
     )
+    if log_async:
+        _start_queue_listener(logger)
     return logger
 
 
@@ -55,6 +115,17 @@ _logger = _setup_logzero()
 del temp_settings
 
 
-def setup_logzero(level, path, name=None, silent=True):
+def log_directory(name="manifester"):
+    """Return the directory of the logger's log file, the logs directory if it has none."""
+    logger = logging.getLogger(name)
+    listener = _queue_listeners.get(name)
+    handlers = list(logger.handlers) + list(listener.handlers if listener else [])
+    for handler in handlers:
+        if getattr(handler, "baseFilename", None):
+            return Path(handler.baseFilename).parent
+    return Path("logs")
+
+
+def setup_logzero(level, path, name=None, silent=True, log_async=False):
     """Call logzero setup with the given settings."""
-    _logger = _setup_logzero(level, path, name, silent)
+    _logger = _setup_logzero(level, path, name, silent=silent, log_async=log_async)
@@ -3,6 +3,7 @@
 This module defines the `Manifester` class, which provides methods for authenticating to and
 interacting with the RHSM Subscription API for the purpose of generating a subscription manifest.
 """
+from contextlib import contextmanager, nullcontext
 from functools import cached_property
 from pathlib import Path
 import random
@@ -11,13 +12,37 @@ import string
 from dynaconf.utils.boxing import DynaBox
 from requests.exceptions import RequestException, Timeout
 
+from manifester import profiling, tracing
+from manifester.accounts import ACCOUNT_SELECTOR, AccountRequester, category_accounts
+from manifester.concurrency import DEFAULT_MAX_LIMIT, AdaptiveRequester, adaptive_limiter
+from manifester.deadlines import DEFAULT_REQUEST_TIMEOUT, DeadlineExceeded, deadline
+from manifester.hedging import (
+    DEFAULT_HEDGE_BUDGET,
+    DEFAULT_HEDGE_MIN_DELAY,
+    DEFAULT_HEDGE_PERCENTILE,
+    HedgingRequester,
+)
 from manifester.helpers import (
+    POOL_CATALOG,
+    applied_response,
+    claim_parked_allocation,
+    fetch_cached_json,
     fetch_paginated_data,
+    iter_paginated_data,
+    park_allocation,
     process_sat_version,
     simple_retry,
     update_inventory,
 )
+from manifester.journal import AllocationJournal, discard_journal, load_journals
 from manifester.logger import _logger as logger
+from manifester.preflight import (
+    DEFAULT_CATALOG_TTL,
+    SubscriptionCatalog,
+    check_subscription_data,
+)
+from manifester.reservations import get_ledger
+from manifester.scheduling import DEFAULT_PRIORITY, PRIORITIES, SCHEDULED_OPERATIONS, SCHEDULER
 from manifester.settings import settings
 
 
@@ -32,9 +57,13 @@ class Manifester:
         proxies=None,
         **kwargs,
     ):
+        self.category_name = manifest_category if isinstance(manifest_category, str) else None
         if minimal_init:
+            self.account = kwargs.get("account")
             if kwargs.get("offline_token") is not None:
                 self.offline_token = kwargs.get("offline_token")
+            elif self.account is not None:
+                self.offline_token = self.account.offline_token
             elif settings.get("offline_token") is not None:
                 self.offline_token = settings.get("offline_token")
             else:
@@ -50,38 +79,26 @@ class Manifester:
             }
             self.manifest_data = {"proxies": proxies}
             self.username_prefix = settings.get("username_prefix")
-            if kwargs.get("requester") is not None:
-                self.requester = kwargs["requester"]
-                self.is_mock = True
-            else:
-                import requests
-
-                self.requester = requests
-                self.is_mock = False
+            self._init_optional_settings(kwargs)
+            self._init_requester(kwargs)
+            self._init_adaptive_concurrency(kwargs)
+            self._init_hedging(kwargs)
         else:
             if isinstance(manifest_category, dict):
                 self.manifest_data = DynaBox(manifest_category)
             else:
                 self.manifest_data = settings.manifest_category.get(manifest_category)
-            if kwargs.get("requester") is not None:
-                self.requester = kwargs["requester"]
-                self.is_mock = True
-            else:
-                import requests
-
-                self.requester = requests
-                self.is_mock = False
+            self._init_requester(kwargs)
             self.username_prefix = (
                 self.manifest_data.get("username_prefix") or settings.username_prefix
             )
+            self._allocation_name_requested = allocation_name is not None
             self.allocation_name = allocation_name or f"{self.username_prefix}-" + "".join(
                 random.sample(string.ascii_letters, 8)
             )
             self.manifest_name = Path(f"{self.allocation_name}_manifest.zip")
-            self.offline_token = self.manifest_data.get(
-                "offline_token", settings.get("offline_token")
-            )
             self.subscription_data = self.manifest_data.subscription_data
+            self._init_account(kwargs)
             self.token_request_data = {
                 "grant_type": "refresh_token",
                 "client_id": "rhsm-api",
@@ -96,11 +113,182 @@ class Manifester:
             self._allocations = None
             self._subscription_pools = None
             self._active_pools = []
+            self._pool_quantities = {}
+            self._create_sent = False
+            self._journal = None
+            self._unverified_subscriptions = None
+            self._init_optional_settings(kwargs)
+            self._init_adaptive_concurrency(kwargs)
+            self._init_hedging(kwargs)
             self.sat_version = process_sat_version(
                 kwargs.get("sat_version", self.manifest_data.sat_version),
                 self.valid_sat_versions,
             )
 
+    def _init_requester(self, kwargs):
+        """Sets the module or object used to send requests to the RHSM API."""
+        if kwargs.get("requester") is not None:
+            self.requester = kwargs["requester"]
+            # Requesters that return real responses, such as cassette replayers, opt out of mocking
+            self.is_mock = getattr(self.requester, "is_mock", True) is not False
+            # Cassettes must see every request, so they opt out of the metadata cache
+            self.use_metadata_cache = getattr(self.requester, "use_metadata_cache", True)
+        else:
+            import requests
+
+            self.requester = requests
+            self.is_mock = False
+            self.use_metadata_cache = True
+
+    @contextmanager
+    def _phase(self, name):
+        """Applies the phase's time budget and records it in the active profile and trace.
+
+        Operations wait for a slot from the scheduler first, if concurrency is limited. A failed
+        phase stops counting the manifest as in flight in its account.
+        """
+        try:
+            with (
+                deadline(self.phase_budgets.get(name), name),
+                self._scheduled(name),
+                profiling.phase(name),
+                self._span(name),
+            ):
+                yield
+        except BaseException:
+            self._release_account()
+            raise
+
+    def _scheduled(self, operation):
+        """Returns a context manager that holds a scheduler slot for the operation, if needed."""
+        if operation not in SCHEDULED_OPERATIONS or not any(self.concurrency_limits):
+            return nullcontext()
+        account = getattr(self, "account", None)
+        return SCHEDULER.slot(
+            operation,
+            priority=self.priority,
+            category=self.category_name,
+            account=account.name if account is not None else None,
+            limits=self.concurrency_limits,
+        )
+
+    @contextmanager
+    def _span(self, name, **attributes):
+        """Records the block as a trace span linked to this instance's allocation."""
+        with tracing.span(
+            name,
+            allocation_name=getattr(self, "allocation_name", None),
+            allocation_uuid=getattr(self, "allocation_uuid", None),
+            **attributes,
+        ) as span:
+            try:
+                yield span
+            finally:
+                # The UUID of a new allocation is only known once it has been created
+                span.set("allocation_uuid", getattr(self, "allocation_uuid", None))
+
+    def _init_adaptive_concurrency(self, kwargs):
+        """Limits RHSM API requests in flight adaptively, if adaptive_concurrency is set.
+
+        Instances that use the same API and account share a limiter.
+        """
+        if not self._optional_setting(kwargs, "adaptive_concurrency", False):
+            return
+        account = getattr(self, "account", None)
+        limiter = adaptive_limiter(
+            (self.allocations_url, account.name if account is not None else None),
+            maximum=self._optional_setting(kwargs, "adaptive_concurrency_max", DEFAULT_MAX_LIMIT),
+        )
+        self.requester = AdaptiveRequester(self.requester, limiter, self.allocations_url)
+
+    def _init_hedging(self, kwargs):
+        """Wraps the requester so that slow GET requests are hedged, if hedge_requests is set."""
+        if not self._optional_setting(kwargs, "hedge_requests", False):
+            return
+        self.requester = HedgingRequester(
+            self.requester,
+            percentile=self._optional_setting(
+                kwargs, "hedge_percentile", DEFAULT_HEDGE_PERCENTILE
+            ),
+            min_delay=self._optional_setting(kwargs, "hedge_min_delay", DEFAULT_HEDGE_MIN_DELAY),
+            budget=self._optional_setting(kwargs, "hedge_budget", DEFAULT_HEDGE_BUDGET),
+        )
+
+    def _init_account(self, kwargs):
+        """Sets the account to create the allocation in, choosing one if several are listed.
+
+        An account passed in kwargs, such as the account of a resumed allocation, is used as is.
+        """
+        if kwargs.get("account") is not None:
+            self.account = kwargs["account"]
+            self.offline_token = self.account.offline_token
+            self.requester = AccountRequester(self.requester, self.account)
+            return
+        accounts = category_accounts(self.manifest_data)
+        if not accounts:
+            self.account = None
+            self.offline_token = self.manifest_data.get(
+                "offline_token", settings.get("offline_token")
+            )
+            return
+        self.account = ACCOUNT_SELECTOR.select(accounts, self.subscription_data)
+        self.offline_token = self.account.offline_token
+        self.requester = AccountRequester(self.requester, self.account)
+
+    def _acquire_account(self):
+        """Counts this instance's manifest as in flight in its account until it is released."""
+        if self.account is not None and not getattr(self, "_account_in_flight", False):
+            ACCOUNT_SELECTOR.acquire(self.account)
+            self._account_in_flight = True
+
+    def _release_account(self):
+        """Stops counting this instance's manifest as in flight in its account."""
+        if getattr(self, "_account_in_flight", False):
+            ACCOUNT_SELECTOR.release(self.account)
+            self._account_in_flight = False
+
+    def _optional_setting(self, kwargs, name, default=None):
+        """Returns an optional setting from kwargs, the manifest category, or global settings."""
+        if name in kwargs:
+            return kwargs[name]
+        return self.manifest_data.get(name, settings.get(name, default))
+
+    def _init_optional_settings(self, kwargs):
+        """Sets the optional behaviours enabled per instance, per category or in settings."""
+        self.pool_catalog_ttl = self._optional_setting(kwargs, "pool_catalog_ttl", 0)
+        self.recycle_allocations = self._optional_setting(kwargs, "recycle_allocations", False)
+        self.raw_records = self._optional_setting(kwargs, "raw_records", False)
+        self.stream_pools = self._optional_setting(kwargs, "stream_pools", True)
+        self.metadata_cache_ttl = self._optional_setting(kwargs, "metadata_cache_ttl", 86400)
+        self.bypass_metadata_cache = self._optional_setting(kwargs, "bypass_metadata_cache", False)
+        self.preflight = self._optional_setting(kwargs, "preflight", False)
+        self.subscription_catalog_ttl = self._optional_setting(
+            kwargs, "subscription_catalog_ttl", DEFAULT_CATALOG_TTL
+        )
+        self.reservation_ledger = get_ledger(
+            self._optional_setting(kwargs, "reservation_ledger", False)
+        )
+        self.request_timeout = self._optional_setting(
+            kwargs, "request_timeout", DEFAULT_REQUEST_TIMEOUT
+        )
+        self.manifest_deadline = self._optional_setting(kwargs, "manifest_deadline", None)
+        self.phase_budgets = self._optional_setting(kwargs, "phase_budgets", None) or {}
+        self.profile = self._optional_setting(kwargs, "profile", False)
+        self.journal = self._optional_setting(kwargs, "journal", False)
+        self.priority = self._optional_setting(kwargs, "priority", DEFAULT_PRIORITY)
+        if self.priority not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority {self.priority!r}. Valid priorities are {', '.join(PRIORITIES)}."
+            )
+        self.concurrency_limits = (
+            self._optional_setting(kwargs, "max_concurrent_operations", None),
+            self._optional_setting(kwargs, "category_concurrency", None),
+            self._optional_setting(kwargs, "account_concurrency", None),
+        )
+        trace_file = self._optional_setting(kwargs, "trace_file", None)
+        if trace_file:
+            tracing.start(trace_file, otel=self._optional_setting(kwargs, "otel_tracing", False))
+
     @property
     def access_token(self):
         """Representation of an RHSM API access token.
@@ -108,13 +296,14 @@ class Manifester:
         Used to authenticate requests to the RHSM API.
         """
         if not self._access_token:
-            token_request_data = {"data": self.token_request_data}
+            token_request_data = {"data": self.token_request_data, "timeout": self.request_timeout}
             logger.debug("Generating access token")
-            token_data = simple_retry(
-                self.requester.post,
-                cmd_args=[f"{self.token_request_url}"],
-                cmd_kwargs=token_request_data,
-            ).json()
+            with self._phase("token"):
+                token_data = simple_retry(
+                    self.requester.post,
+                    cmd_args=[f"{self.token_request_url}"],
+                    cmd_kwargs=token_request_data,
+                ).json()
             if "error" in token_data:
                 raise RequestException(f"{token_data['error']}: {token_data['error_description']}")
             if self.is_mock:
@@ -125,10 +314,23 @@ class Manifester:
 
     @cached_property
     def valid_sat_versions(self):
-        """Retrieves the list of valid Satellite versions from the RHSM API."""
+        """Retrieves the list of valid Satellite versions from the RHSM API.
+
+        The response is cached on disk for metadata_cache_ttl seconds, since the valid versions
+        rarely change, unless a cassette is being recorded or replayed.
+        """
+        if self.metadata_cache_ttl and self.use_metadata_cache and not self.is_mock:
+            sat_versions_response = fetch_cached_json(
+                self,
+                f"{self.allocations_url}/versions",
+                ttl=self.metadata_cache_ttl,
+                bypass=self.bypass_metadata_cache,
+            )
+            return [ver_dict["value"] for ver_dict in sat_versions_response["body"]]
         headers = {
             "headers": {"Authorization": f"Bearer {self.access_token}"},
             "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
         }
         sat_versions_response = simple_retry(
             self.requester.get,
@@ -144,106 +346,376 @@ class Manifester:
     def subscription_allocations(self):
         """Representation of subscription allocations in an account.
 
-        Filtered by username_prefix.
+        Filtered by username_prefix. Allocations are tagged with the name of the account that they
+        belong to when several accounts are configured.
         """
-        return fetch_paginated_data(self, "allocations")
+        allocations = fetch_paginated_data(self, "allocations")
+        if self.account is None:
+            return allocations
+        return [dict(allocation, account=self.account.name) for allocation in allocations]
 
     @property
     def subscription_pools(self):
-        """Representation of subscription pools in an account."""
-        return fetch_paginated_data(self, "pools")
+        """Representation of subscription pools in an account.
+
+        Served from the shared pool catalog when pool_catalog_ttl is set.
+        """
+        if self.pool_catalog_ttl:
+            return POOL_CATALOG.pools(self, self.pool_catalog_ttl)
+        pools = fetch_paginated_data(self, "pools")
+        if self.preflight:
+            # Complete pool listings keep the subscription catalog used by preflight checks fresh
+            SubscriptionCatalog().update(self, pools["body"])
+        return pools
+
+    def iter_subscription_pools(self):
+        """Yields the subscription pools in an account, fetching each page only when needed."""
+        return iter_paginated_data(self, "pools")
+
+    def _pools_to_match(self):
+        """Returns the subscription pools to search when attaching a subscription.
+
+        Pools are streamed page by page so that matching can stop as soon as a pool with enough
+        capacity is found, unless they are served from the shared pool catalog.
+        """
+        if self.stream_pools and not self.pool_catalog_ttl:
+            return self.iter_subscription_pools()
+        return self.subscription_pools
+
+    def _refresh_subscription_pools(self):
+        """Discards the cached subscription pools so that they are fetched again when needed."""
+        self._subscription_pools = None
+        if self.pool_catalog_ttl:
+            POOL_CATALOG.invalidate(self)
+
+    def _record_attachment(self, pool, quantity):
+        """Records a successful attachment of entitlements from a subscription pool."""
+        self._active_pools.append(pool)
+        self._pool_quantities[pool["id"]] = self._pool_quantities.get(pool["id"], 0) + quantity
+        if self._journal is not None:
+            self._journal.record_attachment(pool["id"], pool["subscriptionName"], quantity)
+        if self.pool_catalog_ttl:
+            POOL_CATALOG.consume(self, pool["id"], quantity)
+        if self.account is not None:
+            ACCOUNT_SELECTOR.record_capacity(
+                self.account, pool["subscriptionName"], pool["entitlementsAvailable"] - quantity
+            )
+
+    def _reserve_matches(self, matching, quantity):
+        """Yields matching pools with the ID of the reservation made in the reservation ledger.
+
+        Pools whose available entitlements are reserved by other instances are deferred until every
+        other matching pool has been tried, and are then yielded without a reservation.
+        """
+        if self.reservation_ledger is None:
+            for match in matching:
+                yield match, None
+            return
+        contended = []
+        for match in matching:
+            if match["entitlementsAvailable"] <= quantity and match["entitlementsAvailable"] != -1:
+                # Pools without enough entitlements are skipped by the caller
+                yield match, None
+                continue
+            reservation_id = self.reservation_ledger.reserve(match, quantity)
+            if reservation_id is None:
+                contended.append(match)
+            else:
+                yield match, reservation_id
+        for match in contended:
+            yield match, None
+
+    def _release_reservation(self, reservation_id):
+        """Releases a reservation made in the reservation ledger once its attachment is settled."""
+        if reservation_id is not None:
+            self.reservation_ledger.release(reservation_id)
+
+    def validate_subscription_data(self, refresh=False):
+        """Checks the requested subscriptions against the account's subscription catalog.
+
+        The cached catalog is used unless it is older than subscription_catalog_ttl or refresh is
+        set, in which case it is rebuilt from an existing allocation in the account.
+
+        :return: list of problems found, or None if the account has no allocation to list its
+            subscriptions from
+        """
+        catalog = SubscriptionCatalog()
+        subscriptions = None if refresh else catalog.get(self, self.subscription_catalog_ttl)
+        if subscriptions is None:
+            subscriptions = catalog.refresh(self)
+        if subscriptions is None:
+            return None
+        return check_subscription_data(self.subscription_data, subscriptions)
+
+    def _preflight(self):
+        """Fails before any allocation is created if the requested subscriptions are unavailable.
+
+        Problems found in the cached catalog are confirmed against a refreshed catalog first, so
+        that a stale cache entry cannot fail a manifest that the account can fulfil.
+        """
+        problems = self.validate_subscription_data()
+        if problems:
+            logger.debug("Refreshing the subscription catalog to confirm: %s", " ".join(problems))
+            problems = self.validate_subscription_data(refresh=True)
+        if problems is None:
+            logger.debug("Skipping preflight check, no subscription catalog is available.")
+        elif problems:
+            raise ValueError(
+                f"Manifest category cannot be fulfilled by the account: {' '.join(problems)}"
+            )
 
     def create_subscription_allocation(self):
-        """Creates a new consumer in the provided RHSM account and returns its UUID."""
-        allocation_data = {
-            "headers": {"Authorization": f"Bearer {self.access_token}"},
-            "proxies": self.manifest_data.get("proxies"),
-            "params": {
-                "name": f"{self.allocation_name}",
-                "version": f"{self.sat_version}",
-                "simpleContentAccess": f"{self.simple_content_access}",
-            },
-        }
-        self.allocation = simple_retry(
-            self.requester.post,
-            cmd_args=[f"{self.allocations_url}"],
-            cmd_kwargs=allocation_data,
-        ).json()
-        logger.debug(f"Received response {self.allocation} when attempting to create allocation.")
-        self.allocation_uuid = (
-            self.allocation.uuid if self.is_mock else self.allocation["body"]["uuid"]
-        )
-        if self.simple_content_access == "disabled":
-            simple_retry(
-                self.requester.put,
-                cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}"],
-                cmd_kwargs={
-                    "headers": {"Authorization": f"Bearer {self.access_token}"},
-                    "proxies": self.manifest_data.get("proxies"),
-                    "json": {"simpleContentAccess": "disabled"},
+        """Creates a new consumer in the provided RHSM account and returns its UUID.
+
+        When recycle_allocations is enabled, a parked allocation with a matching Satellite version
+        and Simple Content Access setting is reused instead of creating a new one.
+        """
+        self._acquire_account()
+        if self.recycle_allocations and not self._allocation_name_requested:
+            parked = claim_parked_allocation(
+                self.sat_version,
+                self.simple_content_access,
+                account=self.account.name if self.account else None,
+            )
+            if parked:
+                self.allocation = parked
+                self.allocation_uuid = parked["uuid"]
+                self.allocation_name = parked["name"]
+                self.manifest_name = Path(f"{self.allocation_name}_manifest.zip")
+                logger.info(
+                    f"Reusing parked subscription allocation {self.allocation_name} with UUID "
+                    f"{self.allocation_uuid}"
+                )
+                self._start_journal()
+                update_inventory(self.subscription_allocations, uuid=self.allocation_uuid)
+                return self.allocation_uuid
+        with self._phase("create"):
+            allocation_data = {
+                "headers": {"Authorization": f"Bearer {self.access_token}"},
+                "proxies": self.manifest_data.get("proxies"),
+                "timeout": self.request_timeout,
+                "params": {
+                    "name": f"{self.allocation_name}",
+                    "version": f"{self.sat_version}",
+                    "simpleContentAccess": f"{self.simple_content_access}",
                 },
+            }
+            self._create_sent = True
+            self.allocation = simple_retry(
+                self.requester.post,
+                cmd_args=[f"{self.allocations_url}"],
+                cmd_kwargs=allocation_data,
+                before_retry=self._adopt_created_allocation,
+            ).json()
+            logger.debug(
+                "Received response %s when attempting to create allocation.", self.allocation
+            )
+            self.allocation_uuid = (
+                self.allocation.uuid if self.is_mock else self.allocation["body"]["uuid"]
             )
+            if self.simple_content_access == "disabled":
+                simple_retry(
+                    self.requester.put,
+                    cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}"],
+                    cmd_kwargs={
+                        "headers": {"Authorization": f"Bearer {self.access_token}"},
+                        "proxies": self.manifest_data.get("proxies"),
+                        "timeout": self.request_timeout,
+                        "json": {"simpleContentAccess": "disabled"},
+                    },
+                )
         logger.info(
             f"Subscription allocation created with name {self.allocation_name} "
             f"and UUID {self.allocation_uuid}"
         )
+        self._start_journal()
         update_inventory(self.subscription_allocations, uuid=self.allocation_uuid)
         return self.allocation_uuid
 
-    def delete_subscription_allocation(self, uuid=None):
-        """Deletes the specified subscription allocation and returns the RHSM API's response."""
-        self._access_token = None
+    def _start_journal(self):
+        """Starts the journal of the allocation's completed steps, if journaling is enabled."""
+        if not self.journal or self.is_mock:
+            return
+        self._journal = AllocationJournal.start(
+            self.allocation_uuid,
+            self.allocation_name,
+            manifest_category=self.category_name,
+            account=self.account.name if self.account is not None else None,
+        )
+
+    def _discard_journal(self, uuid):
+        """Discards the journal of an allocation, through this instance's journal if it holds it."""
+        journal = getattr(self, "_journal", None)
+        if journal is not None and journal.entry["uuid"] == uuid:
+            journal.discard()
+            self._journal = None
+        else:
+            discard_journal(uuid)
+
+    def find_allocation_by_name(self, name=None):
+        """Looks up an allocation in the account by name, the allocation's own name by default.
+
+        Returns the allocation as listed by the API, or None if there is no such allocation.
+        Only allocations whose names start with the username prefix are found.
+        """
+        name = name or self.allocation_name
+        self._allocations = None
+        return next(
+            (a for a in iter_paginated_data(self, "allocations") if a["name"] == name), None
+        )
+
+    def _adopt_created_allocation(self, response):
+        """Returns the allocation created by a failed request to create it, if there is one."""
+        existing = self.find_allocation_by_name()
+        if existing is None:
+            return None
+        logger.warning(
+            f"Received response status {response.status_code}, but subscription allocation "
+            f"{self.allocation_name} was created with UUID {existing['uuid']}. Adopting it."
+        )
+        return applied_response({"body": {"uuid": existing["uuid"], "name": existing["name"]}})
+
+    def _delete_allocation(self, uuid):
+        """Sends the request to delete a subscription allocation without updating the inventory."""
         data = {
             "headers": {"Authorization": f"Bearer {self.access_token}"},
             "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
             "params": {"force": "true"},
         }
-        response = simple_retry(
+        return simple_retry(
             self.requester.delete,
-            cmd_args=[f"{self.allocations_url}/{uuid if uuid else self.allocation_uuid}"],
+            cmd_args=[f"{self.allocations_url}/{uuid}"],
             cmd_kwargs=data,
         )
+
+    def delete_subscription_allocation(self, uuid=None):
+        """Deletes the specified subscription allocation and returns the RHSM API's response."""
+        self._release_account()
+        self._access_token = None
+        with self._phase("delete"):
+            response = self._delete_allocation(uuid if uuid else self.allocation_uuid)
+        self._discard_journal(uuid if uuid else self.allocation_uuid)
         update_inventory(
             self.subscription_allocations, remove=True, uuid=uuid if uuid else self.allocation_uuid
         )
         return response
 
+    def release_subscription_allocation(self, uuid=None):
+        """Detaches all entitlements from the allocation and parks it in the inventory for reuse.
+
+        The allocation is deleted instead if any of its entitlements cannot be detached.
+        """
+        uuid = uuid if uuid else self.allocation_uuid
+        self._access_token = None
+        data = {
+            "headers": {"Authorization": f"Bearer {self.access_token}"},
+            "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
+        }
+        self._fetch_attached_entitlements(uuid=uuid)
+        for entitlement in self.entitlement_data["body"]["entitlementsAttached"]["value"]:
+            response = simple_retry(
+                self.requester.delete,
+                cmd_args=[f"{self.allocations_url}/{uuid}/entitlements/{entitlement['id']}"],
+                cmd_kwargs=data,
+            )
+            if response.status_code not in [200, 204]:
+                logger.warning(
+                    f"Unable to detach entitlement {entitlement['id']} from allocation {uuid}. "
+                    f"Received response status {response.status_code}. Deleting the allocation."
+                )
+                return self.delete_subscription_allocation(uuid=uuid)
+        if self.pool_catalog_ttl:
+            # Detached entitlements are returned to their pools
+            POOL_CATALOG.invalidate(self)
+        park_allocation(uuid)
+        self._discard_journal(uuid)
+        self._release_account()
+        logger.info(f"Subscription allocation {uuid} parked for reuse.")
+
     def add_entitlements_to_allocation(self, pool_id, entitlement_quantity):
         """Attempts to add the set of subscriptions defined in the settings to the allocation."""
         data = {
             "headers": {"Authorization": f"Bearer {self.access_token}"},
             "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
             "params": {"pool": f"{pool_id}", "quantity": f"{entitlement_quantity}"},
         }
         add_entitlements = simple_retry(
             self.requester.post,
             cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}/entitlements"],
             cmd_kwargs=data,
+            before_retry=lambda response: self._applied_attachment(
+                response, pool_id, entitlement_quantity
+            ),
         )
         return add_entitlements
 
-    def verify_allocation_entitlements(self, entitlement_quantity, subscription_name):
-        """Checks that the entitlements in the allocation match those defined in settings."""
-        logger.info(f"Verifying the entitlement quantity of {subscription_name} on the allocation.")
+    def _applied_attachment(self, response, pool_id, entitlement_quantity):
+        """Returns a successful response if a failed attach request added its entitlements.
+
+        The entitlements attached from the pool are compared with those recorded by this instance.
+        If the API does not report which pool each entitlement came from, None is returned and the
+        request is repeated.
+        """
+        entitlements = self.get_allocation_details()["body"]["entitlementsAttached"]["value"]
+        if any("pool" not in entitlement for entitlement in entitlements):
+            return None
+        attached = sum(e["entitlementQuantity"] for e in entitlements if e["pool"] == pool_id)
+        if attached - self._pool_quantities.get(pool_id, 0) < entitlement_quantity:
+            return None
+        logger.warning(
+            f"Received response status {response.status_code}, but {entitlement_quantity} "
+            f"entitlements from pool {pool_id} were attached. Not attaching them again."
+        )
+        return applied_response(
+            {"body": {"pool": pool_id, "entitlementQuantity": entitlement_quantity}}
+        )
+
+    def get_allocation_details(self, uuid=None):
+        """Retrieves a subscription allocation including its attached entitlements."""
         data = {
             "headers": {"Authorization": f"Bearer {self.access_token}"},
             "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
             "params": {"include": "entitlements"},
         }
-        self.entitlement_data = simple_retry(
-            self.requester.get,
-            cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}"],
-            cmd_kwargs=data,
-        ).json()
-        current_entitlement = [
-            d
-            for d in self.entitlement_data["body"]["entitlementsAttached"]["value"]
-            if d["subscriptionName"] == subscription_name
-        ]
-        if not current_entitlement:
+        with self._phase("details"):
+            allocation_details = simple_retry(
+                self.requester.get,
+                cmd_args=[f"{self.allocations_url}/{uuid if uuid else self.allocation_uuid}"],
+                cmd_kwargs=data,
+            ).json()
+        if self.is_mock:
+            allocation_details = allocation_details.entitlement_response
+        return allocation_details
+
+    def _fetch_attached_entitlements(self, uuid=None):
+        """Retrieves the allocation's attached entitlements indexed by subscription name.
+
+        A single request is made for the whole allocation. Quantities of subscriptions that are
+        attached from more than one pool are summed.
+        """
+        self.entitlement_data = self.get_allocation_details(uuid=uuid)
+        attached = {}
+        for entitlement in self.entitlement_data["body"]["entitlementsAttached"]["value"]:
+            name = entitlement["subscriptionName"]
+            attached[name] = attached.get(name, 0) + entitlement["entitlementQuantity"]
+        return attached
+
+    def verify_allocation_entitlements(self, entitlement_quantity, subscription_name):
+        """Checks that the entitlements in the allocation match those defined in settings."""
+        with self._span("verify_allocation_entitlements", subscription=subscription_name):
+            return self._verify_allocation_entitlements(entitlement_quantity, subscription_name)
+
+    def _verify_allocation_entitlements(self, entitlement_quantity, subscription_name):
+        """Compares the attached quantity of a subscription with the requested quantity."""
+        logger.info(f"Verifying the entitlement quantity of {subscription_name} on the allocation.")
+        self.attached_quantity = self._fetch_attached_entitlements().get(subscription_name, 0)
+        if not self.attached_quantity:
             return
-        logger.debug(f"Current entitlement is {current_entitlement}")
-        self.attached_quantity = current_entitlement[0]["entitlementQuantity"]
+        logger.debug(f"Current entitlement quantity is {self.attached_quantity}")
         if self.attached_quantity == entitlement_quantity:
             logger.debug(f"Operation successful. Attached {self.attached_quantity} entitlements.")
             return True
@@ -259,36 +731,94 @@ class Manifester:
             )
             return True
 
+    def reconcile_allocation_entitlements(self, subscription_data):
+        """Verifies every requested subscription against the allocation in a single request.
+
+        Returns a list of the subscriptions whose attached quantity falls short of the requested
+        quantity. The quantity of each returned subscription is the outstanding shortfall.
+        """
+        requested = {}
+        for sub in subscription_data:
+            requested[sub["name"]] = requested.get(sub["name"], 0) + sub["quantity"]
+        logger.info(f"Verifying the entitlement quantities of {len(requested)} subscriptions.")
+        attached = self._fetch_attached_entitlements()
+        shortfalls = []
+        for name, quantity in requested.items():
+            attached_quantity = attached.get(name, 0)
+            if attached_quantity < quantity:
+                logger.debug(
+                    "%s of %s %s entitlements attached.", attached_quantity, quantity, name
+                )
+                shortfalls.append({"name": name, "quantity": quantity - attached_quantity})
+            elif attached_quantity > quantity:
+                logger.warning(
+                    f"Something went wrong. Attached quantity {attached_quantity} of {name} is "
+                    f"greater than requested quantity {quantity}."
+                )
+        return shortfalls
+
     def process_subscription_pools(self, subscription_pools, subscription_data):
         """Loops through the list of subscription pools in the account.
 
         Identifies pools that match the subscription names and quantities defined in settings, then
         attempts to add the specified quantity of each subscription to the allocation.
+        subscription_pools may be a pool listing or an iterator of pools, in which case no further
+        pools are consumed once the subscription has been attached.
         """
+        with self._span(
+            "process_subscription_pools",
+            subscription=subscription_data["name"],
+            quantity=subscription_data["quantity"],
+        ):
+            return self._process_subscription_pools(subscription_pools, subscription_data)
+
+    def _process_subscription_pools(self, subscription_pools, subscription_data):
+        """Attaches a subscription from the first matching pool with enough entitlements."""
         SUCCESS_CODE = 200
-        logger.debug(f"Finding a matching pool for {subscription_data['name']}.")
-        matching = [
-            d
-            for d in subscription_pools["body"]
-            if d["subscriptionName"] == subscription_data["name"]
-        ]
-        logger.debug(f"The following pools are matches for this subscription: {matching}")
-        for match in matching:
+        logger.debug("Finding a matching pool for %s.", subscription_data["name"])
+        if isinstance(subscription_pools, dict):
+            subscription_pools = subscription_pools["body"]
+        matching = (
+            d for d in subscription_pools if d["subscriptionName"] == subscription_data["name"]
+        )
+        found_capacity = False
+        for match, reservation_id in self._reserve_matches(matching, subscription_data["quantity"]):
+            logger.debug("Pool %s is a match for this subscription.", match["id"])
             if (
                 match["entitlementsAvailable"] > subscription_data["quantity"]
                 or match["entitlementsAvailable"] == -1
             ):
+                found_capacity = True
                 logger.debug(
-                    f"Pool {match['id']} is a match for this subscription and has "
-                    f"{match['entitlementsAvailable']} entitlements available."
-                )
-                add_entitlements = self.add_entitlements_to_allocation(
-                    pool_id=match["id"],
-                    entitlement_quantity=subscription_data["quantity"],
+                    "Pool %s is a match for this subscription and has %s entitlements available.",
+                    match["id"],
+                    match["entitlementsAvailable"],
                 )
+                try:
+                    add_entitlements = self.add_entitlements_to_allocation(
+                        pool_id=match["id"],
+                        entitlement_quantity=subscription_data["quantity"],
+                    )
+                except Exception:
+                    self._release_reservation(reservation_id)
+                    raise
+                if add_entitlements.status_code != SUCCESS_CODE:
+                    self._release_reservation(reservation_id)
                 # if the above is using simple_retry, it will raise an exception
                 # and never trigger the following block
-                if add_entitlements.status_code in [404, 429, 500, 504]:
+                if (
+                    add_entitlements.status_code in [404, 429, 500, 504]
+                    and self._unverified_subscriptions is not None
+                ):
+                    # Verification is deferred to a single batch request made by
+                    # add_subscriptions_to_allocation once every subscription has been processed
+                    logger.debug(
+                        f"Received response status {add_entitlements.status_code}. Deferring "
+                        f"verification of {subscription_data['name']}."
+                    )
+                    self._unverified_subscriptions.append(subscription_data["name"])
+                    break
+                elif add_entitlements.status_code in [404, 429, 500, 504]:
                     verify_entitlements = self.verify_allocation_entitlements(
                         entitlement_quantity=subscription_data["quantity"],
                         subscription_name=subscription_data["name"],
@@ -297,8 +827,7 @@ class Manifester:
                         # If no entitlements of a given subscription are
                         # attached, refresh the pools and try again
                         if not self.attached_quantity:
-                            self._subscription_pools = None
-                            # self.subscription_pools
+                            self._refresh_subscription_pools()
                             self.process_subscription_pools(
                                 subscription_pools=self.subscription_pools,
                                 subscription_data=subscription_data,
@@ -312,7 +841,7 @@ class Manifester:
                                 f"Received response status {add_entitlements.status_code}."
                                 "Trying to find another pool."
                             )
-                            self._subscription_pools = None
+                            self._refresh_subscription_pools()
                             subscription_data["quantity"] -= self.attached_quantity
                             self.process_subscription_pools(
                                 subscription_pools=self.subscription_pools,
@@ -323,7 +852,7 @@ class Manifester:
                             f"Successfully added {subscription_data['quantity']} entitlements of "
                             f"{subscription_data['name']} to the allocation."
                         )
-                        self._active_pools.append(match)
+                        self._record_attachment(match, subscription_data["quantity"])
                         update_inventory(self.subscription_allocations, uuid=self.allocation_uuid)
                         break
                 elif add_entitlements.status_code == SUCCESS_CODE:
@@ -331,7 +860,9 @@ class Manifester:
                         f"Successfully added {subscription_data['quantity']} entitlements of "
                         f"{subscription_data['name']} to the allocation."
                     )
-                    self._active_pools.append(match)
+                    # Pool listings fetched from now on already count the attached entitlements
+                    self._release_reservation(reservation_id)
+                    self._record_attachment(match, subscription_data["quantity"])
                     update_inventory(self.subscription_allocations, uuid=self.allocation_uuid)
                     break
                 else:
@@ -339,54 +870,116 @@ class Manifester:
                         "Something went wrong while adding entitlements. Received response status "
                         f"{add_entitlements.status_code}."
                     )
+        if not found_capacity and self.account is not None:
+            ACCOUNT_SELECTOR.record_capacity(self.account, subscription_data["name"], 0)
 
-    def trigger_manifest_export(self):
+    def add_subscriptions_to_allocation(self, subscription_data=None):
+        """Attaches each of the requested subscriptions to the allocation.
+
+        Subscriptions whose entitlements could not be attached are verified together with a single
+        request once every subscription has been processed, and only the shortfalls are re-planned
+        against a refreshed list of subscription pools.
+        """
+        MAX_VERIFICATION_ROUNDS = 5
+        subscription_data = subscription_data or self.subscription_data
+        self._unverified_subscriptions = []
+        with self._phase("attach"):
+            try:
+                for sub in subscription_data:
+                    self.process_subscription_pools(
+                        subscription_pools=self._pools_to_match(),
+                        subscription_data=sub,
+                    )
+                verification_round = 0
+                while self._unverified_subscriptions:
+                    verification_round += 1
+                    if verification_round > MAX_VERIFICATION_ROUNDS:
+                        raise RuntimeError(
+                            "Unable to attach the requested entitlements of "
+                            f"{', '.join(sorted(set(self._unverified_subscriptions)))}."
+                        )
+                    unverified = [
+                        sub
+                        for sub in subscription_data
+                        if sub["name"] in self._unverified_subscriptions
+                    ]
+                    self._unverified_subscriptions = []
+                    shortfalls = self.reconcile_allocation_entitlements(unverified)
+                    if shortfalls:
+                        self._refresh_subscription_pools()
+                    for shortfall in shortfalls:
+                        self.process_subscription_pools(
+                            subscription_pools=self._pools_to_match(),
+                            subscription_data=shortfall,
+                        )
+                if self._journal is not None:
+                    self._journal.record(attached=True)
+            finally:
+                self._unverified_subscriptions = None
+
+    def trigger_manifest_export(self, export_job_id=None):
         """Triggers job to export manifest from subscription allocation.
 
         Starts the export job, monitors the status of the job, and downloads the manifest on
-        successful completion of the job.
+        successful completion of the job. If the ID of an export job that was already started is
+        given, that job is monitored instead, unless it no longer exists.
         """
         MAX_REQUESTS = 500
         SUCCESS_CODE = 200
+        NOT_FOUND = 404
         data = {
             "headers": {"Authorization": f"Bearer {self.access_token}"},
             "proxies": self.manifest_data.get("proxies"),
+            "timeout": self.request_timeout,
         }
         local_file = Path(f"manifests/{self.manifest_name}")
         local_file.parent.mkdir(parents=True, exist_ok=True)
         logger.info(
             f"Triggering manifest export job for subscription allocation {self.allocation_name}"
         )
-        trigger_export_job = simple_retry(
-            self.requester.get,
-            cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}/export"],
-            cmd_kwargs=data,
-        ).json()
-        export_job_id = trigger_export_job["body"]["exportJobID"]
-        export_job = simple_retry(
-            self.requester.get,
-            cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}/exportJob/{export_job_id}"],
-            cmd_kwargs=data,
-        )
-        request_count = 1
-        limit_exceeded = False
-        while export_job.status_code != SUCCESS_CODE:
-            export_job = simple_retry(
-                self.requester.get,
-                cmd_args=[
-                    f"{self.allocations_url}/{self.allocation_uuid}/exportJob/{export_job_id}"
-                ],
-                cmd_kwargs=data,
-            )
-            logger.debug(f"Attempting to export manifest. Attempt number: {request_count}")
-            if request_count > MAX_REQUESTS:
-                limit_exceeded = True
-                logger.info(
-                    "Manifest export job status check limit exceeded. This may indicate an "
-                    "upstream issue with Red Hat Subscription Management."
+        with self._phase("export"):
+            export_job = None
+            if export_job_id is not None:
+                export_job = simple_retry(
+                    self.requester.get,
+                    cmd_args=[self._export_job_url(export_job_id)],
+                    cmd_kwargs=data,
                 )
-                raise Timeout("Export timeout exceeded")
-            request_count += 1
+                if export_job.status_code == NOT_FOUND:
+                    logger.info(f"Export job {export_job_id} no longer exists. Starting another.")
+                    export_job = None
+            if export_job is None:
+                trigger_export_job = simple_retry(
+                    self.requester.get,
+                    cmd_args=[f"{self.allocations_url}/{self.allocation_uuid}/export"],
+                    cmd_kwargs=data,
+                ).json()
+                export_job_id = trigger_export_job["body"]["exportJobID"]
+                if self._journal is not None:
+                    self._journal.record(export_job=export_job_id)
+                export_job = simple_retry(
+                    self.requester.get,
+                    cmd_args=[self._export_job_url(export_job_id)],
+                    cmd_kwargs=data,
+                )
+            export_job_url = self._export_job_url(export_job_id)
+            request_count = 1
+            limit_exceeded = False
+            while export_job.status_code != SUCCESS_CODE:
+                export_job = simple_retry(
+                    self.requester.get,
+                    cmd_args=[export_job_url],
+                    cmd_kwargs=data,
+                )
+                logger.debug("Attempting to export manifest. Attempt number: %s", request_count)
+                if request_count > MAX_REQUESTS:
+                    limit_exceeded = True
+                    logger.info(
+                        "Manifest export job status check limit exceeded. This may indicate an "
+                        "upstream issue with Red Hat Subscription Management."
+                    )
+                    raise Timeout("Export timeout exceeded")
+                request_count += 1
         if limit_exceeded:
             self.content = None
             return self
@@ -395,11 +988,12 @@ class Manifester:
             export_href = export_job.body["href"]
         else:
             export_href = export_job["body"]["href"]
-        manifest = simple_retry(
-            self.requester.get,
-            cmd_args=[f"{export_href}"],
-            cmd_kwargs=data,
-        )
+        with self._phase("download"):
+            manifest = simple_retry(
+                self.requester.get,
+                cmd_args=[f"{export_href}"],
+                cmd_kwargs=data,
+            )
         logger.info(
             f"Writing manifest for subscription allocation {self.allocation_name} to location "
             f"{local_file}"
@@ -408,31 +1002,124 @@ class Manifester:
         manifest.path = local_file
         manifest.name = self.manifest_name
         manifest.uuid = self.allocation_uuid
+        self._finish_manifest()
         update_inventory(self.subscription_allocations, uuid=self.allocation_uuid)
         return manifest
 
+    def _export_job_url(self, export_job_id):
+        """Returns the URL of an export job of the allocation."""
+        return f"{self.allocations_url}/{self.allocation_uuid}/exportJob/{export_job_id}"
+
+    def _finish_manifest(self):
+        """Discards the journal of a downloaded manifest and stops counting it as in flight."""
+        if self._journal is not None:
+            self._journal.discard()
+            self._journal = None
+        self._release_account()
+
     def get_manifest(self):
         """Provides a subscription manifest based on settings.
 
         Calls the methods required to create a new subscription allocation, add the appropriate
-        subscriptions to the allocation, export a manifest, and download the manifest.
+        subscriptions to the allocation, export a manifest, and download the manifest. If the
+        manifest_deadline or a phase budget is exceeded, the allocation is deleted and
+        DeadlineExceeded is raised. If the profile setting is enabled, the call is profiled.
         """
-        self.create_subscription_allocation()
-        for sub in self.subscription_data:
-            self.process_subscription_pools(
-                subscription_pools=self.subscription_pools,
-                subscription_data=sub,
+        profiled = profiling.profile("get-manifest") if self.profile else nullcontext()
+        try:
+            with profiled, deadline(self.manifest_deadline, "manifest"), self._span("get_manifest"):
+                if self.preflight:
+                    self._preflight()
+                self.create_subscription_allocation()
+                self.add_subscriptions_to_allocation()
+                return self.trigger_manifest_export()
+        except DeadlineExceeded as err:
+            logger.warning("Manifest generation stopped: %s.", err)
+            self._roll_back_allocation()
+            raise
+        finally:
+            self._release_account()
+            self._release_journal()
+
+    def resume_manifest(self):
+        """Continues generating the manifest of this instance's allocation from its journal.
+
+        Subscriptions are only attached as far as the allocation still falls short of the
+        requested quantities, and an export job that was already started is monitored instead of
+        starting another one. Raises FileNotFoundError if the allocation has no journal, and
+        JournalInUse if another process is generating the manifest.
+        """
+        journals = load_journals([self.allocation_name])
+        if not journals:
+            raise FileNotFoundError(
+                f"No journal of subscription allocation {self.allocation_name} was found."
             )
-        return self.trigger_manifest_export()
+        self._journal = journals[0]
+        self._journal.claim()
+        self._acquire_account()
+        self.allocation_uuid = self._journal.entry["uuid"]
+        for attachment in self._journal.entry["attachments"]:
+            self._pool_quantities[attachment["pool"]] = (
+                self._pool_quantities.get(attachment["pool"], 0) + attachment["quantity"]
+            )
+        logger.info(
+            f"Resuming subscription allocation {self.allocation_name} with UUID "
+            f"{self.allocation_uuid} after step {self._journal.step}."
+        )
+        profiled = profiling.profile("resume-manifest") if self.profile else nullcontext()
+        try:
+            with profiled, deadline(self.manifest_deadline, "manifest"), self._span("resume"):
+                if not self._journal.entry["attached"]:
+                    shortfalls = self.reconcile_allocation_entitlements(self.subscription_data)
+                    if shortfalls:
+                        self.add_subscriptions_to_allocation(shortfalls)
+                    else:
+                        self._journal.record(attached=True)
+                return self.trigger_manifest_export(export_job_id=self._journal.entry["export_job"])
+        finally:
+            self._release_account()
+            self._release_journal()
+
+    def _release_journal(self):
+        """Lets another process resume the manifest of an unfinished journal."""
+        if self._journal is not None:
+            self._journal.release()
+
+    def _roll_back_allocation(self):
+        """Deletes the allocation created by an unfinished get_manifest call, if any.
+
+        The allocation is forgotten afterwards, so that it is not deleted a second time.
+        """
+        uuid = getattr(self, "allocation_uuid", None)
+        if uuid is None:
+            if self._create_sent:
+                # Looking the allocation up could stall as long as the request to create it did
+                logger.warning(
+                    f"Subscription allocation {self.allocation_name} may have been created. "
+                    "Run `manifester reap --untracked` to delete it if so."
+                )
+            return
+        logger.info(f"Deleting unfinished subscription allocation {uuid}.")
+        try:
+            self.delete_subscription_allocation(uuid=uuid)
+        except Exception as err:  # noqa: BLE001 - the deadline error is the one to report
+            logger.warning(f"Unable to delete subscription allocation {uuid}: {err}")
+        self.allocation_uuid = None
+        self._create_sent = False
 
     def __enter__(self):
         """Generates and returns a manifest."""
         try:
             return self.get_manifest()
         except:
-            self.delete_subscription_allocation()
+            # Allocations rolled back by get_manifest have already been deleted
+            if getattr(self, "allocation_uuid", None) is not None:
+                self._roll_back_allocation()
             raise
 
     def __exit__(self, *tb_args):
-        """Deletes subscription allocation on teardown unless using CLI."""
-        self.delete_subscription_allocation()
+        """Deletes or, if recycling is enabled, parks subscription allocation on teardown."""
+        if self.recycle_allocations:
+            self.release_subscription_allocation()
+        else:
+            self.delete_subscription_allocation()
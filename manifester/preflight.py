@@ -0,0 +1,120 @@
+"""Checks manifest categories against a cached catalog of the subscriptions in an account.
+
+The RHSM API only lists subscription pools through an existing subscription allocation, so the
+catalog is built from the pools of an allocation that already exists in the account, and is
+refreshed whenever Manifester fetches a complete pool listing. The catalog keeps, for each
+subscription name, the largest number of entitlements available from a single pool, since every
+subscription in a category is attached from a single pool. It is stored in manifester's cache
+directory so that it is shared between processes and CI runs.
+"""
+import difflib
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+import threading
+import time
+
+from manifester.helpers import cache_dir, iter_paginated_data
+from manifester.logger import _logger as logger
+
+DEFAULT_CATALOG_TTL = 3600
+
+
+class SubscriptionCatalog:
+    """Subscriptions available in each account, keyed by allocations URL and token digest."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else cache_dir().joinpath("subscription_catalog.json")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(manifester):
+        """Return the catalog key of a Manifester instance's account."""
+        # The offline token identifies the account, but it is a secret and is only kept as a digest
+        token_digest = hashlib.sha256(str(manifester.offline_token).encode()).hexdigest()
+        return f"{manifester.allocations_url} {token_digest}"
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, manifester, ttl=DEFAULT_CATALOG_TTL):
+        """Return the subscriptions of the manifester's account, or None if they are not cached."""
+        entry = self._load().get(self.key(manifester))
+        if entry and time.time() - entry["fetched_at"] < ttl:
+            return entry["subscriptions"]
+        return None
+
+    def update(self, manifester, pools):
+        """Replace the catalog of the manifester's account with a complete pool listing."""
+        subscriptions = {}
+        for pool in pools:
+            available = pool["entitlementsAvailable"]
+            # Pools with unlimited entitlements report -1 available
+            available = math.inf if available == -1 else available
+            name = pool["subscriptionName"]
+            subscriptions[name] = max(subscriptions.get(name, 0), available)
+        with self._lock:
+            catalog = self._load()
+            catalog[self.key(manifester)] = {
+                "fetched_at": time.time(),
+                # JSON has no infinity, so unlimited pools are stored as -1 as in the API
+                "subscriptions": {
+                    name: -1 if available == math.inf else available
+                    for name, available in subscriptions.items()
+                },
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(json.dumps(catalog))
+            tmp_path.replace(self.path)
+        return catalog[self.key(manifester)]["subscriptions"]
+
+    def refresh(self, manifester):
+        """Rebuild the catalog from the pools of an existing allocation in the account.
+
+        An allocation with the manifester's Satellite version is preferred. Returns None if the
+        account has no allocations under the manifester's username_prefix.
+        """
+        allocations = manifester.subscription_allocations
+        sat_version = str(getattr(manifester, "sat_version", "")).removeprefix("sat-")
+        allocation = next(
+            (a for a in allocations if str(a.get("version")).removeprefix("sat-") == sat_version),
+            allocations[0] if allocations else None,
+        )
+        if allocation is None:
+            logger.debug("No allocation to list the subscriptions of the account from.")
+            return None
+        logger.debug("Refreshing subscription catalog from allocation %s.", allocation["uuid"])
+        pools = iter_paginated_data(
+            manifester, "pools", raw=False, allocation_uuid=allocation["uuid"]
+        )
+        return self.update(manifester, pools)
+
+
+def check_subscription_data(subscription_data, subscriptions):
+    """Compare requested subscriptions with the subscriptions available in an account.
+
+    :return: list of messages describing the subscriptions that cannot be attached
+    """
+    problems = []
+    for sub in subscription_data:
+        name, quantity = sub["name"], sub["quantity"]
+        if name not in subscriptions:
+            suggestions = difflib.get_close_matches(name, subscriptions, n=1)
+            hint = f" Did you mean '{suggestions[0]}'?" if suggestions else ""
+            problems.append(f"Subscription '{name}' was not found in the account.{hint}")
+            continue
+        available = subscriptions[name]
+        # Entitlements are only attached from a pool with more than the requested quantity
+        if available != -1 and available <= quantity:
+            problems.append(
+                f"Subscription '{name}' has no pool with more than {quantity} entitlements "
+                f"available (largest pool has {available})."
+            )
+    return problems
+
@@ -0,0 +1,127 @@
+"""Opt-in profiling of manifester commands and library calls.
+
+While a profile is active, the calling thread is profiled with cProfile, memory allocations are
+traced with tracemalloc, and the wall-clock time of each phase of manifest generation (such as
+creating the allocation or exporting the manifest) is recorded from every thread. When the profile
+ends, its results are written next to the log file:
+
+    logs/profile-get-manifest-20240320T145202-1234.pstats  cProfile statistics for pstats/snakeviz
+    logs/profile-get-manifest-20240320T145202-1234.txt     the slowest functions by cumulative time
+    logs/profile-get-manifest-20240320T145202-1234.json    wall time, phases and peak memory
+
+Profiles are started by the `--profile` option of the CLI, the MANIFESTER_PROFILE environment
+variable, or the `profile` context manager. Only one profile is active at a time, and profiles
+started while another is active are folded into it.
+"""
+from contextlib import contextmanager
+import cProfile
+from datetime import datetime
+import io
+import json
+import os
+from pathlib import Path
+import pstats
+import threading
+import time
+import tracemalloc
+
+from manifester.logger import _logger as logger, log_directory
+
+# Number of functions listed in the text report
+REPORT_LIMIT = 40
+
+_active_profile = None
+_active_lock = threading.Lock()
+
+
+class Profile:
+    """Wall-clock phase timings collected while a profile is active."""
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def record_phase(self, phase, seconds):
+        """Add the duration of one run of a phase."""
+        with self._lock:
+            stats = self.phases.setdefault(phase, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+
+
+def active_profile():
+    """Return the active profile, or None."""
+    return _active_profile
+
+
+@contextmanager
+def phase(name):
+    """Record the wall-clock time spent in the block as a phase of the active profile, if any."""
+    profile_ = _active_profile
+    if profile_ is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile_.record_phase(name, time.perf_counter() - started)
+
+
+def _write_artifacts(profile_, profiler, summary, directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    base = directory.joinpath(f"profile-{profile_.name}-{stamp}-{os.getpid()}")
+    profiler.dump_stats(f"{base}.pstats")
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(REPORT_LIMIT)
+    Path(f"{base}.txt").write_text(report.getvalue())
+    Path(f"{base}.json").write_text(json.dumps(summary, indent=2))
+    return base
+
+
+@contextmanager
+def profile(name, directory=None):
+    """Profile the block and write the results to directory, the log directory by default.
+
+    cProfile only follows the thread that entered the block, but phases and memory are recorded
+    for every thread.
+    """
+    global _active_profile  # noqa: PLW0603 - a single profile is shared by every thread
+    with _active_lock:
+        if _active_profile is not None:
+            nested = _active_profile
+        else:
+            nested = None
+            _active_profile = Profile(name)
+    if nested is not None:
+        yield nested
+        return
+    profile_ = _active_profile
+    tracing_memory = tracemalloc.is_tracing()
+    if not tracing_memory:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        yield profile_
+    finally:
+        profiler.disable()
+        wall_time = time.perf_counter() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        if not tracing_memory:
+            tracemalloc.stop()
+        with _active_lock:
+            _active_profile = None
+        summary = {
+            "name": name,
+            "wall_seconds": round(wall_time, 6),
+            "peak_memory_bytes": peak_memory,
+            "phases": profile_.phases,
+        }
+        base = _write_artifacts(profile_, profiler, summary, Path(directory or log_directory()))
+        logger.info("Wrote profile of %s to %s.*", name, base)
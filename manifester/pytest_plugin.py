@@ -0,0 +1,211 @@
+"""Pytest plugin that generates the manifests needed by a test session in the background.
+
+The plugin is not loaded automatically. Enable it with `-p manifester.pytest_plugin` on the command
+line or `pytest_plugins = ["manifester.pytest_plugin"]` in a conftest.py file.
+
+Tests request a manifest with the `manifester_manifest` fixture and a `manifester` marker naming
+the manifest category:
+
+    @pytest.mark.manifester(category="golden_ticket")
+    def test_manifest_upload(manifester_manifest):
+        ...
+
+When prefetching is enabled with `--manifester-prefetch` or the `manifester_prefetch` ini option,
+the plugin counts the manifests that the collected tests need and generates them in background
+threads while the session continues. Categories listed in the `manifester_prefetch_categories` ini
+option are generated from session start, before collection. Subscription allocations are deleted
+together at the end of the session instead of after each test. Under pytest-xdist, each worker
+prefetches its share of the manifests, and falls back to generating a manifest on demand when its
+share is used up.
+"""
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import math
+import threading
+
+import pytest
+
+from manifester import Manifester
+from manifester.logger import _logger as logger
+
+DEFAULT_PREFETCH_WORKERS = 4
+PREFETCHER_KEY = pytest.StashKey()
+
+
+def _default_manifester(category):
+    return Manifester(manifest_category=category)
+
+
+class ManifestPrefetcher:
+    """Generates manifests in background threads and hands them out by manifest category.
+
+    :param manifester_factory: callable that returns a Manifester instance for a manifest category
+    """
+
+    def __init__(self, max_workers=DEFAULT_PREFETCH_WORKERS, manifester_factory=None):
+        self.max_workers = max_workers
+        self.manifester_factory = manifester_factory or _default_manifester
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="manifester-prefetch"
+        )
+        self._queues = defaultdict(deque)
+        self._issued = []
+        self._lock = threading.Lock()
+
+    def _generate(self, category):
+        manifester = self.manifester_factory(category)
+        # Entering the manifester deletes the allocation if the manifest cannot be generated, unless
+        # get_manifest has already rolled it back
+        return manifester, manifester.__enter__()
+
+    def prefetch(self, category, count=1):
+        """Start generating manifests of a category in the background."""
+        logger.info("Prefetching %s manifests of category %s", count, category)
+        for _ in range(count):
+            future = self._executor.submit(self._generate, category)
+            with self._lock:
+                self._queues[category].append(future)
+
+    def queued(self, category):
+        """Return the number of manifests of a category that have been prefetched but not used."""
+        with self._lock:
+            return len(self._queues[category])
+
+    def get(self, category):
+        """Return a manifest of a category, waiting for a prefetched one or generating one."""
+        with self._lock:
+            future = self._queues[category].popleft() if self._queues[category] else None
+        if future is None:
+            logger.debug("No prefetched manifest of category %s, generating one", category)
+            manifester, manifest = self._generate(category)
+        else:
+            manifester, manifest = future.result()
+        with self._lock:
+            self._issued.append(manifester)
+        return manifest
+
+    def shutdown(self):
+        """Stop prefetching and delete every allocation that was generated."""
+        with self._lock:
+            unused = [future for queue in self._queues.values() for future in queue]
+            self._queues.clear()
+        for future in unused:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        manifesters = self._issued + [
+            future.result()[0]
+            for future in unused
+            if not future.cancelled() and future.exception() is None
+        ]
+        self._issued = []
+        logger.info("Deleting %s allocations generated during the session", len(manifesters))
+
+        def _teardown(manifester):
+            try:
+                manifester.__exit__(None, None, None)
+            except Exception as err:  # noqa: BLE001 - every allocation should be attempted
+                logger.warning(
+                    "Unable to delete allocation %s: %s", manifester.allocation_name, err
+                )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(_teardown, manifesters))
+
+
+def _marker_category(node):
+    marker = node.get_closest_marker("manifester")
+    if marker is None:
+        return None
+    return marker.kwargs.get("category", marker.args[0] if marker.args else None)
+
+
+def _is_xdist_controller(config):
+    return not hasattr(config, "workerinput") and getattr(config.option, "dist", "no") != "no"
+
+
+def pytest_addoption(parser):
+    """Add the plugin's command line and ini options."""
+    group = parser.getgroup("manifester")
+    group.addoption(
+        "--manifester-prefetch",
+        action="store_true",
+        default=None,
+        help="Generate the manifests needed by the collected tests in the background",
+    )
+    parser.addini(
+        "manifester_prefetch",
+        type="bool",
+        default=False,
+        help="Generate the manifests needed by the collected tests in the background",
+    )
+    parser.addini(
+        "manifester_prefetch_categories",
+        type="linelist",
+        default=[],
+        help="Manifest categories to start generating at session start, before collection",
+    )
+    parser.addini(
+        "manifester_prefetch_workers",
+        default=str(DEFAULT_PREFETCH_WORKERS),
+        help="Number of manifests generated concurrently",
+    )
+
+
+def pytest_configure(config):
+    """Register the manifester marker and start the prefetcher if prefetching is enabled."""
+    config.addinivalue_line(
+        "markers", "manifester(category): manifest category used by the manifester_manifest fixture"
+    )
+    enabled = config.getoption("manifester_prefetch") or config.getini("manifester_prefetch")
+    if enabled and not _is_xdist_controller(config):
+        config.stash[PREFETCHER_KEY] = ManifestPrefetcher(
+            max_workers=int(config.getini("manifester_prefetch_workers"))
+        )
+
+
+def pytest_sessionstart(session):
+    """Start generating the categories listed in the ini file before collection."""
+    prefetcher = session.config.stash.get(PREFETCHER_KEY, None)
+    if prefetcher is not None:
+        for category in session.config.getini("manifester_prefetch_categories"):
+            prefetcher.prefetch(category)
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """Prefetch the manifests of the categories needed by the collected tests."""
+    prefetcher = config.stash.get(PREFETCHER_KEY, None)
+    if prefetcher is None:
+        return
+    demand = Counter(
+        _marker_category(item)
+        for item in items
+        if "manifester_manifest" in getattr(item, "fixturenames", ())
+    )
+    demand.pop(None, None)
+    # Each xdist worker collects every test but only runs its share of them
+    worker_count = getattr(config, "workerinput", {}).get("workercount", 1)
+    for category, count in demand.items():
+        missing = math.ceil(count / worker_count) - prefetcher.queued(category)
+        if missing > 0:
+            prefetcher.prefetch(category, missing)
+
+
+def pytest_sessionfinish(session):
+    """Delete the allocations generated during the session."""
+    prefetcher = session.config.stash.get(PREFETCHER_KEY, None)
+    if prefetcher is not None:
+        prefetcher.shutdown()
+
+
+@pytest.fixture
+def manifester_manifest(request):
+    """Provide a manifest of the category named by the test's manifester marker."""
+    category = _marker_category(request.node)
+    if category is None:
+        pytest.fail("manifester_manifest requires @pytest.mark.manifester(category=...)")
+    prefetcher = request.config.stash.get(PREFETCHER_KEY, None)
+    if prefetcher is None:
+        with _default_manifester(category) as manifest:
+            yield manifest
+    else:
+        yield prefetcher.get(category)
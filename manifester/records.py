@@ -0,0 +1,87 @@
+"""Defines compact records for the RHSM API objects that Manifester keeps in memory.
+
+Accounts can contain tens of thousands of subscription pools, but Manifester only uses a handful of
+fields from each of them. API responses are projected onto these records as each page is parsed,
+and the records support the subset of the dict interface used by Manifester, so that they can be
+used in place of the raw response data.
+"""
+
+
+class CompactRecord:
+    """Base class for records that store a fixed set of fields in slots instead of a dict."""
+
+    __slots__ = ()
+    # Records are mutable, so they are not hashable
+    __hash__ = None
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Project a raw API object onto a record, discarding all other fields."""
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+    def __getitem__(self, key):
+        """Get a field by name, raising a KeyError for fields that are not kept."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        """Set a field by name, raising a KeyError for fields that are not kept."""
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        """Return whether the field is kept by the record."""
+        return key in self.__slots__
+
+    def __iter__(self):
+        """Iterate over the field names, like a dict."""
+        return iter(self.__slots__)
+
+    def __eq__(self, other):
+        """Compare the record's fields with another record or dict."""
+        if isinstance(other, CompactRecord | dict):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __copy__(self):
+        """Return a shallow copy of the record."""
+        return self.from_dict(self.to_dict())
+
+    def __repr__(self):
+        """Return a string representation of the record."""
+        inner = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__)
+        return f"{self.__class__.__name__}({inner})"
+
+    def get(self, key, default=None):
+        """Get a field by name, returning the default for fields that are not kept."""
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        """Return the names of the fields kept by the record."""
+        return self.__slots__
+
+    def items(self):
+        """Return (name, value) pairs of the fields kept by the record."""
+        return [(field, getattr(self, field)) for field in self.__slots__]
+
+    def to_dict(self):
+        """Return the record's fields as a dict."""
+        return dict(self.items())
+
+
+class PoolRecord(CompactRecord):
+    """Subscription pool fields used to match subscriptions and attach entitlements."""
+
+    __slots__ = ("entitlementsAvailable", "id", "subscriptionName")
+
+
+class AllocationRecord(CompactRecord):
+    """Subscription allocation fields used to identify allocations and determine their age."""
+
+    __slots__ = ("createdDate", "name", "uuid")
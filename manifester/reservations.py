@@ -0,0 +1,141 @@
+"""Host-local ledger of the entitlements that Manifester instances are about to attach.
+
+Manifester instances that generate manifests at the same time read the same numbers of available
+entitlements from the subscription pools and would otherwise all try to attach entitlements from
+the first matching pool. With the ledger enabled, an instance reserves the quantity it needs from a
+pool before attaching it, and pools whose available entitlements are already reserved by other
+instances are skipped. Reservations are released as soon as the attachment is made, since pool
+listings fetched afterwards already count the attached entitlements, or once it fails. Reservations
+of processes that die in between expire after RESERVATION_TTL seconds.
+
+The `reservation_ledger` setting selects the ledger: `memory` shares reservations between the
+Manifester instances in a process, and `file` shares them between processes on the same host
+through a file in the cache directory.
+"""
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - fcntl is not available on Windows
+    fcntl = None
+
+from manifester.helpers import cache_dir
+from manifester.logger import _logger as logger
+
+# Seconds after which a reservation expires, even if the process that made it is still running
+RESERVATION_TTL = 300
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ReservationLedger:
+    """Reservations of entitlement quantities from subscription pools.
+
+    :param path: file shared between processes, or None to keep reservations in memory
+    """
+
+    def __init__(self, path=None, ttl=RESERVATION_TTL):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self._reservations = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _transaction(self):
+        """Yield the current reservations, saving them afterwards if the ledger is file-backed."""
+        with self._lock:
+            if self.path is None:
+                self._prune(self._reservations)
+                yield self._reservations
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.with_suffix(".lock").open("a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    reservations = json.loads(self.path.read_text()) if self.path.is_file() else {}
+                    self._prune(reservations)
+                    yield reservations
+                    tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+                    tmp_path.write_text(json.dumps(reservations))
+                    tmp_path.replace(self.path)
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _prune(self, reservations):
+        """Drop expired reservations and those held by processes that have exited."""
+        now = time.time()
+        for reservation_id, reservation in list(reservations.items()):
+            if reservation["expires"] < now or not _process_alive(reservation["pid"]):
+                del reservations[reservation_id]
+
+    @staticmethod
+    def _reserved_quantity(reservations, pool_id):
+        return sum(r["quantity"] for r in reservations.values() if r["pool_id"] == pool_id)
+
+    def reserved(self, pool_id):
+        """Return the quantity of entitlements reserved from a pool."""
+        with self._transaction() as reservations:
+            return self._reserved_quantity(reservations, pool_id)
+
+    def reserve(self, pool, quantity):
+        """Reserve entitlements from a pool if enough of them are not reserved by others.
+
+        :return: reservation ID, or None if the pool lacks unreserved entitlements
+        """
+        with self._transaction() as reservations:
+            available = pool["entitlementsAvailable"]
+            reserved = self._reserved_quantity(reservations, pool["id"])
+            # Pools with unlimited entitlements report -1 available
+            if available != -1 and available - reserved <= quantity:
+                logger.debug("Entitlements of pool %s are already reserved.", pool["id"])
+                return None
+            reservation_id = uuid.uuid4().hex
+            reservations[reservation_id] = {
+                "pool_id": pool["id"],
+                "quantity": quantity,
+                "pid": os.getpid(),
+                "expires": time.time() + self.ttl,
+            }
+        logger.debug("Reserved %s entitlements of pool %s.", quantity, pool["id"])
+        return reservation_id
+
+    def release(self, reservation_id):
+        """Release a reservation once its attachment has been made or has failed."""
+        with self._transaction() as reservations:
+            reservations.pop(reservation_id, None)
+
+    def clear(self):
+        """Release every reservation."""
+        with self._transaction() as reservations:
+            reservations.clear()
+
+
+_LEDGERS = {}
+_LEDGERS_LOCK = threading.Lock()
+
+
+def get_ledger(mode):
+    """Return the shared ledger for a reservation_ledger setting, or None if it is disabled."""
+    if not mode:
+        return None
+    if mode not in ("memory", "file"):
+        raise ValueError(f"Invalid reservation_ledger setting {mode!r}, expected memory or file")
+    path = cache_dir().joinpath("reservations.json").resolve() if mode == "file" else None
+    with _LEDGERS_LOCK:
+        return _LEDGERS.setdefault(path, ReservationLedger(path))
@@ -0,0 +1,173 @@
+"""Schedules the operations of concurrent manifest generation by priority.
+
+When Manifester instances in a process run at the same time, for example during bulk generation or
+from parallel test workers, their operations (creating an allocation, attaching subscriptions,
+exporting a manifest and deleting an allocation) otherwise all compete for the same RHSM API
+budget. Once a concurrency limit is configured, each operation waits for a slot from the process's
+scheduler before it starts:
+
+    max_concurrent_operations: 8   # operations running at once in the process
+    category_concurrency: 4        # operations running at once for one manifest category
+    account_concurrency: 6         # operations running at once against one RHSM account
+    priority: "normal"             # interactive, gating, normal or background
+
+Free slots go to waiting operations of the highest priority class, so that interactive and release
+gating work is served before background refills and cleanups. Within a class, the manifest category
+with the fewest running operations goes first, so that one busy category cannot take every slot.
+Operations that have waited for AGING_INTERVAL seconds are promoted by one class, so that
+background work still progresses under sustained load. Waiting counts against the active deadline.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
+import itertools
+import threading
+import time
+
+from manifester.deadlines import active_deadline
+from manifester.logger import _logger as logger
+
+PRIORITIES = ("interactive", "gating", "normal", "background")
+DEFAULT_PRIORITY = "normal"
+# Seconds of waiting after which an operation is promoted to the next priority class
+AGING_INTERVAL = 30
+SCHEDULED_OPERATIONS = ("create", "attach", "export", "delete")
+
+# Operations nested in a scheduled operation run in its slot instead of waiting for another one
+_HOLDING_SLOT = contextvars.ContextVar("manifester_holding_slot", default=False)
+
+
+class _Ticket:
+    """An operation waiting for, or running in, a slot."""
+
+    def __init__(self, operation, priority, *, category, account, limits, sequence):
+        if priority not in PRIORITIES:
+            raise ValueError(
+                f"Unknown priority {priority!r}. Valid priorities are {', '.join(PRIORITIES)}."
+            )
+        self.operation = operation
+        self.priority = priority
+        self.category = category
+        self.account = account
+        self.limits = limits
+        self.sequence = sequence
+        self.enqueued = time.monotonic()
+
+    def counters(self):
+        """Return the counters of running operations that this operation counts towards."""
+        return (("all", None), ("category", self.category), ("account", self.account))
+
+
+class Scheduler:
+    """Dispatches operations to a limited number of slots by priority, sharing slots fairly.
+
+    Limits are given by each operation, so that instances with different settings can share the
+    scheduler. A limit of None or 0 leaves that dimension unlimited.
+    """
+
+    def __init__(self, aging_interval=AGING_INTERVAL):
+        self.aging_interval = aging_interval
+        self.dispatched = Counter()
+        self._running = Counter()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def _rank(self, ticket, now):
+        promotions = int((now - ticket.enqueued) // self.aging_interval)
+        return max(PRIORITIES.index(ticket.priority) - promotions, 0)
+
+    def _fits(self, ticket):
+        return all(
+            not limit or self._running[key] < limit
+            for key, limit in zip(ticket.counters(), ticket.limits)
+        )
+
+    def _next_ticket(self):
+        now = time.monotonic()
+        eligible = [ticket for ticket in self._waiting if self._fits(ticket)]
+        if not eligible:
+            return None
+        return min(
+            eligible,
+            key=lambda ticket: (
+                self._rank(ticket, now),
+                self._running[("category", ticket.category)],
+                ticket.sequence,
+            ),
+        )
+
+    def _wait_for_turn(self, ticket):
+        while self._next_ticket() is not ticket:
+            active = active_deadline()
+            timeout = None if active is None else active.remaining()
+            if timeout is not None and timeout <= 0:
+                self._waiting.remove(ticket)
+                # Another operation may be able to start in the place of this one
+                self._condition.notify_all()
+                raise active.exceeded()
+            self._condition.wait(timeout)
+
+    @contextmanager
+    def slot(self, operation, priority=DEFAULT_PRIORITY, category=None, account=None, limits=()):
+        """Wait for a slot for an operation and hold it for the duration of the block.
+
+        :param limits: (overall, per category, per account) numbers of concurrent operations
+        """
+        if _HOLDING_SLOT.get():
+            yield
+            return
+        limits = tuple(limits) + (None,) * (3 - len(limits))
+        with self._condition:
+            ticket = _Ticket(
+                operation,
+                priority,
+                category=category,
+                account=account,
+                limits=limits,
+                sequence=next(self._sequence),
+            )
+            self._waiting.append(ticket)
+            self._wait_for_turn(ticket)
+            self._waiting.remove(ticket)
+            for key in ticket.counters():
+                self._running[key] += 1
+            self.dispatched[ticket.priority] += 1
+            # Other operations may fit in the slots that are still free
+            self._condition.notify_all()
+        waited = time.monotonic() - ticket.enqueued
+        if waited > 1:
+            logger.debug(
+                "%s operation %s waited %.1f seconds for a slot.", priority, operation, waited
+            )
+        token = _HOLDING_SLOT.set(True)
+        try:
+            yield
+        finally:
+            _HOLDING_SLOT.reset(token)
+            with self._condition:
+                for key in ticket.counters():
+                    self._running[key] -= 1
+                self._condition.notify_all()
+
+    def running(self, category=None, account=None):
+        """Return the number of operations running overall, or for a category or an account."""
+        with self._condition:
+            if category is not None:
+                return self._running[("category", category)]
+            if account is not None:
+                return self._running[("account", account)]
+            return self._running[("all", None)]
+
+    def waiting(self):
+        """Return the number of operations waiting for a slot."""
+        with self._condition:
+            return len(self._waiting)
+
+    def clear(self):
+        """Reset the counts of dispatched operations."""
+        with self._condition:
+            self.dispatched.clear()
+
+
+SCHEDULER = Scheduler()
@@ -0,0 +1,387 @@
+"""Local HTTP server that imitates the RHSM API endpoints used by Manifester.
+
+The stub keeps allocations, subscription pools and export jobs in memory, so that Manifester can
+generate manifests against it without network access. It is used to test and benchmark Manifester:
+
+    with RhsmStubServer(latency=0.05) as stub:
+        manifester = Manifester(manifest_category=stub.manifest_category(), sat_version="sat-6.15")
+        manifester.get_manifest()
+
+Responses can be delayed by a fixed latency, and a fraction of them can be answered with HTTP 429
+to imitate rate limiting. A fraction of the allocations and attachments that are created can be
+answered with HTTP 504 after the change has been made, to imitate a gateway timing out.
+"""
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+import uuid
+import zipfile
+
+from manifester.helpers import UTC
+
+API_PATH = "/management/v1/allocations"
+TOKEN_PATH = "/auth/realms/redhat-external/protocol/openid-connect/token"
+SAT_VERSIONS = ("sat-6.13", "sat-6.14", "sat-6.15")
+ALLOCATIONS_PAGE_SIZE = 100
+POOLS_PAGE_SIZE = 50
+JSON_TYPE = "application/json"
+DEFAULT_POOLS = (
+    ("Red Hat Satellite Infrastructure Subscription", 500),
+    ("Red Hat Enterprise Linux Server, Premium (Physical or Virtual Nodes)", 500),
+    ("Software Collections and Developer Toolset", 500),
+    ("Red Hat Ansible Automation Platform, Standard (100 Managed Nodes)", 500),
+    ("Red Hat Beta Access", -1),
+)
+
+
+def _manifest_archive(allocation):
+    """Build a manifest archive with the consumer and entitlements of an allocation."""
+    export = io.BytesIO()
+    with zipfile.ZipFile(export, "w") as archive:
+        archive.writestr(
+            "export/consumer.json",
+            json.dumps(
+                {
+                    "uuid": allocation["uuid"],
+                    "name": allocation["name"],
+                    "contentAccessMode": "org_environment"
+                    if allocation["simpleContentAccess"] == "enabled"
+                    else "entitlement",
+                }
+            ),
+        )
+        archive.writestr("export/meta.json", json.dumps({"created": allocation["createdDate"]}))
+        for entitlement in allocation["entitlements"]:
+            archive.writestr(
+                f"export/entitlements/{entitlement['id']}.json",
+                json.dumps(
+                    {
+                        "pool": {
+                            "id": entitlement["pool"],
+                            "productName": entitlement["subscriptionName"],
+                        },
+                        "quantity": entitlement["entitlementQuantity"],
+                    }
+                ),
+            )
+    manifest = io.BytesIO()
+    with zipfile.ZipFile(manifest, "w") as archive:
+        archive.writestr("consumer_export.zip", export.getvalue())
+        archive.writestr("signature", b"stub signature")
+    return manifest.getvalue()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        """Discard the default request log written to standard error."""
+
+    def _send(self, status, body=None, content_type=JSON_TYPE, headers=None):
+        payload = body if isinstance(body, bytes) else json.dumps(body or {}).encode()
+        if status in (204, 304):
+            payload = b""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, response, content_type, headers = self.server.stub.respond(
+            method, url.path, query, body, self.headers
+        )
+        self._send(status, response, content_type, headers)
+
+    def do_GET(self):
+        """Answer a GET request."""
+        self._handle("GET")
+
+    def do_POST(self):
+        """Answer a POST request."""
+        self._handle("POST")
+
+    def do_PUT(self):
+        """Answer a PUT request."""
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        """Answer a DELETE request."""
+        self._handle("DELETE")
+
+
+class RhsmStubServer:
+    """Imitation of the RHSM API served from a background thread on a local port.
+
+    :param latency: seconds by which every response is delayed
+    :param rate_limit: fraction of requests, other than token requests, answered with HTTP 429
+    :param export_polls: number of export job status checks answered with HTTP 202
+    :param pools: (subscription name, available entitlements) pairs, -1 meaning unlimited
+    :param lost_responses: fraction of successful POST requests answered with HTTP 504
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        *,
+        latency=0,
+        rate_limit=0,
+        export_polls=1,
+        pools=DEFAULT_POOLS,
+        seed=None,
+        lost_responses=0,
+    ):
+        self.latency = latency
+        self.lost_responses = lost_responses
+        self.rate_limit = rate_limit
+        self.export_polls = export_polls
+        self.requests = Counter()
+        self.allocations = {}
+        self.pools = [
+            {
+                "id": uuid.uuid4().hex,
+                "subscriptionName": name,
+                "entitlementsAvailable": available,
+                "quantity": available,
+            }
+            for name, available in pools
+        ]
+        self._export_jobs = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Return the URL that the stub is served from."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_url(self):
+        """Return the URL of the stub's token endpoint."""
+        return f"{self.base_url}{TOKEN_PATH}"
+
+    @property
+    def allocations_url(self):
+        """Return the URL of the stub's allocations endpoint."""
+        return f"{self.base_url}{API_PATH}"
+
+    def manifest_category(self, **overrides):
+        """Return a manifest category that generates manifests from the stub."""
+        category = {
+            "offline_token": "stub-offline-token",
+            "sat_version": SAT_VERSIONS[-1],
+            "subscription_data": [
+                {"name": pool["subscriptionName"], "quantity": 1} for pool in self.pools[:2]
+            ],
+            "simple_content_access": "enabled",
+            "url": {"token_request": self.token_url, "allocations": self.allocations_url},
+            "proxies": {},
+            "metadata_cache_ttl": 0,
+            "preflight": False,
+        }
+        category.update(overrides)
+        return category
+
+    def start(self):
+        """Start serving requests from a background thread."""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="rhsm-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the listening socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        """Start the stub."""
+        return self.start()
+
+    def __exit__(self, *tb_args):
+        """Stop the stub."""
+        self.stop()
+
+    def respond(self, method, path, query, body, headers):
+        """Return the status, body, content type and headers of the response to a request."""
+        if self.latency:
+            time.sleep(self.latency)
+        if path == TOKEN_PATH and method == "POST":
+            self.requests["token"] += 1
+            token = {"access_token": uuid.uuid4().hex, "expires_in": 900}
+            return 200, token, JSON_TYPE, {}
+        if not path.startswith(API_PATH):
+            return 404, {"error": "not found"}, JSON_TYPE, {}
+        if self.rate_limit and self._random.random() < self.rate_limit:
+            self.requests["rate_limited"] += 1
+            return 429, {"error": "rate limited"}, JSON_TYPE, {}
+        parts = [part for part in path[len(API_PATH) :].split("/") if part]
+        with self._lock:
+            status, response, content_type, headers = self._route(method, parts, query, headers)
+            if (
+                method == "POST"
+                and status == 200  # noqa: PLR2004
+                and self.lost_responses
+                and self._random.random() < self.lost_responses
+            ):
+                # The allocation or attachment has been made, but the client is not told so
+                self.requests["lost_response"] += 1
+                return 504, {"error": "gateway timeout"}, JSON_TYPE, {}
+            return status, response, content_type, headers
+
+    def _route(self, method, parts, query, headers):
+        if parts == ["versions"]:
+            return self._versions(headers)
+        if not parts:
+            return self._allocations(method, query)
+        allocation = self.allocations.get(parts[0])
+        if allocation is None:
+            return 404, {"error": "allocation not found"}, JSON_TYPE, {}
+        if len(parts) == 1:
+            return self._allocation(method, allocation, query)
+        if parts[1] in ("pools", "entitlements"):
+            return self._allocation_pools(method, allocation, parts[1:], query)
+        return self._allocation_export(method, allocation, parts[1:])
+
+    def _versions(self, headers):
+        self.requests["versions"] += 1
+        etag = '"stub-versions"'
+        if headers.get("If-None-Match") == etag:
+            return 304, None, JSON_TYPE, {"ETag": etag}
+        versions = [{"value": v, "description": f"Satellite {v[4:]}"} for v in SAT_VERSIONS]
+        return 200, {"body": versions}, JSON_TYPE, {"ETag": etag}
+
+    def _allocations(self, method, query):
+        if method == "GET":
+            self.requests["list_allocations"] += 1
+            offset = int(query.get("offset", 0))
+            listing = [
+                {key: value for key, value in alloc.items() if key != "entitlements"}
+                for alloc in self.allocations.values()
+            ]
+            page = listing[offset : offset + ALLOCATIONS_PAGE_SIZE]
+            return 200, {"body": page}, JSON_TYPE, {}
+        if method == "POST":
+            self.requests["create_allocation"] += 1
+            allocation_uuid = str(uuid.uuid4())
+            self.allocations[allocation_uuid] = {
+                "uuid": allocation_uuid,
+                "name": query.get("name"),
+                "version": query.get("version"),
+                "simpleContentAccess": query.get("simpleContentAccess", "enabled"),
+                "createdDate": datetime.now(UTC).isoformat(),
+                "entitlementQuantity": 0,
+                "type": "Satellite",
+                "entitlements": [],
+            }
+            created = {"uuid": allocation_uuid, "name": query.get("name")}
+            return 200, {"body": created}, JSON_TYPE, {}
+        return 405, {"error": "method not allowed"}, JSON_TYPE, {}
+
+    def _allocation(self, method, allocation, query):
+        if method == "GET":
+            self.requests["allocation_details"] += 1
+            details = {key: value for key, value in allocation.items() if key != "entitlements"}
+            if query.get("include") == "entitlements":
+                details["entitlementsAttached"] = {
+                    "valid": True,
+                    "value": allocation["entitlements"],
+                }
+            return 200, {"body": details}, JSON_TYPE, {}
+        if method == "PUT":
+            self.requests["update_allocation"] += 1
+            return 200, {}, JSON_TYPE, {}
+        if method == "DELETE":
+            self.requests["delete_allocation"] += 1
+            for entitlement in allocation["entitlements"]:
+                self._return_entitlement(entitlement)
+            del self.allocations[allocation["uuid"]]
+            return 204, None, JSON_TYPE, {}
+        return 405, {"error": "method not allowed"}, JSON_TYPE, {}
+
+    def _allocation_pools(self, method, allocation, parts, query):
+        if parts == ["pools"] and method == "GET":
+            self.requests["pools"] += 1
+            offset = int(query.get("offset", 0))
+            pools = [
+                {key: value for key, value in pool.items() if key != "quantity"}
+                for pool in self.pools
+            ]
+            return 200, {"body": pools[offset : offset + POOLS_PAGE_SIZE]}, JSON_TYPE, {}
+        if parts == ["entitlements"] and method == "POST":
+            self.requests["attach"] += 1
+            return self._attach(allocation, query.get("pool"), int(query.get("quantity", 1)))
+        if parts[0] == "entitlements" and method == "DELETE" and len(parts) == 2:  # noqa: PLR2004
+            self.requests["detach"] += 1
+            for entitlement in list(allocation["entitlements"]):
+                if entitlement["id"] == parts[1]:
+                    allocation["entitlements"].remove(entitlement)
+                    self._return_entitlement(entitlement)
+                    return 204, None, JSON_TYPE, {}
+            return 404, {"error": "entitlement not found"}, JSON_TYPE, {}
+        return 404, {"error": "not found"}, JSON_TYPE, {}
+
+    def _allocation_export(self, method, allocation, parts):
+        if method != "GET":
+            return 405, {"error": "method not allowed"}, JSON_TYPE, {}
+        if parts == ["export"]:
+            self.requests["export"] += 1
+            job_id = uuid.uuid4().hex
+            self._export_jobs[job_id] = self.export_polls
+            job = {"exportJobID": job_id, "href": f"exportJob/{job_id}"}
+            return 200, {"body": job}, JSON_TYPE, {}
+        if parts[0] == "exportJob" and len(parts) == 2:  # noqa: PLR2004
+            self.requests["export_job"] += 1
+            remaining = self._export_jobs.get(parts[1], 0)
+            if remaining > 0:
+                self._export_jobs[parts[1]] = remaining - 1
+                return 202, {"body": {"status": "pending"}}, JSON_TYPE, {}
+            href = f"{self.allocations_url}/{allocation['uuid']}/export/{parts[1]}"
+            return 200, {"body": {"exportID": parts[1], "href": href}}, JSON_TYPE, {}
+        if parts[0] == "export":
+            self.requests["download"] += 1
+            return 200, _manifest_archive(allocation), "application/zip", {}
+        return 404, {"error": "not found"}, JSON_TYPE, {}
+
+    def _attach(self, allocation, pool_id, quantity):
+        pool = next((pool for pool in self.pools if pool["id"] == pool_id), None)
+        if pool is None:
+            return 404, {"error": "pool not found"}, JSON_TYPE, {}
+        available = pool["entitlementsAvailable"]
+        if available != -1 and available < quantity:
+            return 400, {"error": "not enough entitlements"}, JSON_TYPE, {}
+        if available != -1:
+            pool["entitlementsAvailable"] -= quantity
+        entitlement = {
+            "id": uuid.uuid4().hex,
+            "pool": pool_id,
+            "subscriptionName": pool["subscriptionName"],
+            "entitlementQuantity": quantity,
+        }
+        allocation["entitlements"].append(entitlement)
+        allocation["entitlementQuantity"] += quantity
+        return 200, {"body": entitlement}, JSON_TYPE, {}
+
+    def _return_entitlement(self, entitlement):
+        pool = next((p for p in self.pools if p["id"] == entitlement["pool"]), None)
+        if pool is not None and pool["entitlementsAvailable"] != -1:
+            pool["entitlementsAvailable"] += entitlement["entitlementQuantity"]
@@ -0,0 +1,167 @@
+"""Records the phases of manifest generation as spans for timeline viewers.
+
+When tracing is started, each phase of every Manifester instance in the process (requesting an
+access token, creating the allocation, matching and attaching subscriptions, verifying entitlements,
+polling the export job and downloading the manifest) is recorded as a span on the thread that ran
+it, with the name and UUID of its allocation. The spans are written as Chrome trace-event JSON,
+which chrome://tracing and https://ui.perfetto.dev display as a timeline with a row per thread, so
+that bulk and concurrent runs show where phases wait on each other.
+
+Tracing is started by the `trace_file` setting, the `--trace` option of the CLI, or `start()`, and
+the trace file is written when the process exits or `stop()` is called. If the `otel_tracing`
+setting is enabled and opentelemetry-api is installed, spans are also sent to the configured
+OpenTelemetry tracer provider.
+"""
+import atexit
+from contextlib import ExitStack, contextmanager
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+from manifester.logger import _logger as logger
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - opentelemetry-api is an optional dependency
+    otel_trace = None
+
+
+class Span:
+    """A timed phase with attributes describing the allocation it belongs to."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.thread_id = threading.get_native_id()
+        self.start = time.time_ns() // 1000
+        self._started = time.perf_counter_ns()
+        self.duration = None
+        self.otel_span = None
+
+    def set(self, key, value):
+        """Set an attribute of the span, ignoring values that are not known yet."""
+        if value is None:
+            return
+        self.attributes[key] = value
+        if self.otel_span is not None:
+            self.otel_span.set_attribute(key, value)
+
+    def finish(self):
+        """Record the duration of the span."""
+        self.duration = (time.perf_counter_ns() - self._started) // 1000
+
+    def trace_event(self, pid):
+        """Return the span as a Chrome complete ("X") trace event, in microseconds."""
+        return {
+            "name": self.name,
+            "cat": "manifester",
+            "ph": "X",
+            "ts": self.start,
+            "dur": self.duration,
+            "pid": pid,
+            "tid": self.thread_id,
+            "args": {key: str(value) for key, value in self.attributes.items()},
+        }
+
+
+class _NoSpan:
+    """Stands in for a span while tracing is not active."""
+
+    def set(self, key, value):
+        """Ignore the attribute."""
+
+
+NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """Collects finished spans and writes them to a Chrome trace file, if it has a path."""
+
+    def __init__(self, path, otel=False):
+        self.path = Path(path) if path else None
+        self.spans = []
+        self._lock = threading.Lock()
+        self._otel_tracer = _otel_tracer() if otel else None
+
+    @contextmanager
+    def span(self, name, attributes):
+        """Record the block as a span."""
+        span_ = Span(name, attributes)
+        with ExitStack() as stack:
+            if self._otel_tracer is not None:
+                span_.otel_span = stack.enter_context(
+                    self._otel_tracer.start_as_current_span(name, attributes=span_.attributes)
+                )
+            try:
+                yield span_
+            finally:
+                span_.finish()
+                with self._lock:
+                    self.spans.append(span_)
+
+    def write(self):
+        """Write every finished span to the trace file, replacing it atomically."""
+        if self.path is None:
+            return None
+        with self._lock:
+            events = [span_.trace_event(os.getpid()) for span_ in self.spans]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+        tmp_path.replace(self.path)
+        logger.info("Wrote %s trace spans to %s", len(events), self.path)
+        return self.path
+
+
+def _otel_tracer():
+    """Return an OpenTelemetry tracer, or None if opentelemetry-api is not installed."""
+    if otel_trace is None:
+        logger.warning("Install opentelemetry-api to send manifester spans to OpenTelemetry.")
+        return None
+    return otel_trace.get_tracer("manifester")
+
+
+_active_tracer = None
+_active_lock = threading.Lock()
+
+
+def start(path, otel=False):
+    """Start recording spans for the trace file at path, unless tracing is already active.
+
+    Spans are only collected in memory if path is None.
+    """
+    global _active_tracer  # noqa: PLW0603 - a single tracer is shared by every thread
+    with _active_lock:
+        if _active_tracer is None:
+            _active_tracer = Tracer(path, otel=otel)
+            logger.debug("Recording trace spans for %s.", path)
+        return _active_tracer
+
+
+@atexit.register
+def stop():
+    """Stop recording spans and write the trace file, if tracing is active."""
+    global _active_tracer
+    with _active_lock:
+        tracer, _active_tracer = _active_tracer, None
+    if tracer is not None:
+        return tracer.write()
+    return None
+
+
+def active_tracer():
+    """Return the active tracer, or None."""
+    return _active_tracer
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record the block as a span if tracing is active, yielding the span."""
+    tracer = _active_tracer
+    if tracer is None:
+        yield NO_SPAN
+        return
+    with tracer.span(name, attributes) as span_:
+        yield span_
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Measures the cost of logging large subscription pool listings on the calling thread.
+
+Compares eager f-string formatting with deferred formatting, written either synchronously or by
+the queue-based asynchronous logging mode, at the info and debug log levels. Example usage:
+
+    scripts/logging_benchmark.py --pools 5000 --iterations 50
+"""
+from pathlib import Path
+import tempfile
+import time
+import uuid
+
+import click
+
+from manifester.logger import _setup_logzero, _stop_queue_listener
+
+
+def _pools(count):
+    return [
+        {
+            "id": uuid.uuid4().hex,
+            "subscriptionName": "Red Hat Satellite Infrastructure Subscription",
+            "entitlementsAvailable": num % 100,
+        }
+        for num in range(count)
+    ]
+
+
+def _run(pools, iterations, log_dir, *, level, log_async, lazy):
+    logger = _setup_logzero(
+        level=level,
+        path=str(Path(log_dir, f"{level}-{log_async}-{lazy}.log")),
+        name="manifester_logging_benchmark",
+        log_async=log_async,
+    )
+    message = "The following pools are matches for this subscription:"
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if lazy:
+            logger.debug("%s %s", message, pools)
+        else:
+            logger.debug(f"{message} {pools}")  # noqa: G004
+    caller_time = time.perf_counter() - start
+    # Stopping the listener waits for queued records to be written
+    _stop_queue_listener(logger)
+    total_time = time.perf_counter() - start
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+    return caller_time, total_time
+
+
+@click.command()
+@click.option(
+    "--pools", type=int, default=5000, show_default=True, help="Number of pools per record"
+)
+@click.option(
+    "--iterations", type=int, default=50, show_default=True, help="Logging calls per case"
+)
+def main(pools, iterations):
+    """Run the benchmark and print the time per logging call."""
+    pools = _pools(pools)
+    click.echo(
+        f"{'level':<6} {'mode':<6} {'format':<6} {'caller ms/call':>15} {'total ms/call':>14}"
+    )
+    with tempfile.TemporaryDirectory() as log_dir:
+        for level in ("info", "debug"):
+            for log_async in (False, True):
+                for lazy in (False, True):
+                    caller_time, total_time = _run(
+                        pools, iterations, log_dir, level=level, log_async=log_async, lazy=lazy
+                    )
+                    click.echo(
+                        f"{level:<6} {'async' if log_async else 'sync':<6} "
+                        f"{'lazy' if lazy else 'eager':<6} "
+                        f"{caller_time * 1000 / iterations:>15.3f} "
+                        f"{total_time * 1000 / iterations:>14.3f}"
+                    )
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,58 @@
+from datetime import datetime, timedelta
 from functools import cached_property
+import io
+import json
+import os
 from pathlib import Path
 import random
 import string
+import threading
+import time
 import uuid
+import zipfile
 
+from click.testing import CliRunner
 import pytest
+import requests
 from requests.exceptions import Timeout
 
-from manifester import Manifester
+from manifester import (
+    Manifester,
+    accounts,
+    bench,
+    cassettes,
+    helpers,
+    inspection,
+    journal,
+    loadtest,
+    preflight,
+    profiling,
+    pytest_plugin,
+    tracing,
+)
+from manifester.accounts import ACCOUNT_SELECTOR, category_accounts
+from manifester.commands import cli
+from manifester.concurrency import AdaptiveLimiter, clear_limiters, limiter_metrics
+from manifester.deadlines import DeadlineExceeded, active_deadline, deadline
+from manifester.hedging import HEDGE_BUDGET, LATENCY_TRACKER, HedgingRequester
 from manifester.helpers import (
+    POOL_CATALOG,
     MockStub,
     fake_http_response_code,
+    find_stale_allocations,
+    hydrate_allocations,
     load_inventory_file,
+    reap_allocations,
     update_inventory,
 )
+from manifester.journal import AllocationJournal, JournalInUse, discard_journal, load_journals
+from manifester.logger import _setup_logzero, _stop_queue_listener
+from manifester.records import PoolRecord
+from manifester.reservations import ReservationLedger
+from manifester.scheduling import SCHEDULED_OPERATIONS, SCHEDULER, Scheduler
+from manifester.stub import RhsmStubServer
+
+pytest_plugins = ["pytester"]
 
 SUB_ALLOCATION_UUID = f"{uuid.uuid4().hex}"
 
@@ -100,6 +139,12 @@ class RhsmApiStub(MockStub):
         self._bad_codes = kwargs.get("bad_codes", [429, 500, 504])
         self._fail_rate = kwargs.get("fail_rate", 0)
         self._has_offset = kwargs.get("has_offset", False)
+        self._attached_entitlements = kwargs.get("attached_entitlements", [])
+        self._entitlement_requests = 0
+        self._pool_requests = 0
+        self._allocation_requests = 0
+        self._detached_entitlements = []
+        self._delete_requests = 0
         super().__init__(in_dict)
 
     @cached_property
@@ -113,6 +158,7 @@ class RhsmApiStub(MockStub):
             self.access_token = "this is a simulated access token"
             return self
         if args[0].endswith("allocations"):
+            self._allocation_requests += 1
             self.uuid = SUB_ALLOCATION_UUID
             return self
         if args[0].endswith("entitlements"):
@@ -131,38 +177,16 @@ class RhsmApiStub(MockStub):
                 ]
             }
             return self
-        if args[0].endswith("pools") and not self._has_offset:
-            self.pool_response = SUB_POOL_RESPONSE
+        if kwargs.get("params", {}).get("include") == "entitlements":
+            self._entitlement_requests += 1
+            self.entitlement_response = {
+                "body": {"entitlementsAttached": {"value": self._attached_entitlements}}
+            }
             return self
-        if args[0].endswith("pools") and self._has_offset:
-            if kwargs["params"]["offset"] != 50:
-                self.pool_response = {"body": []}
-                for _x in range(50):
-                    self.pool_response["body"].append(
-                        {
-                            "id": f'{"".join(random.sample(string.ascii_letters, 12))}',
-                            "subscriptionName": "Red Hat Satellite Infrastructure Subscription",
-                            "entitlementsAvailable": random.randrange(100),
-                        }
-                    )
-                return self
-            else:
-                self.pool_response["body"] += SUB_POOL_RESPONSE["body"]
-                return self
+        if args[0].endswith("pools"):
+            return self._get_pools(kwargs.get("params", {}))
         if args[0].endswith("allocations") and self._has_offset:
-            if kwargs["params"]["offset"] != 100:
-                self.allocations_response = {"body": []}
-                for _x in range(100):
-                    self.allocations_response["body"].append(
-                        {
-                            "uuid": f"{uuid.uuid4().hex}",
-                            "name": f'{"".join(random.sample(string.ascii_letters, 12))}',
-                        }
-                    )
-                return self
-            else:
-                self.allocations_response["body"] += SUB_ALLOCATIONS_RESPONSE["body"]
-                return self
+            return self._get_allocations_page(kwargs["params"])
         if (
             "allocations" in args[0]
             and not ("export" in args[0] or "pools" in args[0])
@@ -188,8 +212,49 @@ class RhsmApiStub(MockStub):
             self.content = b"this is a simulated manifest"
             return self
 
+    def _get_pools(self, params):
+        """Simulate a page of the subscription pools of an allocation."""
+        self._pool_requests += 1
+        if not self._has_offset:
+            self.pool_response = SUB_POOL_RESPONSE
+            return self
+        if params["offset"] != 50:
+            self.pool_response = {"body": []}
+            for _x in range(50):
+                self.pool_response["body"].append(
+                    {
+                        "id": f'{"".join(random.sample(string.ascii_letters, 12))}',
+                        "subscriptionName": "Red Hat Satellite Infrastructure Subscription",
+                        "entitlementsAvailable": random.randrange(100),
+                    }
+                )
+        else:
+            self.pool_response["body"] += SUB_POOL_RESPONSE["body"]
+        return self
+
+    def _get_allocations_page(self, params):
+        """Simulate a page of subscription allocations."""
+        if params["offset"] != 100:
+            self.allocations_response = {"body": []}
+            for _x in range(100):
+                self.allocations_response["body"].append(
+                    {
+                        "uuid": f"{uuid.uuid4().hex}",
+                        "name": f'{"".join(random.sample(string.ascii_letters, 12))}',
+                    }
+                )
+        else:
+            self.allocations_response["body"] += SUB_ALLOCATIONS_RESPONSE["body"]
+        return self
+
     def delete(self, *args, **kwargs):
         """Simulate responses to DELETE requests for RHSM API endpoints used by Manifester."""
+        self._delete_requests += 1
+        if "/entitlements/" in args[0]:
+            del self.status_code
+            self._detached_entitlements.append(args[0].split("/")[-1])
+            self._good_codes = [204]
+            return self
         if (
             args[0].endswith(f"allocations/{SUB_ALLOCATION_UUID}")
             and kwargs["params"]["force"] == "true"
@@ -301,6 +366,905 @@ def test_correct_subs_added_to_allocation():
     assert active_subs == sub_names_from_config
 
 
+def test_reconcile_allocation_entitlements_single_request(tmp_path, monkeypatch):
+    """Test that all requested subscriptions are verified with one request and shortfalls returned."""
+    monkeypatch.chdir(tmp_path)
+    requester = RhsmApiStub(
+        in_dict=None,
+        attached_entitlements=[
+            {
+                "subscriptionName": "Red Hat Satellite Infrastructure Subscription",
+                "entitlementQuantity": 1,
+            },
+            {"subscriptionName": "Red Hat Beta Access", "entitlementQuantity": 1},
+        ],
+    )
+    manifester = Manifester(manifest_category=MANIFEST_DATA, requester=requester)
+    manifester.create_subscription_allocation()
+    subscription_data = [dict(sub, quantity=2) for sub in MANIFEST_DATA["subscription_data"]]
+    shortfalls = manifester.reconcile_allocation_entitlements(subscription_data)
+    assert requester._entitlement_requests == 1
+    assert sorted((s["name"], s["quantity"]) for s in shortfalls) == [
+        ("Red Hat Beta Access", 1),
+        ("Red Hat Enterprise Linux Server, Premium (Physical or Virtual Nodes)", 2),
+        ("Red Hat Enterprise Linux for Virtual Datacenters, Premium", 2),
+        ("Red Hat Satellite Infrastructure Subscription", 1),
+    ]
+
+
+def test_pool_catalog_shared_across_allocations(tmp_path, monkeypatch):
+    """Test that pools are fetched once per account and version and consumed locally."""
+    monkeypatch.chdir(tmp_path)
+    POOL_CATALOG.clear()
+    requester = RhsmApiStub(in_dict=None)
+    for _ in range(2):
+        Manifester(
+            manifest_category=MANIFEST_DATA, requester=requester, pool_catalog_ttl=300
+        ).get_manifest()
+    assert requester._pool_requests == 1
+    manifester = Manifester(manifest_category=MANIFEST_DATA, requester=requester)
+    manifester.allocation_uuid = SUB_ALLOCATION_UUID
+    catalog_pools = POOL_CATALOG.pools(manifester, ttl=300)["body"]
+    assert [pool["entitlementsAvailable"] for pool in catalog_pools] == [6, 6, 6, 6]
+    assert [pool["entitlementsAvailable"] for pool in SUB_POOL_RESPONSE["body"]] == [8, 8, 8, 8]
+    POOL_CATALOG.invalidate(manifester)
+    POOL_CATALOG.pools(manifester, ttl=300)
+    assert requester._pool_requests == 2
+    POOL_CATALOG.clear()
+
+
+def test_recycle_parked_allocation(tmp_path, monkeypatch):
+    """Test that a released allocation is stripped, parked, and reused by the next request."""
+    monkeypatch.chdir(tmp_path)
+    requester = RhsmApiStub(
+        in_dict=None,
+        attached_entitlements=[
+            {
+                "id": "8a85f99c7d76f2fd017d78ef6bf9",
+                "subscriptionName": "Red Hat Beta Access",
+                "entitlementQuantity": 1,
+            }
+        ],
+    )
+    with Manifester(
+        manifest_category=MANIFEST_DATA, requester=requester, recycle_allocations=True
+    ) as manifest:
+        assert manifest.uuid == SUB_ALLOCATION_UUID
+    assert requester._detached_entitlements == ["8a85f99c7d76f2fd017d78ef6bf9"]
+    inventory = load_inventory_file(Path(MANIFEST_DATA["inventory_path"]))
+    assert [alloc.get("parked") for alloc in inventory if alloc["uuid"] == SUB_ALLOCATION_UUID] == [
+        True
+    ]
+    manifester = Manifester(
+        manifest_category=MANIFEST_DATA, requester=requester, recycle_allocations=True
+    )
+    assert manifester.create_subscription_allocation() == SUB_ALLOCATION_UUID
+    assert manifester.allocation_name == SUB_ALLOCATIONS_RESPONSE["body"][0]["name"]
+    assert requester._allocation_requests == 1
+    inventory = load_inventory_file(Path(MANIFEST_DATA["inventory_path"]))
+    assert not any(alloc.get("parked") for alloc in inventory)
+
+
+def test_hydrate_allocations_cached_by_last_modified(tmp_path):
+    """Test that allocation details are fetched concurrently and cached until they change."""
+    requester = RhsmApiStub(
+        in_dict=None,
+        attached_entitlements=[
+            {"subscriptionName": "Red Hat Beta Access", "entitlementQuantity": 1},
+        ],
+    )
+    manifester = Manifester(minimal_init=True, requester=requester)
+    allocations = [
+        {"uuid": f"{uuid.uuid4().hex}", "name": f"test_user-{num}", "lastModified": "2024-03-20"}
+        for num in range(5)
+    ]
+    cache_path = tmp_path / "allocation_details.json"
+    results = list(hydrate_allocations(manifester, allocations, max_workers=3, cache_path=cache_path))
+    assert sorted(num for num, _, _ in results) == [0, 1, 2, 3, 4]
+    assert all(entitlements[0]["entitlementQuantity"] == 1 for _, _, entitlements in results)
+    assert requester._entitlement_requests == 5
+    allocations[2]["lastModified"] = "2024-03-21"
+    list(hydrate_allocations(manifester, allocations, max_workers=3, cache_path=cache_path))
+    assert requester._entitlement_requests == 6
+    # An allocation whose details cannot be fetched does not end the listing
+    get_details = manifester.get_allocation_details
+
+    def _get_details(allocation_uuid):
+        if allocation_uuid == allocations[3]["uuid"]:
+            raise requests.HTTPError("404 Client Error: Not Found")
+        return get_details(allocation_uuid)
+
+    manifester.get_allocation_details = _get_details
+    for allocation in allocations:
+        allocation["lastModified"] = "2024-03-22"
+    results = list(hydrate_allocations(manifester, allocations, max_workers=3, cache_path=cache_path))
+    assert sorted(num for num, _, entitlements in results if entitlements is None) == [3]
+    assert len(results) == 5
+    # Allocations in other accounts are looked up with the manifester of their account
+    other_requester = RhsmApiStub(in_dict=None)
+    allocations[0].update(account="other", lastModified="2024-03-23")
+    other_manifesters = {"other": Manifester(minimal_init=True, requester=other_requester)}
+    list(
+        hydrate_allocations(
+            manifester, allocations[:1], cache_path=cache_path, account_manifesters=other_manifesters
+        )
+    )
+    assert other_requester._entitlement_requests == 1
+
+
+def test_find_stale_allocations():
+    """Test that allocations are stale when too old or, optionally, missing from the inventory."""
+    now = datetime.fromisoformat("2024-03-20T12:00:00+00:00")
+    allocations = [
+        {"uuid": "old", "name": "test_user-old", "createdDate": "2024-03-18T12:00:00.000Z"},
+        {"uuid": "new", "name": "test_user-new", "createdDate": "2024-03-20T11:00:00.000Z"},
+        {"uuid": "untracked", "name": "test_user-untracked"},
+    ]
+    inventory = [{"uuid": "old"}, {"uuid": "new"}]
+    stale = find_stale_allocations(allocations, inventory, max_age=timedelta(days=1), now=now)
+    assert [alloc["uuid"] for alloc, _ in stale] == ["old"]
+    stale = find_stale_allocations(
+        allocations, inventory, max_age=timedelta(days=1), untracked=True, now=now
+    )
+    assert [alloc["uuid"] for alloc, _ in stale] == ["old", "untracked"]
+
+
+def test_reap_untracked_allocations(tmp_path, monkeypatch):
+    """Test that the reaper reports stale allocations in dry-run mode and deletes them otherwise."""
+    monkeypatch.chdir(tmp_path)
+    update_inventory([], sync=True)
+    manifester = Manifester(minimal_init=True, requester=RhsmApiStub(in_dict=None))
+    manifester.username_prefix = MANIFEST_DATA["username_prefix"]
+    # The reaper lists the allocations itself instead of reading a cached listing
+    manifester._allocations = [{"uuid": "cached", "name": "test_user-cached"}]
+    report = reap_allocations(manifester, untracked=True, dry_run=True)
+    assert [(entry["uuid"], entry["status"]) for entry in report] == [(SUB_ALLOCATION_UUID, None)]
+    report = reap_allocations(manifester, untracked=True, rate=10)
+    assert [(entry["uuid"], entry["status"]) for entry in report] == [(SUB_ALLOCATION_UUID, 204)]
+
+
+def test_async_logging_defers_formatting(tmp_path):
+    """Test that asynchronous logging formats and writes records off the calling thread."""
+
+    class PoolListing:
+        formatted_on = []
+
+        def __str__(self):
+            self.formatted_on.append(threading.current_thread())
+            return "formatted pool listing"
+
+    log_file = tmp_path / "manifester.log"
+    logger = _setup_logzero(
+        level="debug", path=str(log_file), name="manifester_async_test", log_async=True
+    )
+    logger.debug("The following pools are matches for this subscription: %s", PoolListing())
+    _stop_queue_listener(logger)
+    assert PoolListing.formatted_on
+    assert threading.current_thread() not in PoolListing.formatted_on
+    assert "formatted pool listing" in log_file.read_text()
+
+
+def test_subscription_pools_projected_to_compact_records(tmp_path, monkeypatch):
+    """Test that pools are kept as compact records unless raw records are requested."""
+    monkeypatch.chdir(tmp_path)
+    manifester = Manifester(manifest_category=MANIFEST_DATA, requester=RhsmApiStub(in_dict=None))
+    manifester.create_subscription_allocation()
+    pools = manifester.subscription_pools["body"]
+    assert all(isinstance(pool, PoolRecord) for pool in pools)
+    assert pools == SUB_POOL_RESPONSE["body"]
+    assert not hasattr(pools[0], "__dict__")
+    with pytest.raises(KeyError):
+        pools[0]["productName"]
+    assert pools[0].get("productName") is None
+    manifester = Manifester(
+        manifest_category=MANIFEST_DATA, requester=RhsmApiStub(in_dict=None), raw_records=True
+    )
+    manifester.create_subscription_allocation()
+    assert all(isinstance(pool, dict) for pool in manifester.subscription_pools["body"])
+
+
+def test_streamed_pools_stop_fetching_after_match(tmp_path, monkeypatch):
+    """Test that streaming pool matching stops requesting pages once a subscription is attached."""
+    monkeypatch.chdir(tmp_path)
+    requester = RhsmApiStub(in_dict=None, has_offset=True)
+    manifester = Manifester(manifest_category=MANIFEST_DATA, requester=requester)
+    manifester.create_subscription_allocation()
+    manifester.process_subscription_pools(
+        subscription_pools=manifester.iter_subscription_pools(),
+        subscription_data={"name": "Red Hat Satellite Infrastructure Subscription", "quantity": 1},
+    )
+    assert len(manifester._active_pools) == 1
+    assert requester._pool_requests == 1
+
+
+def _write_manifest(path, subscriptions, content_access_mode="org_environment"):
+    """Write a manifest file with the layout of an exported RHSM manifest.
+
+    The consumer has the fields of a consumer exported by RHSM, which do not include a version.
+    """
+    consumer_export = io.BytesIO()
+    with zipfile.ZipFile(consumer_export, "w", compression=zipfile.ZIP_DEFLATED) as export:
+        export.writestr(
+            "export/consumer.json",
+            json.dumps(
+                {
+                    "uuid": SUB_ALLOCATION_UUID,
+                    "name": "test_user-manifest",
+                    "type": {"label": "satellite", "manifest": True},
+                    "owner": {"key": "1234567", "displayName": "1234567"},
+                    "urlWeb": "access.redhat.com/management/distributors/",
+                    "urlApi": "subscription.rhsm.redhat.com/subscription/",
+                    "contentAccessMode": content_access_mode,
+                }
+            ),
+        )
+        export.writestr("export/meta.json", json.dumps({"created": "2024-03-20T14:52:02+0000"}))
+        for num, (name, quantity) in enumerate(subscriptions):
+            export.writestr(
+                f"export/entitlements/{num}.json",
+                json.dumps({"pool": {"id": f"pool{num}", "productName": name}, "quantity": quantity}),
+            )
+    with zipfile.ZipFile(path, "w") as manifest:
+        manifest.writestr("consumer_export.zip", consumer_export.getvalue())
+        manifest.writestr("signature", b"signature")
+
+
+def test_inspect_manifest_and_match_category(tmp_path, monkeypatch):
+    """Test that manifests are summarized in memory, indexed, and matched to categories."""
+    manifest_path = tmp_path / "test_user-manifest_manifest.zip"
+    _write_manifest(
+        manifest_path, [(sub["name"], sub["quantity"]) for sub in MANIFEST_DATA["subscription_data"]]
+    )
+    index = inspection.ManifestIndex(tmp_path / "manifest_index.json")
+    summary = index.inspect(manifest_path)
+    assert summary["consumer_uuid"] == SUB_ALLOCATION_UUID
+    assert summary["simple_content_access"] == "enabled"
+    assert len(summary["entitlements"]) == len(MANIFEST_DATA["subscription_data"])
+    # The Satellite version comes from the allocation as listed by the RHSM API
+    assert inspection.with_recorded_version(summary, [])["sat_version"] is None
+    versioned = inspection.with_recorded_version(summary, SUB_ALLOCATIONS_RESPONSE["body"])
+    assert versioned["sat_version"] == MANIFEST_DATA["sat_version"]
+    categories = {
+        "matching": dict(MANIFEST_DATA),
+        "other_version": dict(MANIFEST_DATA, sat_version="sat-6.10"),
+        "sca_disabled": dict(MANIFEST_DATA, simple_content_access="disabled"),
+        "other_subs": dict(MANIFEST_DATA, subscription_data=[{"name": "Red Hat Beta Access", "quantity": 1}]),
+    }
+    assert inspection.matching_categories(versioned, categories) == ["matching"]
+    index.save()
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("manifest should be served from the index")
+
+    monkeypatch.setattr(inspection, "read_manifest", _fail)
+    assert inspection.ManifestIndex(tmp_path / "manifest_index.json").inspect(manifest_path) == summary
+
+
+def test_manifest_prefetcher_generates_in_background_and_deletes_at_end(tmp_path, monkeypatch):
+    """Test that prefetched manifests are handed out and all allocations are deleted at the end."""
+    monkeypatch.chdir(tmp_path)
+    requesters = []
+
+    def _manifester_factory(category):
+        requesters.append(RhsmApiStub(in_dict=None))
+        assert category == "golden_ticket"
+        return Manifester(manifest_category=MANIFEST_DATA, requester=requesters[-1])
+
+    prefetcher = pytest_plugin.ManifestPrefetcher(
+        max_workers=2, manifester_factory=_manifester_factory
+    )
+    prefetcher.prefetch("golden_ticket", count=2)
+    manifests = [prefetcher.get("golden_ticket") for _ in range(3)]
+    assert all(m.content == b"this is a simulated manifest" for m in manifests)
+    assert len(requesters) == 3
+    assert not any(requester._delete_requests for requester in requesters)
+    prefetcher.shutdown()
+    assert all(requester._delete_requests == 1 for requester in requesters)
+
+
+def test_pytest_plugin_prefetches_marked_categories(pytester, monkeypatch):
+    """Test that the plugin prefetches one manifest per test that requests one."""
+    created = []
+
+    def _manifester_factory(category):
+        assert category == "golden_ticket"
+        created.append(Manifester(manifest_category=MANIFEST_DATA, requester=RhsmApiStub()))
+        return created[-1]
+
+    monkeypatch.setattr(pytest_plugin, "_default_manifester", _manifester_factory)
+    pytester.makefile(".yaml", manifester_inventory="")
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.manifester(category="golden_ticket")
+        def test_first(manifester_manifest):
+            assert manifester_manifest.content == b"this is a simulated manifest"
+
+        @pytest.mark.manifester("golden_ticket")
+        def test_second(manifester_manifest):
+            assert manifester_manifest.content == b"this is a simulated manifest"
+        """
+    )
+    result = pytester.runpytest_inprocess("-p", "manifester.pytest_plugin", "--manifester-prefetch")
+    result.assert_outcomes(passed=2)
+    assert len(created) == 2
+    assert all(m.requester._delete_requests == 1 for m in created)
+
+
+def _json_response(data, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(data).encode()
+    return response
+
+
+def test_cassette_record_scrubs_secrets_and_replays(tmp_path, monkeypatch):
+    """Test that recorded exchanges are scrubbed of secrets and replayed at a scaled speed."""
+    api = MockStub()
+    api.post = lambda url, **kwargs: _json_response(
+        {"access_token": "secret-access-token", "refresh_token": "secret-refresh-token"}
+    )
+    api.get = lambda url, **kwargs: _json_response(
+        {"body": [{"value": "sat-6.14"}, {"value": "sat-6.15"}]}
+    )
+    cassette = tmp_path / "cassette.json"
+    recorder = cassettes.RecordingRequester(cassette, requester=api)
+    recorded = Manifester(manifest_category=MANIFEST_DATA, requester=recorder)
+    assert recorded.valid_sat_versions == ["sat-6.14", "sat-6.15"]
+    # The metadata cache is bypassed, so the versions request is always recorded
+    assert recorder.interactions[-1]["request"]["url"].endswith("/versions")
+    recorder.save()
+    assert "secret-" not in cassette.read_text()
+    delays = []
+    monkeypatch.setattr(cassettes.time, "sleep", delays.append)
+    replayer = cassettes.ReplayRequester(cassette, speed=2.0)
+    replayed = Manifester(manifest_category=MANIFEST_DATA, requester=replayer)
+    assert replayed.valid_sat_versions == recorded.valid_sat_versions
+    assert replayed.sat_version == recorded.sat_version
+    assert delays == [i["elapsed"] / 2.0 for i in recorder.interactions]
+    with pytest.raises(cassettes.CassetteError):
+        replayer.delete(f"{replayed.allocations_url}/unrecorded")
+
+
+def test_allocations_spread_across_accounts(tmp_path, monkeypatch):
+    """Test that allocations are assigned to the least loaded account and tagged with it."""
+    monkeypatch.chdir(tmp_path)
+    ACCOUNT_SELECTOR.clear()
+    category = dict(
+        MANIFEST_DATA,
+        accounts=[
+            {"name": "first", "offline_token": "first-token"},
+            {"name": "second", "offline_token": "second-token"},
+        ],
+    )
+    try:
+        manifesters = [
+            Manifester(manifest_category=category, requester=RhsmApiStub(in_dict=None))
+            for _ in range(4)
+        ]
+        assert [m.account.name for m in manifesters] == ["first", "second", "first", "second"]
+        assert manifesters[1].offline_token == "second-token"
+        # Manifests only count as in flight while their allocation is being generated
+        assert ACCOUNT_SELECTOR.in_flight(manifesters[1].account) == 0
+        manifesters[1].create_subscription_allocation()
+        assert ACCOUNT_SELECTOR.in_flight(manifesters[1].account) == 1
+        inventory = load_inventory_file(Path(MANIFEST_DATA["inventory_path"]))
+        assert {"uuid": manifesters[1].allocation_uuid, "account": "second"}.items() <= next(
+            alloc for alloc in inventory if alloc["uuid"] == manifesters[1].allocation_uuid
+        ).items()
+        manifesters[1].delete_subscription_allocation()
+        assert ACCOUNT_SELECTOR.in_flight(manifesters[1].account) == 0
+        # Recent rate limiting and exhausted capacity both steer new allocations away
+        ACCOUNT_SELECTOR.record_rate_limit(manifesters[0].account)
+        assert Manifester(manifest_category=category, requester=RhsmApiStub()).account.name == (
+            "second"
+        )
+        ACCOUNT_SELECTOR.record_capacity(
+            manifesters[1].account, MANIFEST_DATA["subscription_data"][0]["name"], 0
+        )
+        assert Manifester(manifest_category=category, requester=RhsmApiStub()).account.name == (
+            "first"
+        )
+    finally:
+        ACCOUNT_SELECTOR.clear()
+
+
+def test_category_offline_token_takes_precedence_over_global_accounts(monkeypatch):
+    """Test that a category with its own offline token is not spread across global accounts."""
+    global_accounts = [
+        {"name": "first", "offline_token": "first-token"},
+        {"name": "second", "offline_token": "second-token"},
+    ]
+    monkeypatch.setattr(accounts, "settings", {"accounts": global_accounts})
+    (account,) = category_accounts(dict(MANIFEST_DATA, offline_token="dedicated-token"))
+    assert account.offline_token == "dedicated-token"
+    assert [a.name for a in category_accounts({"offline_token": ""})] == ["first", "second"]
+    listed = category_accounts(
+        dict(MANIFEST_DATA, accounts=[{"name": "own", "offline_token": "own-token"}])
+    )
+    assert [a.name for a in listed] == ["own"]
+
+
+def test_reservation_ledger_spreads_attachments_across_pools(tmp_path, monkeypatch):
+    """Test that pools reserved by other instances are skipped and reservations released."""
+    monkeypatch.chdir(tmp_path)
+    ledger = ReservationLedger(tmp_path / "reservations.json")
+    pools = {
+        "body": [
+            {"id": pool_id, "subscriptionName": "Red Hat Beta Access", "entitlementsAvailable": 3}
+            for pool_id in ("first", "second")
+        ]
+    }
+    subscription = {"name": "Red Hat Beta Access", "quantity": 2}
+    other = ledger.reserve(pools["body"][0], 2)
+    assert ledger.reserve(pools["body"][0], 2) is None
+    manifester = Manifester(manifest_category=MANIFEST_DATA, requester=RhsmApiStub(in_dict=None))
+    manifester.reservation_ledger = ledger
+    manifester.allocation_uuid = SUB_ALLOCATION_UUID
+    manifester.process_subscription_pools(pools, dict(subscription))
+    assert manifester.requester.params["pool"] == "second"
+    # The reservation is released once the attachment is made
+    assert ledger.reserved("second") == 0
+    # A reservation made for a failed attachment is released
+    failing = Manifester(
+        manifest_category=MANIFEST_DATA,
+        requester=RhsmApiStub(in_dict=None, good_codes=[404]),
+    )
+    failing.reservation_ledger = ledger
+    failing.allocation_uuid = SUB_ALLOCATION_UUID
+    failing._unverified_subscriptions = []
+    ledger.release(other)
+    failing.process_subscription_pools(pools, dict(subscription))
+    assert failing.requester.params["pool"] == "first"
+    assert ledger.reserved("first") == 0
+    # Once every pool is reserved, the contended pools are tried without a reservation
+    assert ledger.reserve(pools["body"][0], 2)
+    assert ledger.reserve(pools["body"][1], 2)
+    assert list(failing._reserve_matches(iter(pools["body"]), 2)) == [
+        (pools["body"][0], None),
+        (pools["body"][1], None),
+    ]
+
+
+def test_valid_sat_versions_cached_and_revalidated(tmp_path):
+    """Test that the versions response is cached on disk per account, revalidated and bypassable."""
+    api = MockStub()
+    api.is_mock = False
+    requests_sent = []
+    versions = {"body": [{"value": "sat-6.14"}, {"value": "sat-6.15"}]}
+
+    def _get(url, **kwargs):
+        requests_sent.append(kwargs["headers"])
+        if kwargs["headers"].get("If-None-Match") == '"v1"':
+            return _json_response({}, status_code=304)
+        response = _json_response(versions)
+        response.headers["ETag"] = '"v1"'
+        return response
+
+    api.post = lambda url, **kwargs: _json_response({"access_token": "access-token"})
+    api.get = _get
+    cache = helpers.ResponseCache(tmp_path)
+    manifester = Manifester(minimal_init=True, offline_token="token", requester=api)
+    url = f"{manifester.allocations_url}/versions"
+    for _ in range(2):
+        assert helpers.fetch_cached_json(manifester, url, ttl=60, cache=cache) == versions
+    assert len(requests_sent) == 1
+    # A stale entry is revalidated with its ETag, and a 304 response renews it
+    assert helpers.fetch_cached_json(manifester, url, ttl=0, cache=cache) == versions
+    assert requests_sent[-1]["If-None-Match"] == '"v1"'
+    (entry,) = (json.loads(path.read_text()) for path in tmp_path.glob("*.json"))
+    assert time.time() - entry["fetched_at"] < 60
+    assert helpers.fetch_cached_json(manifester, url, ttl=60, bypass=True, cache=cache) == versions
+    assert "If-None-Match" not in requests_sent[-1]
+    assert len(requests_sent) == 3
+    # Another account does not read the cached response, and error responses are not cached
+    other = Manifester(minimal_init=True, offline_token="other-token", requester=api)
+    api.get = lambda url, **kwargs: _json_response({"error": "forbidden"}, status_code=403)
+    for _ in range(2):
+        assert helpers.fetch_cached_json(other, url, ttl=60, cache=cache) == {"error": "forbidden"}
+    assert len(list(tmp_path.glob("*.json"))) == 1
+
+
+def test_preflight_fails_before_creating_allocation(tmp_path, monkeypatch):
+    """Test that misspelled and exhausted subscriptions are reported from the subscription catalog.
+
+    Problems found in a stale cached catalog are confirmed against a refreshed one before failing.
+    """
+    monkeypatch.setattr(preflight, "cache_dir", lambda: tmp_path)
+    category = dict(
+        MANIFEST_DATA,
+        subscription_data=[
+            {"name": "Red Hat Beta Acess", "quantity": 1},
+            {"name": "Red Hat Satellite Infrastructure Subscription", "quantity": 8},
+        ],
+    )
+    requester = RhsmApiStub(in_dict=None)
+    manifester = Manifester(manifest_category=category, requester=requester, preflight=True)
+    problems = manifester.validate_subscription_data()
+    assert "Did you mean 'Red Hat Beta Access'?" in problems[0]
+    assert "largest pool has 8" in problems[1]
+    pool_requests = requester._pool_requests
+    with pytest.raises(ValueError, match="cannot be fulfilled"):
+        manifester.get_manifest()
+    assert requester._allocation_requests == 0
+    assert requester._pool_requests > pool_requests
+    # A cached catalog without the requested subscriptions is refreshed instead of trusted
+    preflight.SubscriptionCatalog().update(manifester, [])
+    Manifester(
+        manifest_category=MANIFEST_DATA, requester=RhsmApiStub(in_dict=None), preflight=True
+    )._preflight()
+
+
+def test_bench_against_local_stub(tmp_path, monkeypatch):
+    """Test that bench probes and times the read-only calls of a local RHSM API stub."""
+    monkeypatch.chdir(tmp_path)
+    with RhsmStubServer() as stub:
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(username_prefix="bench"),
+            metadata_cache_ttl=0,
+        )
+        report = bench.run_bench(manifester, samples=3)
+    assert report["probes"]["allocations"]["url"] == stub.allocations_url
+    phases = report["probes"]["token_request"]["phases"]
+    # The stub is served over plain HTTP without a proxy
+    assert set(phases) == {"dns", "tcp", "ttfb", "total"}
+    for call in ("token", "versions", "allocations"):
+        assert 0 < report["api"][call][50] <= report["api"][call][99]
+    assert stub.requests["token"] >= 3
+    assert stub.requests["versions"] >= 3
+    assert stub.requests["create_allocation"] == 0
+    assert bench.percentiles([4, 1, 3, 2, 5]) == {50: 3, 95: 4.8, 99: 4.96}
+
+
+def test_deadlines_bound_stalled_requests_and_roll_back(tmp_path, monkeypatch):
+    """Test that exceeded budgets raise DeadlineExceeded and delete the unfinished allocation."""
+    monkeypatch.chdir(tmp_path)
+    with RhsmStubServer(export_polls=10**6) as stub:
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(username_prefix="deadline"),
+            phase_budgets={"export": 0.3},
+        )
+        # The allocation rolled back by get_manifest is not deleted again on the way out
+        with pytest.raises(DeadlineExceeded, match="export budget"), manifester:
+            pass
+        assert stub.requests["export_job"] > 1
+        assert stub.requests["delete_allocation"] == 1
+        assert not stub.allocations
+        # A stalled request is abandoned once the overall deadline runs out
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(username_prefix="deadline"),
+            manifest_deadline=0.5,
+        )
+        stub.latency = 5
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as err:
+            manifester.get_manifest()
+        assert err.value.phase == "manifest"
+        assert time.monotonic() - started < 2
+        stub.latency = 0
+
+
+def test_hedged_gets_answered_by_faster_duplicate(tmp_path, monkeypatch):
+    """Test that slow GET requests are hedged within the budget and export jobs are not."""
+    monkeypatch.chdir(tmp_path)
+
+    class FirstRequestStalls:
+        def __init__(self):
+            self.urls = []
+
+        def get(self, url, **kwargs):
+            self.urls.append(url)
+            if len(self.urls) == 1:
+                time.sleep(0.5)
+                return "stalled"
+            return "hedged"
+
+    HEDGE_BUDGET.clear()
+    LATENCY_TRACKER.clear()
+    requester = HedgingRequester(FirstRequestStalls(), min_delay=0.05, budget=1.0, initial_delay=0.1)
+    started = time.monotonic()
+    assert requester.get("https://rhsm.example.com/allocations/versions") == "hedged"
+    assert time.monotonic() - started < 0.4
+    assert (HEDGE_BUDGET.sent, HEDGE_BUDGET.won) == (1, 1)
+    # Without an earned hedge, the slow request is waited for
+    HEDGE_BUDGET.clear()
+    requester = HedgingRequester(FirstRequestStalls(), min_delay=0.05, budget=0, initial_delay=0.1)
+    assert requester.get("https://rhsm.example.com/allocations/versions") == "stalled"
+    requester = HedgingRequester(FirstRequestStalls(), min_delay=0.05, budget=1.0, initial_delay=0.1)
+    assert requester.get(f"https://rhsm.example.com/allocations/{uuid.uuid4()}/export") == "stalled"
+    assert HEDGE_BUDGET.sent == 0
+    with RhsmStubServer() as stub:
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(username_prefix="hedge"),
+            hedge_requests=True,
+        )
+        assert isinstance(manifester.requester, HedgingRequester)
+        assert manifester.get_manifest().status_code == 200
+
+
+def test_hedged_gets_stop_at_the_phase_budget():
+    """Test that hedged requests run under the caller's deadline and stop waiting when it expires."""
+
+    class AlwaysStalls:
+        def __init__(self):
+            self.deadlines = []
+
+        def get(self, url, **kwargs):
+            self.deadlines.append(active_deadline())
+            time.sleep(1)
+            return "stalled"
+
+    HEDGE_BUDGET.clear()
+    LATENCY_TRACKER.clear()
+    stalls = AlwaysStalls()
+    requester = HedgingRequester(stalls, min_delay=0.05, budget=1.0, initial_delay=0.1)
+    started = time.monotonic()
+    with deadline(0.3, "attach") as active, pytest.raises(DeadlineExceeded, match="attach budget"):
+        requester.get("https://rhsm.example.com/allocations/versions")
+    assert time.monotonic() - started < 0.8
+    # Both the request and its hedge were sent with the deadline of the caller
+    assert stalls.deadlines == [active, active]
+
+
+def test_profiling_writes_phase_breakdown(tmp_path, monkeypatch):
+    """Test that profiles record manifest phases, and that the CLI writes them to the log dir."""
+    monkeypatch.chdir(tmp_path)
+    with RhsmStubServer() as stub:
+        manifester = Manifester(manifest_category=stub.manifest_category(username_prefix="prof"))
+        with profiling.profile("library", directory=tmp_path):
+            manifester.get_manifest()
+    summary = json.loads(next(tmp_path.glob("profile-library-*.json")).read_text())
+    assert {"create", "attach", "export", "download"} <= set(summary["phases"])
+    assert summary["phases"]["create"]["count"] == 1
+    assert summary["peak_memory_bytes"] > 0
+    assert next(tmp_path.glob("profile-library-*.pstats")).stat().st_size > 0
+    assert "cumulative" in next(tmp_path.glob("profile-library-*.txt")).read_text()
+    monkeypatch.setattr(profiling, "log_directory", lambda: tmp_path.joinpath("logs"))
+    result = CliRunner().invoke(cli, ["--profile", "bench", "--stub", "--samples", "1"])
+    assert result.exit_code == 0, result.output
+    summary = json.loads(next(tmp_path.glob("logs/profile-bench-*.json")).read_text())
+    assert summary["phases"]["token"]["count"] >= 1
+    assert profiling.active_profile() is None
+
+
+def test_trace_spans_linked_by_allocation(tmp_path, monkeypatch):
+    """Test that manifest phases are written as Chrome trace events tagged with the allocation."""
+    monkeypatch.chdir(tmp_path)
+    trace_file = tmp_path / "trace.json"
+    try:
+        with RhsmStubServer() as stub:
+            manifester = Manifester(
+                manifest_category=stub.manifest_category(username_prefix="trace"),
+                trace_file=str(trace_file),
+            )
+            manifest = manifester.get_manifest()
+    finally:
+        tracing.stop()
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    names = {event["name"] for event in events}
+    assert {
+        "token",
+        "get_manifest",
+        "create",
+        "process_subscription_pools",
+        "export",
+        "download",
+    } <= names
+    allocation_events = [event for event in events if event["name"] != "token"]
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+    assert all(event["args"]["allocation_uuid"] == manifest.uuid for event in allocation_events)
+    pools = [event for event in events if event["name"] == "process_subscription_pools"]
+    assert len(pools) == len(manifester.subscription_data)
+    assert tracing.active_tracer() is None
+
+
+def test_lost_create_and_attach_responses_are_not_repeated(tmp_path, monkeypatch):
+    """Test that allocations and attachments made by failed requests are adopted, not duplicated."""
+    monkeypatch.chdir(tmp_path)
+    with RhsmStubServer(lost_responses=1.0) as stub:
+        manifester = Manifester(manifest_category=stub.manifest_category(username_prefix="lost"))
+        manifester.get_manifest()
+        assert stub.requests["create_allocation"] == 1
+        assert stub.requests["attach"] == len(manifester.subscription_data)
+        (allocation,) = stub.allocations.values()
+        assert allocation["uuid"] == manifester.allocation_uuid
+        assert [e["entitlementQuantity"] for e in allocation["entitlements"]] == [1, 1]
+        manifester.delete_subscription_allocation()
+
+
+def test_scheduler_dispatches_by_priority_within_limits(tmp_path, monkeypatch):
+    """Test that waiting operations start by priority and that concurrency limits are kept."""
+    monkeypatch.chdir(tmp_path)
+    scheduler = Scheduler()
+    started = []
+    release = threading.Event()
+
+    def operation(priority, category, limits=(1, None, None)):
+        with scheduler.slot("create", priority=priority, category=category, limits=limits):
+            started.append(priority)
+            release.wait(5)
+
+    def submit(*args):
+        thread = threading.Thread(target=operation, args=args)
+        thread.start()
+        return thread
+
+    threads = [submit("normal", "golden_ticket")]
+    while not started:
+        time.sleep(0.01)
+    for number, priority in enumerate(("background", "normal", "interactive"), start=1):
+        threads.append(submit(priority, "golden_ticket"))
+        while scheduler.waiting() < number:
+            time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert started == ["normal", "interactive", "normal", "background"]
+    # A category at its limit does not hold up operations of other categories
+    release.clear()
+    threads = [submit("normal", "golden_ticket", (None, 1, None))]
+    while scheduler.running(category="golden_ticket") < 1:
+        time.sleep(0.01)
+    threads.append(submit("interactive", "golden_ticket", (None, 1, None)))
+    threads.append(submit("background", "robottelo_automation", (None, 1, None)))
+    while scheduler.running(category="robottelo_automation") < 1:
+        time.sleep(0.01)
+    assert scheduler.waiting() == 1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert scheduler.running() == 0
+    # Manifester waits for slots for its operations once a limit is set
+    SCHEDULER.clear()
+    with RhsmStubServer() as stub:
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(username_prefix="scheduled"),
+            max_concurrent_operations=1,
+            priority="gating",
+        )
+        manifester.get_manifest()
+        manifester.delete_subscription_allocation()
+    assert SCHEDULER.dispatched["gating"] == len(SCHEDULED_OPERATIONS)
+
+
+def test_adaptive_concurrency_backs_off_and_probes_upward(tmp_path, monkeypatch):
+    """Test that the adaptive limit grows while healthy and halves once per congestion event."""
+    monkeypatch.chdir(tmp_path)
+    limiter = AdaptiveLimiter(initial=4, maximum=6)
+    for _ in range(40):
+        started = [limiter.acquire() for _ in range(limiter.metrics()["limit"])]
+        for start in started:
+            limiter.release(start)
+    assert limiter.metrics()["limit"] == 6
+    started = [limiter.acquire() for _ in range(3)]
+    limiter.release(started[0], congested=True)
+    # Requests sent before the decrease do not decrease the limit again
+    limiter.release(started[1], congested=True)
+    assert limiter.metrics()["limit"] == 3
+    assert limiter.metrics()["decreases"] == 1
+    limiter.release(started[2])
+    # Manifester requests share the limiter of their API and account
+    clear_limiters()
+    with RhsmStubServer(rate_limit=0.3, seed=1) as stub:
+        manifester = Manifester(
+            manifest_category=stub.manifest_category(
+                username_prefix="adaptive", adaptive_concurrency=True
+            )
+        )
+        manifester.get_manifest()
+        manifester.delete_subscription_allocation()
+        metrics = limiter_metrics()[(stub.allocations_url, None)]
+    assert metrics["decreases"] >= 1
+    assert metrics["in_flight"] == 0
+    assert metrics["limit"] >= 1
+
+
+def test_adaptive_concurrency_compares_latency_per_endpoint():
+    """Test that a slow endpoint does not decrease the limit unless it slows down itself."""
+    limiter = AdaptiveLimiter(initial=4)
+    for _ in range(10):
+        fast, slow = limiter.acquire(), limiter.acquire()
+        limiter.release(fast, endpoint="/allocations/{id}")
+        # Downloads take a second each, far longer than the other requests
+        limiter.release(slow - 1, endpoint="/allocations/{id}/export/{id}")
+    assert limiter.metrics()["decreases"] == 0
+    assert limiter.metrics()["limit"] == 4
+    limiter.release(limiter.acquire() - 1, endpoint="/allocations/{id}")
+    assert limiter.metrics()["decreases"] == 1
+
+
+def test_resume_manifest_from_journal_after_export_started(tmp_path, monkeypatch):
+    """Test that an unfinished manifest is resumed from its journal without repeating steps."""
+    monkeypatch.chdir(tmp_path)
+
+    class DiesWhilePolling:
+        is_mock = False
+
+        def __init__(self):
+            self.requester = requests
+            self.died = False
+
+        def get(self, url, **kwargs):
+            if "/exportJob/" in url and not self.died:
+                self.died = True
+                raise requests.ConnectionError("process died")
+            return self.requester.get(url, **kwargs)
+
+        def post(self, url, **kwargs):
+            return self.requester.post(url, **kwargs)
+
+    with RhsmStubServer(export_polls=2) as stub:
+        category = stub.manifest_category(username_prefix="resumed", journal=True)
+        manifester = Manifester(manifest_category=category, requester=DiesWhilePolling())
+        with pytest.raises(requests.ConnectionError):
+            manifester.get_manifest()
+        (journal,) = load_journals([manifester.allocation_name])
+        assert journal.step == "exporting"
+        assert len(journal.entry["attachments"]) == len(category["subscription_data"])
+        resumed = Manifester(manifest_category=category, allocation_name=manifester.allocation_name)
+        # Only one resumer at a time can claim the journal
+        journal.claim()
+        with pytest.raises(JournalInUse):
+            resumed.resume_manifest()
+        journal.release()
+        manifest = resumed.resume_manifest()
+        assert manifest.uuid == manifester.allocation_uuid
+        assert manifest.path.exists()
+        assert (stub.requests["create_allocation"], stub.requests["export"]) == (1, 1)
+        assert stub.requests["attach"] == len(category["subscription_data"])
+        assert not load_journals([manifester.allocation_name])
+        resumed.delete_subscription_allocation()
+        manifest.path.unlink()
+
+
+def test_journal_lock_file_only_removed_by_its_holder(tmp_path, monkeypatch):
+    """Test that a held journal lock survives a discard and that removed lock files are relocked."""
+    holder = AllocationJournal.start("1234", "test_user-locked", directory=tmp_path)
+    lock_path = tmp_path / "1234.lock"
+    discard_journal("1234", directory=tmp_path)
+    assert lock_path.exists()
+    assert not AllocationJournal(tmp_path / "1234.json", dict(holder.entry))._lock_claim()
+    holder.discard()
+    assert not lock_path.exists()
+    # A lock file removed between opening and locking it is locked again at its new inode
+    lock_path.touch()
+    flock = journal.fcntl.flock
+    calls = []
+
+    def _flock_after_removal(lock_file, operation):
+        if not calls:
+            lock_path.unlink()
+        calls.append(lock_file)
+        return flock(lock_file, operation)
+
+    monkeypatch.setattr(journal.fcntl, "flock", _flock_after_removal)
+    lock_file = journal._lock_file(lock_path)
+    assert len(calls) == 2
+    assert os.fstat(lock_file.fileno()).st_ino == lock_path.stat().st_ino
+    lock_file.close()
+
+
+def test_load_test_reports_throughput_and_phase_latency(tmp_path, monkeypatch):
+    """Test that the load test runs concurrent cycles against the stub and reports on them."""
+    monkeypatch.chdir(tmp_path)
+    inventory_path = helpers.settings.inventory_path
+    report = loadtest.run_load_test(workers=3, iterations=6)
+    assert report["manifests"] == 6
+    assert not report["errors"]
+    assert report["manifests_per_minute"] > 0
+    assert report["token_requests"] >= 6
+    assert {"get_manifest", "create", "attach", "export", "download", "delete"} <= set(
+        report["phases"]
+    )
+    assert report["cycle"][50] <= report["cycle"][99]
+    assert helpers.settings.inventory_path == inventory_path
+    assert not list(Path("manifests").glob("load*_manifest.zip"))
+    assert tracing.active_tracer() is None
+    assert any(line.startswith("6 manifests") for line in loadtest.format_report(report))
+
+
 def test_invalid_sat_version():
     """Test that an invalid sat_version value will be replaced with the latest valid sat_version."""
     MANIFEST_DATA["sat_version"] = "sat-6.20"